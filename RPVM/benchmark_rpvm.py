@@ -0,0 +1,132 @@
+"""
+RPVM离线吞吐基准
+回放录制好的cassette(见rpvm_config中的cassette_mode), 不需要网络和检索索引,
+报告问题吞吐(questions/sec)、每个问题各阶段的LLM调用次数、检索次数以及问题延迟的p50/p95
+
+录制cassette(真实运行一次):
+python run_rpvm_exp.py --dataset_name hotpotqa --split test --gpu_id 0 --num_samples 50 --record_cassette output/hotpotqa.cassette.jsonl
+
+使用方法:
+python benchmark_rpvm.py --cassette output/hotpotqa.cassette.jsonl --scheduler async --concurrency 16 \
+    --llm_latency 0.8 --latency_dist lognormal --latency_spread 0.5 --output benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 添加flashRAG路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flashrag.config import Config
+from flashrag.dataset import Dataset
+from rpvm_pipeline import RPVMPipeline
+
+
+def run_benchmark(config, cassette_path: str, scheduler: str = "sequential", concurrency: int = 8,
+                  llm_latency: Optional[Dict] = None, retrieval_latency: Optional[Dict] = None) -> Dict:
+    """
+    以回放模式对cassette中的所有问题运行RPVMPipeline.run, 返回吞吐和延迟统计
+    config中的其他rpvm_config参数需要与录制时一致, 否则请求无法在cassette中找到
+    """
+    rpvm_config = dict(config["rpvm_config"])
+    rpvm_config.update({
+        "cassette_mode": "replay",
+        "cassette_path": cassette_path,
+        "scheduler": scheduler,
+        "replay_concurrency": concurrency,
+        "replay_latency": {"llm": llm_latency or {}, "retrieval": retrieval_latency or {}},
+    })
+    config["rpvm_config"] = rpvm_config
+    config["save_dir"] = tempfile.mkdtemp()
+    config["save_intermediate_data"] = True
+
+    pipeline = RPVMPipeline(config)
+    dataset = Dataset(config=config, data=pipeline.cassette.questions)
+
+    start_time = time.perf_counter()
+    pipeline.run(dataset, do_eval=False)
+    elapsed = time.perf_counter() - start_time
+
+    with open(os.path.join(config["save_dir"], "intermediate_data.jsonl"), "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+
+    report = summarize_records(records, elapsed)
+    report.update({"scheduler": scheduler, "concurrency": concurrency,
+                   "llm_latency": llm_latency or {}, "retrieval_latency": retrieval_latency or {}})
+    return report
+
+
+def summarize_records(records: List[Dict], elapsed: float) -> Dict:
+    """根据中间数据统计吞吐、每个问题的调用次数和延迟分位数"""
+    num_questions = len(records)
+    llm_calls = defaultdict(int)
+    for record in records:
+        for stage, calls in record["llm_calls"].items():
+            llm_calls[stage] += calls
+    latencies = [record["wall_time"] for record in records]
+
+    return {
+        "questions": num_questions,
+        "elapsed_seconds": elapsed,
+        "questions_per_second": num_questions / elapsed if elapsed > 0 else 0.0,
+        "llm_calls_per_question": {stage: calls / num_questions for stage, calls in sorted(llm_calls.items())},
+        "retrievals_per_question": sum(record["total_retrievals"] for record in records) / num_questions,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def print_report(report: Dict):
+    print("=" * 60)
+    print(f"Scheduler: {report['scheduler']}, stand-in concurrency: {report['concurrency']}")
+    print(f"Questions: {report['questions']}, elapsed: {report['elapsed_seconds']:.2f}s")
+    print(f"Throughput: {report['questions_per_second']:.3f} questions/sec")
+    print(f"Question latency: p50 {report['latency_p50']:.3f}s, p95 {report['latency_p95']:.3f}s")
+    print(f"Retrievals per question: {report['retrievals_per_question']:.2f}")
+    print("LLM calls per question:")
+    for stage, calls in report["llm_calls_per_question"].items():
+        print(f"  {stage:<20} {calls:.2f}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RPVM throughput benchmark against a recorded cassette")
+    parser.add_argument("--cassette", type=str, required=True, help="Cassette file recorded with cassette_mode: record")
+    parser.add_argument("--config_file", type=str, default=os.path.join(os.path.dirname(__file__), "rpvm_config.yaml"),
+                        help="Config used for the recording run")
+    parser.add_argument("--scheduler", type=str, default="sequential", choices=["sequential", "batched", "async"])
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Number of requests the stand-in LLM serves at the same time")
+    parser.add_argument("--latency_dist", type=str, default="constant", choices=["constant", "uniform", "lognormal"])
+    parser.add_argument("--llm_latency", type=float, default=0.0, help="Mean simulated latency of one LLM request (s)")
+    parser.add_argument("--latency_spread", type=float, default=0.0,
+                        help="Half width for uniform, log standard deviation for lognormal")
+    parser.add_argument("--retrieval_latency", type=float, default=0.0,
+                        help="Simulated latency of one batch_search call (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    config = Config(config_file_path=args.config_file, config_dict={"disable_save": True})
+    report = run_benchmark(
+        config, args.cassette, scheduler=args.scheduler, concurrency=args.concurrency,
+        llm_latency={"distribution": args.latency_dist, "mean": args.llm_latency,
+                     "spread": args.latency_spread, "seed": args.seed},
+        retrieval_latency={"mean": args.retrieval_latency},
+    )
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
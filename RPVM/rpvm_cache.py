@@ -0,0 +1,94 @@
+"""
+RPVM验证结果缓存
+以 (规范化的plan文本, 检索到的文档id序列, 验证器模型, 验证器温度) 为键,
+缓存 (verdict, corrected_plan, evidence), 避免重复调用验证器LLM
+"""
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class VerificationCache:
+    """
+    两级验证缓存: 内存中的LRU + 可选的SQLite磁盘层(跨运行保留)
+    内存未命中时查询磁盘层, 命中后回填到内存; 写入时两层同时写入
+    """
+
+    def __init__(self, max_size: int = 10000, cache_path: Optional[str] = None):
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.memory_cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.db = None
+        if cache_path is not None:
+            cache_dir = os.path.dirname(cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(cache_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS verification (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.commit()
+
+    @staticmethod
+    def normalize_plan(plan: str) -> str:
+        """规范化plan文本: 小写, 合并空白, 去掉首尾标点"""
+        plan = re.sub(r"\s+", " ", plan.lower()).strip()
+        return plan.strip(" .;:!?\"'")
+
+    @staticmethod
+    def doc_key(doc: Dict) -> str:
+        """文档标识: 优先使用id, 没有id时使用内容的哈希"""
+        if doc.get("id") is not None:
+            return str(doc["id"])
+        contents = doc.get("contents", doc.get("text", ""))
+        return hashlib.sha1(contents.encode("utf-8")).hexdigest()
+
+    def make_key(self, plan: str, docs: List[Dict], model: str, temperature: float) -> str:
+        key_items = [self.normalize_plan(plan), [self.doc_key(doc) for doc in docs], model, temperature]
+        return hashlib.sha1(json.dumps(key_items, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str]]:
+        with self._lock:
+            if key in self.memory_cache:
+                self.memory_cache.move_to_end(key)
+                self.hits += 1
+                return self.memory_cache[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value FROM verification WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = tuple(json.loads(row[0]))
+                    self._put_memory(key, value)
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Tuple[str, str, str]):
+        with self._lock:
+            self._put_memory(key, tuple(value))
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO verification (key, value) VALUES (?, ?)",
+                    (key, json.dumps(list(value), ensure_ascii=False)),
+                )
+                self.db.commit()
+
+    def _put_memory(self, key, value):
+        self.memory_cache[key] = value
+        self.memory_cache.move_to_end(key)
+        while len(self.memory_cache) > self.max_size:
+            self.memory_cache.popitem(last=False)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,208 @@
+"""
+RPVM请求录制/回放
+录制模式: 包装真实的生成器和检索器, 把每个LLM请求/响应和检索结果写入cassette文件(JSONL)
+回放模式: 用本地替身按请求内容返回录制的响应, 并按配置的延迟分布模拟耗时和服务端并发上限,
+无需网络和索引即可测量RPVMPipeline的吞吐
+"""
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class Cassette:
+    """
+    录制的请求/响应
+    每行一条记录: {'kind': 'llm' | 'retrieval' | 'question', 'key': 请求键, 'response': 响应}
+    相同的请求可能被录制多次(如采样温度>0), 回放时按录制顺序依次返回, 用完后重复最后一个
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = defaultdict(list)
+        self.questions = []
+        self._replay_counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def llm_key(messages: List[Dict], params: Dict) -> str:
+        return hashlib.sha1(json.dumps([messages, sorted(params.items())], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def retrieval_key(query: str, num: int) -> str:
+        return hashlib.sha1(json.dumps([query, num], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        cassette = cls(path)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["kind"] == "question":
+                    cassette.questions.append(record["item"])
+                else:
+                    cassette.responses[(record["kind"], record["key"])].append(record["response"])
+        return cassette
+
+    def _append(self, record: Dict):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record(self, kind: str, key: str, response):
+        self.responses[(kind, key)].append(response)
+        self._append({"kind": kind, "key": key, "response": response})
+
+    def record_question(self, item: Dict):
+        self.questions.append(item)
+        self._append({"kind": "question", "item": item})
+
+    def replay(self, kind: str, key: str):
+        with self._lock:
+            responses = self.responses.get((kind, key))
+            if not responses:
+                raise KeyError(f"{kind} request not found in cassette {self.path}")
+            idx = min(self._replay_counts[(kind, key)], len(responses) - 1)
+            self._replay_counts[(kind, key)] += 1
+            return responses[idx]
+
+
+class LatencyModel:
+    """
+    回放时每个请求的模拟延迟(秒)
+    distribution: constant(固定为mean) | uniform(mean±spread) | lognormal(均值为mean, spread为对数标准差)
+    """
+
+    def __init__(self, distribution: str = "constant", mean: float = 0.0, spread: float = 0.0, seed: int = 0):
+        if distribution not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        if self.mean <= 0 or self.distribution == "constant":
+            return max(self.mean, 0.0)
+        with self._lock:
+            if self.distribution == "uniform":
+                return float(self.rng.uniform(max(self.mean - self.spread, 0.0), self.mean + self.spread))
+            return float(self.rng.lognormal(np.log(self.mean) - self.spread ** 2 / 2, self.spread))
+
+
+class RecordingGenerator:
+    """包装真实生成器, 把每个请求和响应写入cassette"""
+
+    def __init__(self, generator, cassette: Cassette):
+        self.generator = generator
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        return getattr(self.generator, name)
+
+    def generate(self, input_list, **params):
+        outputs = self.generator.generate(input_list, **params)
+        for messages, output in zip(input_list, outputs):
+            self.cassette.record("llm", Cassette.llm_key(messages, params), output)
+        return outputs
+
+    async def _generate_async(self, input_list, **params):
+        if hasattr(self.generator, "_generate_async"):
+            outputs = await self.generator._generate_async(input_list, **params)
+        else:
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.generator.generate(input_list, **params)
+            )
+        for messages, output in zip(input_list, outputs):
+            self.cassette.record("llm", Cassette.llm_key(messages, params), output)
+        return outputs
+
+
+class RecordingRetriever:
+    """包装真实检索器, 把每个查询的检索结果写入cassette"""
+
+    def __init__(self, retriever, cassette: Cassette):
+        self.retriever = retriever
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        return getattr(self.retriever, name)
+
+    def batch_search(self, query_list, num=None, **kwargs):
+        results = self.retriever.batch_search(query_list, num=num, **kwargs)
+        for query, docs in zip(query_list, results):
+            self.cassette.record("retrieval", Cassette.retrieval_key(query, num), list(docs))
+        return results
+
+
+class ReplayGenerator:
+    """
+    回放录制的LLM响应的生成器替身
+    同时处理的请求数不超过concurrency(模拟API并发上限), 每个请求按latency休眠
+    """
+
+    def __init__(self, cassette: Cassette, model_name: str, latency: Optional[LatencyModel] = None,
+                 concurrency: int = 8, tokenizer=None):
+        self.cassette = cassette
+        self.model_name = model_name
+        self.latency = latency or LatencyModel()
+        self.concurrency = concurrency
+        self.tokenizer = tokenizer if tokenizer is not None else self._load_tokenizer(model_name)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphores = {}
+
+    @staticmethod
+    def _load_tokenizer(model_name: str):
+        """与录制时一致使用tiktoken; 离线且没有缓存的编码文件时退化为按空白切分"""
+        try:
+            import tiktoken
+            return tiktoken.encoding_for_model(model_name)
+        except Exception:
+            warnings.warn("tiktoken encoding is not available offline, token counts fall back to whitespace split.")
+            return _WhitespaceTokenizer()
+
+    def _respond(self, messages, params):
+        time.sleep(self.latency.sample())
+        return self.cassette.replay("llm", Cassette.llm_key(messages, params))
+
+    def generate(self, input_list, **params):
+        return list(self._pool.map(lambda messages: self._respond(messages, params), input_list))
+
+    async def _generate_async(self, input_list, **params):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        semaphore = self._semaphores[loop]
+
+        async def respond(messages):
+            async with semaphore:
+                await asyncio.sleep(self.latency.sample())
+                return self.cassette.replay("llm", Cassette.llm_key(messages, params))
+
+        return list(await asyncio.gather(*[respond(messages) for messages in input_list]))
+
+
+class ReplayRetriever:
+    """回放录制的检索结果的检索器替身, 每次batch_search按latency休眠一次"""
+
+    def __init__(self, cassette: Cassette, latency: Optional[LatencyModel] = None):
+        self.cassette = cassette
+        self.latency = latency or LatencyModel()
+
+    def batch_search(self, query_list, num=None, **kwargs):
+        time.sleep(self.latency.sample())
+        return [self.cassette.replay("retrieval", Cassette.retrieval_key(query, num)) for query in query_list]
+
+
+class _WhitespaceTokenizer:
+    @staticmethod
+    def encode(text):
+        return text.split()
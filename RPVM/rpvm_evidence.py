@@ -0,0 +1,123 @@
+"""
+RPVM验证证据打包
+把检索文档切分成句子(复用ExtractiveRefiner的分句函数), 按与plan的相关度选取最好的句子,
+连同文档标题一起在token预算内组成验证器的证据, 代替直接拼接前5个文档的全文
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from flashrag.refiner import ExtractiveRefiner
+
+# 只在单字母缩写(如"U.S."、"J. Smith")后不切分; ExtractiveRefiner的默认规则在任何字母加句号后都不切分
+EVIDENCE_SPLIT_PATTERN = r"(?<!\b[A-Za-z]\.)(?<=[.!?])\s+"
+
+
+class EvidencePacker:
+    """
+    在token预算内打包验证证据
+    scorer: bm25(句子与plan的BM25词项重叠分数) | encoder(检索器稠密编码器向量的内积)
+    """
+
+    def __init__(self, tokenizer, encoder=None, k1: float = 1.2, b: float = 0.75):
+        self.tokenizer = tokenizer
+        self.encoder = encoder
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def format_docs(docs: List[Dict]) -> str:
+        """不打包时的证据格式: 文档全文依次编号"""
+        return "\n\n".join([
+            f"Document {i+1}: {doc.get('contents', doc.get('text', ''))}"
+            for i, doc in enumerate(docs)
+        ])
+
+    @staticmethod
+    def split_doc(doc: Dict) -> Tuple[str, List[str]]:
+        """按flashrag语料的约定, contents的第一行为标题, 其余为正文"""
+        contents = doc.get('contents', doc.get('text', ''))
+        title, _, text = contents.partition("\n")
+        return title.strip().strip('"'), ExtractiveRefiner.split_sentences(text, EVIDENCE_SPLIT_PATTERN)
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return re.findall(r"\w+", text.lower())
+
+    def bm25_scores(self, query: str, sentences: List[str]) -> List[float]:
+        """以候选句子为语料计算BM25分数"""
+        sentence_terms = [self._terms(sentence) for sentence in sentences]
+        avg_len = sum(len(terms) for terms in sentence_terms) / max(len(sentence_terms), 1)
+        doc_freq = Counter(term for terms in sentence_terms for term in set(terms))
+        query_terms = set(self._terms(query))
+
+        scores = []
+        for terms in sentence_terms:
+            term_freq = Counter(terms)
+            score = 0.0
+            for term in query_terms:
+                if term not in term_freq:
+                    continue
+                idf = math.log(1 + (len(sentences) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                tf = term_freq[term]
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * len(terms) / max(avg_len, 1)))
+            scores.append(score)
+        return scores
+
+    def encoder_scores(self, query: str, sentences: List[str]) -> List[float]:
+        query_emb = self.encoder.encode([query], is_query=True)
+        sentence_embs = self.encoder.encode(sentences, is_query=False)
+        return (query_emb @ sentence_embs.T)[0].tolist()
+
+    def pack(self, plan: str, docs: List[Dict], max_tokens: int) -> Tuple[str, Dict]:
+        """
+        打包证据: 全文已在预算内时保持原格式; 否则按分数从高到低选取句子直到预算用完,
+        每个文档选中的句子按原顺序排列, 以 "Document i (Title: ...): ..." 的格式输出
+
+        Returns:
+            (证据文本, {'original_tokens': 全文token数, 'packed_tokens': 打包后token数})
+        """
+        original = self.format_docs(docs)
+        original_tokens = len(self.tokenizer.encode(original))
+        if original_tokens <= max_tokens:
+            return original, {'original_tokens': original_tokens, 'packed_tokens': original_tokens}
+
+        titles = []
+        candidates = []  # (文档下标, 句子下标, 句子)
+        for doc_idx, doc in enumerate(docs):
+            title, sentences = self.split_doc(doc)
+            titles.append(title)
+            candidates.extend((doc_idx, sent_idx, sentence) for sent_idx, sentence in enumerate(sentences))
+        if not candidates:
+            return original, {'original_tokens': original_tokens, 'packed_tokens': original_tokens}
+
+        sentences = [sentence for _, _, sentence in candidates]
+        scores = self.encoder_scores(plan, sentences) if self.encoder is not None else self.bm25_scores(plan, sentences)
+
+        selected = []
+        selected_docs = set()
+        used_tokens = 0
+        for idx in np.argsort(scores, kind="stable")[::-1]:
+            doc_idx, _, sentence = candidates[idx]
+            # 每个新文档额外计入标题的开销
+            cost = len(self.tokenizer.encode(sentence)) + 1
+            if doc_idx not in selected_docs:
+                cost += len(self.tokenizer.encode(f"Document {doc_idx + 1} (Title: {titles[doc_idx]}):"))
+            if used_tokens + cost > max_tokens:
+                continue
+            selected.append(int(idx))
+            selected_docs.add(doc_idx)
+            used_tokens += cost
+
+        by_doc = {}
+        for idx in sorted(selected):
+            doc_idx, _, sentence = candidates[idx]
+            by_doc.setdefault(doc_idx, []).append(sentence)
+        packed = "\n\n".join([
+            f"Document {doc_idx + 1} (Title: {titles[doc_idx]}): {' '.join(doc_sentences)}"
+            for doc_idx, doc_sentences in sorted(by_doc.items())
+        ])
+        return packed, {'original_tokens': original_tokens, 'packed_tokens': len(self.tokenizer.encode(packed))}
@@ -0,0 +1,110 @@
+"""
+RPVM结构化记忆
+记忆以事实列表的形式保存, 每条事实带有按分词器精确计算的token数, 总token数增量维护。
+超出预算时先做确定性的压缩(去重、删除被后续纠正覆盖的事实), 仍然超出时才交给LLM摘要。
+"""
+import re
+from typing import Dict, List, Optional
+
+
+class FactMemory:
+    """
+    事实列表形式的记忆
+    每条事实: {'text': 事实文本, 'status': 'verified' / 'corrected' / 'summary',
+              'source': 被纠正的原始plan(仅corrected), 'tokens': 渲染后该行的token数}
+    render() 的输出与原先拼接字符串的记忆格式一致
+    """
+
+    def __init__(self, tokenizer, similarity_threshold: float = 0.9):
+        self.tokenizer = tokenizer
+        self.similarity_threshold = similarity_threshold
+        self.facts: List[Dict] = []
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self.facts)
+
+    @staticmethod
+    def _line(fact: Dict) -> str:
+        if fact['status'] == 'summary':
+            return fact['text']
+        return f"{fact['text']} ({fact['status']})"
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    def add(self, text: str, status: str, source: Optional[str] = None):
+        fact = {'text': text, 'status': status, 'source': source}
+        fact['tokens'] = self.count_tokens(self._line(fact))
+        self.facts.append(fact)
+        self.total_tokens += fact['tokens']
+
+    def render(self) -> str:
+        lines = [self._line(fact) for fact in self.facts]
+        if self.facts and self.facts[0]['status'] == 'summary':
+            return "\n".join(lines)
+        return "".join(f"\n{line}" for line in lines)
+
+    def render_selected(self, scores: List[float], top_k: int, max_tokens: int) -> str:
+        """
+        只渲染相关度最高的事实: 按分数从高到低选取至多top_k条, 且总token数不超过max_tokens,
+        选中的事实按原有顺序渲染
+        """
+        selected = []
+        used_tokens = 0
+        for idx in sorted(range(len(self.facts)), key=lambda i: scores[i], reverse=True):
+            if len(selected) >= top_k:
+                break
+            if used_tokens + self.facts[idx]['tokens'] > max_tokens:
+                continue
+            selected.append(idx)
+            used_tokens += self.facts[idx]['tokens']
+        return "".join(f"\n{self._line(self.facts[idx])}" for idx in sorted(selected))
+
+    def replace_with_summary(self, summary: str):
+        """用LLM摘要替换全部事实"""
+        self.facts = []
+        self.total_tokens = 0
+        self.add(summary, 'summary')
+
+    @staticmethod
+    def word_set(text: str) -> frozenset:
+        return frozenset(re.findall(r"\w+", text.lower()))
+
+    def _similar(self, a: frozenset, b: frozenset) -> bool:
+        """词集合的Jaccard相似度达到阈值即认为近似相同"""
+        if not a or not b:
+            return a == b
+        return len(a & b) / len(a | b) >= self.similarity_threshold
+
+    def compact(self) -> Dict[str, int]:
+        """
+        确定性压缩, 不调用LLM:
+        1. 删除被后续纠正覆盖的事实: 与某条之后的corrected事实的原始plan近似相同的事实
+        2. 去重: 与更早保留的事实近似相同的事实只保留第一条
+        返回 {'superseded': 删除数, 'deduplicated': 删除数}
+        """
+        words = [self.word_set(fact['text']) for fact in self.facts]
+        sources = [self.word_set(fact['source']) if fact['source'] else None for fact in self.facts]
+
+        superseded = set()
+        for later_idx, source in enumerate(sources):
+            if source is None:
+                continue
+            for idx in range(later_idx):
+                if self._similar(words[idx], source) or (sources[idx] is not None and self._similar(sources[idx], source)):
+                    superseded.add(idx)
+
+        kept = []
+        deduplicated = 0
+        for idx, fact in enumerate(self.facts):
+            if idx in superseded:
+                continue
+            if any(self._similar(words[idx], words[kept_idx]) for kept_idx in kept):
+                deduplicated += 1
+                continue
+            kept.append(idx)
+
+        self.facts = [self.facts[idx] for idx in kept]
+        self.total_tokens = sum(fact['tokens'] for fact in self.facts)
+        return {'superseded': len(superseded), 'deduplicated': deduplicated}
@@ -4,96 +4,602 @@ Reflective Plan-Verify Memory for Multi-hop QA
 
 基于FlashRAG框架实现RPVM方法
 """
+import os
 import json
 import re
+import asyncio
+import functools
+import inspect
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
+import numpy as np
+import tiktoken
 from tqdm import tqdm
 from flashrag.pipeline import BasicPipeline
 from flashrag.utils import get_retriever, get_generator
 from flashrag.prompt import PromptTemplate
+from rpvm_cache import VerificationCache
+from rpvm_memory import FactMemory
+from rpvm_evidence import EvidencePacker
+from rpvm_cassette import (
+    Cassette, LatencyModel, RecordingGenerator, RecordingRetriever, ReplayGenerator, ReplayRetriever
+)
 
 
 class RPVMPipeline(BasicPipeline):
     """
     RPVM Pipeline: Reflective Plan-Verify Memory
     核心流程: 反思规划 -> 检索验证 -> 记忆更新 -> 迭代
+
+    每个阶段(规划/检索/改写/验证/摘要/回答)都实现为生成器:
+    通过 yield 交出一个待执行的请求(LLM请求或检索请求), 由调度器执行后把结果 send 回来。
+    因此同一套逻辑既可以逐个问题顺序执行, 也可以跨问题合并成批执行。
     """
 
-    def __init__(self, config, prompt_template=None):
+    # 预算降级的步骤, 按预算用量依次触发
+    DEGRADATIONS = ['skip_rewrite', 'single_plan', 'no_summary', 'best_effort']
+
+    def __init__(self, config, prompt_template=None, retriever=None, generator=None):
         super().__init__(config, prompt_template)
-        
-        # 初始化检索器和生成器
-        self.retriever = get_retriever(config)
-        self.generator = get_generator(config)
-        
+
         # RPVM特定配置
         rpvm_config = config['rpvm_config'] if 'rpvm_config' in config else {}
+
+        # 请求录制/回放: record(录制真实请求到cassette) | replay(用cassette中的响应替代生成器和检索器)
+        self.cassette_mode = rpvm_config.get('cassette_mode', None) if isinstance(rpvm_config, dict) else None
+        self.cassette = None
+        if self.cassette_mode == 'replay':
+            self.cassette = Cassette.load(rpvm_config['cassette_path'])
+            latency = rpvm_config.get('replay_latency', {})
+            if retriever is None:
+                retriever = ReplayRetriever(self.cassette, LatencyModel(**latency.get('retrieval', {})))
+            if generator is None:
+                generator = ReplayGenerator(
+                    self.cassette, config['generator_model'],
+                    latency=LatencyModel(**latency.get('llm', {})),
+                    concurrency=rpvm_config.get('replay_concurrency', 8),
+                )
+
+        # 初始化检索器和生成器
+        self.retriever = get_retriever(config) if retriever is None else retriever
+        self.generator = get_generator(config) if generator is None else generator
+
+        if self.cassette_mode == 'record':
+            cassette_dir = os.path.dirname(rpvm_config['cassette_path'])
+            if cassette_dir:
+                os.makedirs(cassette_dir, exist_ok=True)
+            self.cassette = Cassette(rpvm_config['cassette_path'])
+            self.retriever = RecordingRetriever(self.retriever, self.cassette)
+            self.generator = RecordingGenerator(self.generator, self.cassette)
+
         self.max_iter = rpvm_config.get('max_iter', 5) if isinstance(rpvm_config, dict) else 5
         self.max_retrieval_attempts = rpvm_config.get('max_retrieval_attempts', 2) if isinstance(rpvm_config, dict) else 2
         self.retrieval_topk = rpvm_config.get('retrieval_topk', 5) if isinstance(rpvm_config, dict) else 5
         self.memory_max_tokens = rpvm_config.get('memory_max_tokens', 3000) if isinstance(rpvm_config, dict) else 3000
         self.enable_memory_summary = rpvm_config.get('enable_memory_summary', True) if isinstance(rpvm_config, dict) else True
+        # 每轮结束时对记忆做确定性压缩(去重/删除被纠正覆盖的事实), 仍超出memory_max_tokens时才调用LLM摘要
+        self.memory_compaction = rpvm_config.get('memory_compaction', True) if isinstance(rpvm_config, dict) else True
+        self.memory_similarity_threshold = rpvm_config.get('memory_similarity_threshold', 0.9) if isinstance(rpvm_config, dict) else 0.9
+        # planner prompt中的记忆: full(全部事实) | relevant(按与问题的相关度选取top-k事实, 且不超过token预算)
+        self.memory_injection = rpvm_config.get('memory_injection', 'full') if isinstance(rpvm_config, dict) else 'full'
+        self.memory_injection_topk = rpvm_config.get('memory_injection_topk', 10) if isinstance(rpvm_config, dict) else 10
+        self.memory_injection_max_tokens = rpvm_config.get('memory_injection_max_tokens', 1000) if isinstance(rpvm_config, dict) else 1000
         self.planner_temperature = rpvm_config.get('planner_temperature', 0.7) if isinstance(rpvm_config, dict) else 0.7
         self.verifier_temperature = rpvm_config.get('verifier_temperature', 0.3) if isinstance(rpvm_config, dict) else 0.3
         self.final_answer_temperature = rpvm_config.get('final_answer_temperature', 0.5) if isinstance(rpvm_config, dict) else 0.5
-        
-        # 用于记录中间数据
-        self.intermediate_data = []
+        # 调度方式: sequential(逐个问题) | batched(跨问题按步合批) | async(每个问题一个协程)
+        self.scheduler = rpvm_config.get('scheduler', 'sequential') if isinstance(rpvm_config, dict) else 'sequential'
+        self.max_active_questions = rpvm_config.get('max_active_questions', 64) if isinstance(rpvm_config, dict) else 64
+        # 是否并发验证一轮中的所有plan(按plan顺序提交结果)
+        self.parallel_verification = rpvm_config.get('parallel_verification', False) if isinstance(rpvm_config, dict) else False
+        # 验证方式: single(每个plan一次验证请求) | multi_claim(一轮所有plan共享证据池, 一次验证请求)
+        self.verification_mode = rpvm_config.get('verification_mode', 'single') if isinstance(rpvm_config, dict) else 'single'
+        # 记忆非空时与planner并发推测生成最终答案, planner返回ANSWER_READY时省去一次LLM往返
+        self.speculative_answer = rpvm_config.get('speculative_answer', False) if isinstance(rpvm_config, dict) else False
+        # 验证证据打包: 每次验证的文档证据超过evidence_max_tokens时, 按与plan的相关度选取句子(连同标题)直到预算用完
+        # evidence_scorer: bm25(词项重叠) | encoder(检索器的稠密编码器, 检索器没有编码器时退回bm25)
+        self.evidence_max_tokens = rpvm_config.get('evidence_max_tokens', None) if isinstance(rpvm_config, dict) else None
+        self.evidence_scorer = rpvm_config.get('evidence_scorer', 'bm25') if isinstance(rpvm_config, dict) else 'bm25'
+        self._evidence_packer = None
+        # 单个问题的预算(None表示不限): LLM token数 / LLM调用次数 / 耗时(秒)
+        self.budget_max_tokens = rpvm_config.get('budget_max_tokens', None) if isinstance(rpvm_config, dict) else None
+        self.budget_max_calls = rpvm_config.get('budget_max_calls', None) if isinstance(rpvm_config, dict) else None
+        self.budget_max_seconds = rpvm_config.get('budget_max_seconds', None) if isinstance(rpvm_config, dict) else None
+        # 预算用量达到各阈值时依次降级: 不再改写查询 -> 每轮只验证第一个plan -> 关闭摘要 -> 直接生成尽力回答
+        self.budget_degrade_thresholds = rpvm_config.get('budget_degrade_thresholds', [0.6, 0.75, 0.9, 1.0]) \
+            if isinstance(rpvm_config, dict) else [0.6, 0.75, 0.9, 1.0]
+        self.use_budget = any(
+            budget is not None for budget in (self.budget_max_tokens, self.budget_max_calls, self.budget_max_seconds)
+        )
+        # async调度时的并发上限: 同时在途的LLM请求数 / 检索请求数(检索在线程池中执行)
+        self.max_concurrent_requests = rpvm_config.get('max_concurrent_requests', 64) if isinstance(rpvm_config, dict) else 64
+        self.max_concurrent_retrievals = rpvm_config.get('max_concurrent_retrievals', 4) if isinstance(rpvm_config, dict) else 4
+        # 验证结果缓存: 内存LRU + 可选的磁盘层
+        self.use_verification_cache = rpvm_config.get('verification_cache', False) if isinstance(rpvm_config, dict) else False
+        if self.use_verification_cache:
+            self.verification_cache = VerificationCache(
+                max_size=rpvm_config.get('verification_cache_size', 10000),
+                cache_path=rpvm_config.get('verification_cache_path', None),
+            )
+        else:
+            self.verification_cache = None
+
+        # 记忆token计数使用的分词器, 首次使用时加载
+        self._tokenizer = None
+        # 生成器能返回API的token用量(usage)时, 各阶段token数优先使用usage, 否则用分词器估计
+        self._generator_returns_usage = 'return_usage' in inspect.signature(self.generator.generate).parameters
+
 
-    def run(self, dataset, do_eval=True, pred_process_fun=None):
+    def run(self, dataset, do_eval=True, pred_process_fun=None, resume=False):
         """
         对整个数据集运行RPVM pipeline
+        resume=True 时读取save_dir下已有的intermediate_data.jsonl, 跳过已完成的问题id
         """
-        pred_answer_list = []
-        
-        for item in tqdm(dataset, desc="RPVM Processing"):
-            question = item.question
-            
-            # 运行RPVM单个样本
-            result = self._run_single_question(question)
-            
-            pred_answer_list.append(result['final_answer'])
-            
-            # 保存中间数据
-            if self.config['save_intermediate_data']:
-                self.intermediate_data.append({
-                    'question': question,
-                    'iterations': result['iterations'],
-                    'final_memory': result['final_memory'],
-                    'final_answer': result['final_answer'],
-                    'total_retrievals': result['total_retrievals']
-                })
-        
+        if self.scheduler == 'async':
+            return asyncio.run(self.arun(dataset, do_eval=do_eval, pred_process_fun=pred_process_fun, resume=resume))
+
+        final_answers, todo_items = self._prepare_run(dataset, resume)
+
+        if self.scheduler == 'batched':
+            self._run_batched(
+                [item.question for item in todo_items],
+                on_done=lambda idx, result: self._record_result(final_answers, todo_items[idx], result)
+            )
+        else:
+            for item in tqdm(todo_items, desc="RPVM Processing"):
+                self._record_result(final_answers, item, self._run_single_question(item.question))
+
+        return self._finish_run(dataset, final_answers, do_eval=do_eval, pred_process_fun=pred_process_fun)
+
+    async def arun(self, dataset, do_eval=True, pred_process_fun=None, resume=False):
+        """
+        对整个数据集异步运行RPVM pipeline
+        每个问题一个协程, 直接await生成器的异步接口; 全局信号量限制在途的LLM请求数,
+        检索请求交给线程池执行, 并由单独的信号量限制并发。
+        用法: asyncio.run(pipeline.arun(dataset))
+        """
+        final_answers, todo_items = self._prepare_run(dataset, resume)
+
+        self._llm_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._retrieval_semaphore = asyncio.Semaphore(self.max_concurrent_retrievals)
+        self._retrieval_pool = ThreadPoolExecutor(max_workers=self.max_concurrent_retrievals)
+        pbar = tqdm(total=len(todo_items), desc="RPVM Processing")
+
+        async def run_question(item):
+            result = await self._arun_steps(self._question_steps(item.question))
+            self._record_result(final_answers, item, result)
+            pbar.update(1)
+
+        try:
+            await asyncio.gather(*[run_question(item) for item in todo_items])
+        finally:
+            pbar.close()
+            self._retrieval_pool.shutdown()
+
+        return self._finish_run(dataset, final_answers, do_eval=do_eval, pred_process_fun=pred_process_fun)
+
+    def _prepare_run(self, dataset, resume=False):
+        """
+        准备一次运行: 返回 ({问题id: 最终答案}, 待处理的样本列表)
+        续跑时已完成问题的答案从中间数据文件读取; 否则清空旧的中间数据文件
+        """
+        final_answers = {}
+        if resume:
+            final_answers = {
+                record['id']: record['final_answer'] for record in self._load_intermediate_data()
+            }
+            print(f"Resuming: {len(final_answers)} questions already done")
+        elif self.config['save_intermediate_data']:
+            os.makedirs(self.config['save_dir'], exist_ok=True)
+            open(self._intermediate_data_path(), 'w', encoding='utf-8').close()
+
+        todo_items = [item for item in dataset if self._question_key(item) not in final_answers]
+        if self.cassette_mode == 'record':
+            # 续跑时追加到已录制的cassette, 否则清空旧的录制
+            if not resume:
+                open(self.cassette.path, 'w', encoding='utf-8').close()
+            # 问题也写入cassette, 回放时无需原始数据集
+            for item in todo_items:
+                self.cassette.record_question(
+                    {'id': item.id, 'question': item.question, 'golden_answers': item.golden_answers}
+                )
+        # 本次运行的推测生成token统计和各降级步骤的触发次数
+        self.speculation_totals = {'speculative_tokens': 0, 'wasted_tokens': 0}
+        self.degradation_totals = {name: 0 for name in self.DEGRADATIONS}
+        self.evidence_totals = {'packed_calls': 0, 'original_tokens': 0, 'packed_tokens': 0}
+        return final_answers, todo_items
+
+    def _record_result(self, final_answers: Dict, item, result: Dict):
+        """问题完成时调用: 记录最终答案, 并把该问题的中间数据立即追加写入文件"""
+        question_key = self._question_key(item)
+        final_answers[question_key] = result['final_answer']
+        if 'speculation' in result['stats']:
+            for key in self.speculation_totals:
+                self.speculation_totals[key] += result['stats']['speculation'][key]
+        if 'degradations' in result['stats']:
+            for key in self.degradation_totals:
+                self.degradation_totals[key] += result['stats']['degradations'][key]
+        if 'evidence' in result['stats']:
+            for key in self.evidence_totals:
+                self.evidence_totals[key] += result['stats']['evidence'][key]
+
+        if self.config['save_intermediate_data']:
+            self._append_intermediate_data({
+                'id': question_key,
+                'question': item.question,
+                'iterations': result['iterations'],
+                'final_memory': result['final_memory'],
+                'final_answer': result['final_answer'],
+                'total_retrievals': result['total_retrievals'],
+                **result['stats']
+            })
+
+    def _finish_run(self, dataset, final_answers: Dict, do_eval=True, pred_process_fun=None):
+        """按数据集顺序收集最终答案并评估"""
+        pred_answer_list = [final_answers[self._question_key(item)] for item in dataset]
+
+        if self.verification_cache is not None:
+            print(f"Verification cache: {self.verification_cache.hits} hits, {self.verification_cache.misses} misses")
+        if self.speculative_answer:
+            print(f"Speculative answer: wasted token ratio "
+                  f"{self._wasted_token_ratio(self.speculation_totals):.3f} "
+                  f"({self.speculation_totals['wasted_tokens']}/{self.speculation_totals['speculative_tokens']})")
+        if self.use_budget:
+            print("Budget degradations: " + ", ".join(f"{k} {v}" for k, v in self.degradation_totals.items()))
+        if self.evidence_max_tokens is not None:
+            print(f"Evidence packing: {self.evidence_totals['packed_calls']} verifier calls, "
+                  f"{self.evidence_totals['original_tokens']} -> {self.evidence_totals['packed_tokens']} evidence tokens")
+
         # 更新数据集的预测结果
         dataset.update_output("pred", pred_answer_list)
-        
-        # 保存中间数据到文件
+
         if self.config['save_intermediate_data']:
-            self._save_intermediate_data()
-        
+            print(f"Intermediate data saved to: {self._intermediate_data_path()}")
+
         # 评估
         dataset = self.evaluate(dataset, do_eval=do_eval, pred_process_fun=pred_process_fun)
-        
+
         return dataset
 
     def _run_single_question(self, question: str) -> Dict:
         """
         对单个问题运行RPVM流程
-        
+
         Returns:
             包含最终答案、记忆、迭代历史等信息的字典
         """
-        memory = ""
+        return self._run_steps(self._question_steps(question))
+
+    def _run_steps(self, steps):
+        """顺序驱动一个阶段生成器: 每个请求单独执行, 直到生成器返回结果"""
+        finished, request = self._step(steps)
+        while not finished:
+            finished, request = self._step(steps, self._execute_request(request))
+        return request
+
+    def _run_batched(self, questions: List[str], on_done=None) -> List[Dict]:
+        """
+        跨问题的按步合批调度
+        每个问题是一个状态机(规划 -> 验证plan i -> 摘要 -> 回答), 每一轮(tick)收集所有活跃问题的待执行请求,
+        LLM请求合并为一次generate调用, 检索请求合并为一次batch_search调用, 再把结果分发回各自的问题。
+        同时活跃的问题数由max_active_questions限制, 完成一个补充一个。
+        提供on_done(idx, result)时每个问题完成即回调, 不再保留结果; 否则返回按问题顺序的结果列表。
+        """
+        results = [None] * len(questions)
+
+        def finish(idx, result):
+            if on_done is None:
+                results[idx] = result
+            else:
+                on_done(idx, result)
+        active = {}  # question idx -> (steps, pending request)
+        next_idx = 0
+        pbar = tqdm(total=len(questions), desc="RPVM Processing")
+
+        while next_idx < len(questions) or active:
+            # 补充新问题, 直到活跃问题数达到上限
+            while next_idx < len(questions) and len(active) < self.max_active_questions:
+                steps = self._question_steps(questions[next_idx])
+                finished, request = self._step(steps)
+                if finished:
+                    finish(next_idx, request)
+                    pbar.update(1)
+                else:
+                    active[next_idx] = (steps, request)
+                next_idx += 1
+
+            # 展平所有活跃问题的请求, 一次执行
+            pending = {q_idx: request for q_idx, (_, request) in active.items()}
+            flat_requests, spans = self._flatten_requests(pending)
+            responses = self._split_responses(pending, spans, self._execute_requests(flat_requests))
+
+            for q_idx in list(active.keys()):
+                steps, _ = active[q_idx]
+                finished, request = self._step(steps, responses[q_idx])
+                if finished:
+                    finish(q_idx, request)
+                    del active[q_idx]
+                    pbar.update(1)
+                else:
+                    active[q_idx] = (steps, request)
+
+        pbar.close()
+        return results
+
+    async def _arun_steps(self, steps):
+        """异步驱动一个阶段生成器: 一组请求并发执行"""
+        finished, request = self._step(steps)
+        while not finished:
+            if isinstance(request, list):
+                response = await self._aexecute_requests(request)
+            else:
+                response = await self._aexecute_request(request)
+            finished, request = self._step(steps, response)
+        return request
+
+    async def _aexecute_requests(self, requests: List[Dict]) -> List:
+        """异步执行一组请求: LLM请求各自并发, 检索请求合并后在线程池中执行(合并为batch_search)"""
+        loop = asyncio.get_running_loop()
+        retrieval_idxs = [i for i, r in enumerate(requests) if r['type'] == 'retrieval']
+        llm_idxs = [i for i, r in enumerate(requests) if r['type'] != 'retrieval']
+
+        async def run_retrievals():
+            async with self._retrieval_semaphore:
+                return await loop.run_in_executor(
+                    self._retrieval_pool, self._execute_requests, [requests[i] for i in retrieval_idxs]
+                )
+
+        tasks = [self._aexecute_request(requests[i]) for i in llm_idxs]
+        if retrieval_idxs:
+            tasks.append(run_retrievals())
+        outputs = await asyncio.gather(*tasks)
+
+        responses = [None] * len(requests)
+        for idx, output in zip(llm_idxs, outputs):
+            responses[idx] = output
+        if retrieval_idxs:
+            for idx, output in zip(retrieval_idxs, outputs[-1]):
+                responses[idx] = output
+        return responses
+
+    async def _aexecute_request(self, request: Dict):
+        """异步执行单个请求: LLM请求直接await生成器的异步接口, 检索请求在线程池中执行"""
+        loop = asyncio.get_running_loop()
+        if request['type'] == 'llm':
+            params = dict(request['params'])
+            if self._generator_returns_usage:
+                params['return_usage'] = True
+            async with self._llm_semaphore:
+                if hasattr(self.generator, '_generate_async'):
+                    outputs = await self.generator._generate_async([request['messages']], **params)
+                else:
+                    outputs = await loop.run_in_executor(
+                        None, functools.partial(self.generator.generate, [request['messages']], **params)
+                    )
+            if self._generator_returns_usage:
+                outputs, usages = outputs
+                request['usage'] = usages[0]
+        else:
+            async with self._retrieval_semaphore:
+                outputs = await loop.run_in_executor(
+                    self._retrieval_pool,
+                    functools.partial(self.retriever.batch_search, [request['query']], num=request['num'])
+                )
+        return outputs[0]
+
+    @staticmethod
+    def _step(steps, response=None):
+        """推进生成器一步, 返回 (是否已结束, 下一个请求或最终结果)"""
+        try:
+            return False, steps.send(response)
+        except StopIteration as e:
+            return True, e.value
+
+    @staticmethod
+    def _flatten_requests(pending: Dict) -> Tuple[List[Dict], Dict]:
+        """把 {key: 请求或请求列表} 展平成一个请求列表, 并记录每个key对应的区间"""
+        flat_requests = []
+        spans = {}
+        for key, request in pending.items():
+            request_list = request if isinstance(request, list) else [request]
+            spans[key] = (len(flat_requests), len(request_list))
+            flat_requests.extend(request_list)
+        return flat_requests, spans
+
+    @staticmethod
+    def _split_responses(pending: Dict, spans: Dict, flat_responses: List) -> Dict:
+        """_flatten_requests 的逆操作: 把展平执行的结果按key拆回"""
+        responses = {}
+        for key, (start, length) in spans.items():
+            response = flat_responses[start: start + length]
+            responses[key] = response if isinstance(pending[key], list) else response[0]
+        return responses
+
+    @staticmethod
+    def _llm_request(stage: str, messages: List[Dict], **params) -> Dict:
+        return {'type': 'llm', 'stage': stage, 'messages': messages, 'params': params}
+
+    @staticmethod
+    def _retrieval_request(query: str, num: int) -> Dict:
+        return {'type': 'retrieval', 'stage': 'retrieval', 'query': query, 'num': num}
+
+    def _execute_request(self, request):
+        """执行单个请求(或一组请求)"""
+        if isinstance(request, list):
+            return self._execute_requests(request)
+        return self._execute_requests([request])[0]
+
+    def _execute_requests(self, requests: List[Dict]) -> List:
+        """
+        执行一组请求: 生成参数相同的LLM请求合并为一次generate, topk相同的检索请求合并为一次batch_search
+        多个组(如改写与验证、planner与推测答案)互不依赖, 在线程中并发执行, 而不是逐组阻塞
+        返回与requests顺序一致的结果列表
+        """
+        responses = [None] * len(requests)
+        groups = {}
+        for idx, request in enumerate(requests):
+            if request['type'] == 'llm':
+                key = ('llm',) + tuple(sorted(request['params'].items()))
+            else:
+                key = ('retrieval', request['num'])
+            groups.setdefault(key, []).append(idx)
+
+        def run_group(idxs):
+            first = requests[idxs[0]]
+            if first['type'] == 'llm':
+                params = dict(first['params'])
+                if self._generator_returns_usage:
+                    params['return_usage'] = True
+                outputs = self.generator.generate([requests[i]['messages'] for i in idxs], **params)
+                if self._generator_returns_usage:
+                    outputs, usages = outputs
+                    for idx, usage in zip(idxs, usages):
+                        requests[idx]['usage'] = usage
+                return outputs
+            return self.retriever.batch_search([requests[i]['query'] for i in idxs], num=first['num'])
+
+        group_idxs = list(groups.values())
+        if len(group_idxs) > 1:
+            with ThreadPoolExecutor(max_workers=len(group_idxs)) as pool:
+                group_outputs = list(pool.map(run_group, group_idxs))
+        else:
+            group_outputs = [run_group(idxs) for idxs in group_idxs]
+        for idxs, outputs in zip(group_idxs, group_outputs):
+            for idx, output in zip(idxs, outputs):
+                responses[idx] = output
+        return responses
+
+    def _question_steps(self, question: str):
+        """单个问题的RPVM流程(生成器), 返回值同 _run_single_question"""
+        # 单个问题的统计信息, 会写入中间数据
+        start_time = time.perf_counter()
+        stats = {
+            'llm_calls': {},
+            'prompt_tokens': {},
+            'completion_tokens': {},
+            'stage_time': {},
+            'memory': {'deduplicated': 0, 'superseded': 0, 'summary_calls': 0},
+        }
+        if self.verification_cache is not None:
+            stats['verification_cache'] = {'hits': 0, 'misses': 0}
+        if self.verification_mode == 'multi_claim':
+            stats['multi_claim'] = {'joint_calls': 0, 'claims': 0, 'fallbacks': 0}
+        if self.speculative_answer:
+            stats['speculation'] = {'attempts': 0, 'hits': 0, 'speculative_tokens': 0, 'wasted_tokens': 0}
+        if self.use_budget:
+            stats['degradations'] = {name: 0 for name in self.DEGRADATIONS}
+        if self.evidence_max_tokens is not None:
+            stats['evidence'] = {'packed_calls': 0, 'original_tokens': 0, 'packed_tokens': 0, 'saved_tokens': []}
+
+        result = yield from self._track_requests(self._rpvm_steps(question, stats), stats, start_time)
+        if 'speculation' in stats:
+            stats['speculation']['wasted_token_ratio'] = self._wasted_token_ratio(stats['speculation'])
+        return result
+
+    @staticmethod
+    def _wasted_token_ratio(speculation: Dict) -> float:
+        """推测生成的token中被丢弃的比例"""
+        if not speculation['speculative_tokens']:
+            return 0.0
+        return speculation['wasted_tokens'] / speculation['speculative_tokens']
+
+    def _track_requests(self, steps, stats: Dict, start_time: float):
+        """
+        透传阶段生成器的请求和结果, 同时按阶段统计:
+        LLM调用次数、prompt/completion token数(有API usage时使用usage, 否则用分词器计数),
+        以及耗时(从交出请求到拿到结果的时间, 同一步中有多个阶段的请求时计入每个阶段, 检索计入retrieval阶段)
+        wall_time为从问题开始处理到当前的时间(包括在调度器中等待其他问题的时间), 每一步更新, 预算检查依赖这些统计
+        """
+        stats['wall_time'] = time.perf_counter() - start_time
+        llm_calls = stats['llm_calls']
+        prompt_tokens = stats['prompt_tokens']
+        completion_tokens = stats['completion_tokens']
+        stage_time = stats['stage_time']
+        finished, request = self._step(steps)
+        while not finished:
+            requests = request if isinstance(request, list) else [request]
+            for r in requests:
+                if r['type'] == 'llm':
+                    llm_calls[r['stage']] = llm_calls.get(r['stage'], 0) + 1
+
+            request_start = time.perf_counter()
+            response = yield request
+            elapsed = time.perf_counter() - request_start
+
+            for stage in {r['stage'] for r in requests}:
+                stage_time[stage] = stage_time.get(stage, 0.0) + elapsed
+            responses = response if isinstance(request, list) else [response]
+            for r, output in zip(requests, responses):
+                if r['type'] != 'llm':
+                    continue
+                usage = r.get('usage')
+                if usage is not None:
+                    prompt, completion = usage['prompt_tokens'], usage['completion_tokens']
+                else:
+                    prompt = sum(len(self.tokenizer.encode(message['content'])) for message in r['messages'])
+                    completion = len(self.tokenizer.encode(output))
+                prompt_tokens[r['stage']] = prompt_tokens.get(r['stage'], 0) + prompt
+                completion_tokens[r['stage']] = completion_tokens.get(r['stage'], 0) + completion
+            stats['wall_time'] = time.perf_counter() - start_time
+            finished, request = self._step(steps, response)
+        stats['wall_time'] = time.perf_counter() - start_time
+        return request
+
+    def _budget_used(self, stats: Dict) -> float:
+        """预算用量: 各项预算中已用比例的最大值"""
+        used = [0.0]
+        if self.budget_max_tokens:
+            tokens = sum(stats['prompt_tokens'].values()) + sum(stats['completion_tokens'].values())
+            used.append(tokens / self.budget_max_tokens)
+        if self.budget_max_calls:
+            used.append(sum(stats['llm_calls'].values()) / self.budget_max_calls)
+        if self.budget_max_seconds:
+            used.append(stats['wall_time'] / self.budget_max_seconds)
+        return max(used)
+
+    def _degraded(self, stats: Optional[Dict], degradation: str) -> bool:
+        """判断是否应执行某个降级步骤; 触发时计入stats['degradations']"""
+        if not self.use_budget or stats is None:
+            return False
+        threshold = self.budget_degrade_thresholds[self.DEGRADATIONS.index(degradation)]
+        if self._budget_used(stats) < threshold:
+            return False
+        stats['degradations'][degradation] += 1
+        return True
+
+    @staticmethod
+    def _stage_tokens(stats: Dict, stage: str) -> int:
+        """某阶段目前为止的prompt + completion token数"""
+        return stats['prompt_tokens'].get(stage, 0) + stats['completion_tokens'].get(stage, 0)
+
+    def _rpvm_steps(self, question: str, stats: Dict):
+        """RPVM的迭代流程: 规划 -> 逐个验证plan并更新记忆 -> 压缩/摘要记忆, 直到可以回答"""
+        memory = FactMemory(self.tokenizer, similarity_threshold=self.memory_similarity_threshold)
         iterations = []
         total_retrievals = 0
-        
+        plans = None
+
         for iter_idx in range(self.max_iter):
+            # 预算即将用尽: 直接生成尽力回答
+            if self._degraded(stats, 'best_effort'):
+                break
+
             # Step 1: Reflective Planner - 生成计划链
-            plans = self._planner(question, memory)
-            
+            speculative_answer = None
+            if self.speculative_answer and len(memory) > 0:
+                # 记忆非空时与planner同时推测生成答案: planner对同一记忆判定ANSWER_READY时直接采用, 否则丢弃
+                plans, speculative_answer = yield from self._speculate_final_answer(question, memory, stats)
+            else:
+                plans = yield from self._planner(question, self._memory_view(memory, question))
+
             # 检查是否准备好回答
             if plans == "ANSWER_READY":
-                final_answer = self._generate_final_answer(question, memory)
+                if speculative_answer is not None:
+                    final_answer = speculative_answer
+                else:
+                    final_answer = yield from self._generate_final_answer(question, memory.render())
                 iterations.append({
                     'iteration': iter_idx + 1,
                     'plans': 'ANSWER_READY',
@@ -101,23 +607,38 @@ class RPVMPipeline(BasicPipeline):
                     'final_answer': final_answer
                 })
                 break
-            
+
+            # 预算紧张: 本轮只验证第一个plan
+            if len(plans) > 1 and self._degraded(stats, 'single_plan'):
+                plans = plans[:1]
+
             # 记录本轮迭代信息
             iter_info = {
                 'iteration': iter_idx + 1,
                 'plans': plans,
                 'verifications': []
             }
-            
+
             # Step 2 & 3: 对每个plan进行验证和记忆更新
+            committed = None
+            if self.verification_mode == 'multi_claim':
+                # 一次验证请求验证本轮所有plan, 之后按plan顺序提交
+                committed = yield from self._verify_plans_jointly(plans, question, memory.render(), stats)
+            elif self.parallel_verification:
+                # 并发验证本轮所有plan, 之后按plan顺序提交
+                committed = yield from self._verify_plans_concurrently(plans, question, memory.render(), stats)
+
             should_break = False
             for plan_idx, plan in enumerate(plans):
                 # 验证当前plan
-                verdict, corrected_plan, evidence, retrievals = self._verify_plan(
-                    plan, question, memory
-                )
+                if committed is None:
+                    verdict, corrected_plan, evidence, retrievals = yield from self._verify_plan(
+                        plan, question, memory.render(), stats
+                    )
+                else:
+                    verdict, corrected_plan, evidence, retrievals = committed[plan_idx]
                 total_retrievals += retrievals
-                
+
                 verification_info = {
                     'plan_index': plan_idx + 1,
                     'original_plan': plan,
@@ -126,71 +647,92 @@ class RPVMPipeline(BasicPipeline):
                     'retrievals': retrievals
                 }
                 iter_info['verifications'].append(verification_info)
-                
+
                 # 根据验证结果更新记忆
                 if verdict == "supported":
-                    memory += f"\n{corrected_plan} (verified)"
+                    memory.add(corrected_plan, 'verified')
                 elif verdict == "contradicted":
-                    memory += f"\n{corrected_plan} (corrected)"
+                    memory.add(corrected_plan, 'corrected', source=plan)
                     should_break = True  # 短路当前轮
                     break
                 # insufficient情况不更新记忆
-            
-            # 检查记忆长度，必要时进行摘要
-            if self.enable_memory_summary:
-                memory = self._check_and_summarize_memory(memory)
-            
-            iter_info['updated_memory'] = memory
+
+            # 压缩记忆, 仍然过长时进行摘要
+            yield from self._check_and_summarize_memory(memory, stats)
+
+            iter_info['updated_memory'] = memory.render()
             iterations.append(iter_info)
-            
+
             # 如果遇到contradicted，短路当前轮
             if should_break:
                 continue
-        
+
         # 如果达到最大迭代次数，仍生成最佳答案
-        if iter_idx == self.max_iter - 1 and plans != "ANSWER_READY":
-            final_answer = self._generate_best_effort_answer(question, memory)
-        else:
-            if plans != "ANSWER_READY":
-                final_answer = self._generate_best_effort_answer(question, memory)
-        
+        if plans != "ANSWER_READY":
+            final_answer = yield from self._generate_best_effort_answer(question, memory.render())
+
+        stats['memory']['final_tokens'] = memory.total_tokens
         return {
             'final_answer': final_answer,
-            'final_memory': memory,
+            'final_memory': memory.render(),
             'iterations': iterations,
-            'total_retrievals': total_retrievals
+            'total_retrievals': total_retrievals,
+            'stats': stats
         }
 
     def _planner(self, question: str, memory: str) -> any:
         """
-        Reflective Planner: 基于问题和当前记忆生成推理计划链
-        
+        Reflective Planner: 基于问题和当前记忆生成推理计划链(生成器)
+
         Returns:
             "ANSWER_READY" 或 计划列表 [plan1, plan2, ...]
         """
         planner_prompt = self._build_planner_prompt(question, memory)
-        
+
         # 使用OpenAI生成器
         messages = [
             {"role": "system", "content": "You are a helpful assistant that plans reasoning chains for answering complex multi-hop questions."},
             {"role": "user", "content": planner_prompt}
         ]
-        
-        response = self.generator.generate(
-            [messages],
+
+        response = yield self._llm_request(
+            'planner', messages,
             temperature=self.planner_temperature,
             max_tokens=512
-        )[0]
-        
+        )
+
         # 解析响应
         response = response.strip()
         if "ANSWER_READY" in response:
             return "ANSWER_READY"
-        
+
         # 解析计划列表
         plans = self._parse_plans(response)
         return plans
 
+    def _speculate_final_answer(self, question: str, memory: FactMemory, stats: Dict) -> Tuple[any, Optional[str]]:
+        """
+        planner与最终答案并发生成(生成器)
+
+        Returns:
+            (plans, 推测的答案); planner未返回ANSWER_READY时答案被丢弃, 返回None, 其token数计入wasted_tokens
+        """
+        speculation = stats['speculation']
+        tokens_before = self._stage_tokens(stats, 'speculative_answer')
+        plans, answer = yield from self._gather([
+            self._planner(question, self._memory_view(memory, question)),
+            self._generate_final_answer(question, memory.render(), stage='speculative_answer'),
+        ])
+        spent = self._stage_tokens(stats, 'speculative_answer') - tokens_before
+
+        speculation['attempts'] += 1
+        speculation['speculative_tokens'] += spent
+        if plans == "ANSWER_READY":
+            speculation['hits'] += 1
+            return plans, answer
+        speculation['wasted_tokens'] += spent
+        return plans, None
+
     def _build_planner_prompt(self, question: str, memory: str) -> str:
         """构建Planner的prompt"""
         if memory.strip():
@@ -222,14 +764,14 @@ Format: List each plan on a new line starting with a number, e.g.:
 2. [Second reasoning step]
 
 Your response:"""
-        
+
         return prompt
 
     def _parse_plans(self, response: str) -> List[str]:
         """从LLM响应中解析计划列表"""
         plans = []
         lines = response.strip().split('\n')
-        
+
         for line in lines:
             line = line.strip()
             # 匹配 "1. xxx" 或 "1) xxx" 格式
@@ -238,50 +780,174 @@ Your response:"""
                 plan_text = match.group(2).strip()
                 if plan_text:
                     plans.append(plan_text)
-        
+
         # 如果没有解析到计划，尝试直接按行分割
         if not plans and response.strip():
             plans = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
-        
+
         return plans if plans else ["Unable to parse plans, using original response"]
 
-    def _verify_plan(self, plan: str, question: str, memory: str) -> Tuple[str, str, str, int]:
+    def _verify_plan(self, plan: str, question: str, memory: str, stats: Optional[Dict] = None) -> Tuple[str, str, str, int]:
         """
-        Plan Verifier: 验证单个plan
-        
+        Plan Verifier: 验证单个plan(生成器)
+
         Returns:
             (verdict, corrected_plan, evidence, num_retrievals)
             verdict: "supported" | "contradicted" | "insufficient"
         """
+        docs, retrievals_count = yield from self._retrieve_for_plan(plan, stats)
+
+        # 如果没有检索到文档
+        if not docs:
+            return "insufficient", plan, "No relevant documents found", retrievals_count
+
+        # 基于检索到的文档进行验证
+        verdict, corrected_plan, evidence = yield from self._verify_with_docs(plan, docs, question, memory, stats)
+
+        return verdict, corrected_plan, evidence, retrievals_count
+
+    def _retrieve_for_plan(self, plan: str, stats: Optional[Dict] = None) -> Tuple[List[Dict], int]:
+        """
+        为plan检索文档(生成器), 检索为空时改写查询重试(预算紧张时不再重试)
+
+        Returns:
+            (docs, num_retrievals)
+        """
         retrievals_count = 0
         docs = []
         current_query = plan
-        
+
         # 尝试检索相关文档
         for attempt in range(self.max_retrieval_attempts):
             # 检索
-            retrieved_docs = self.retriever.batch_search([current_query], num=self.retrieval_topk)
+            retrieved_docs = yield self._retrieval_request(current_query, self.retrieval_topk)
             retrievals_count += 1
-            
-            if retrieved_docs and retrieved_docs[0]:
-                docs = retrieved_docs[0]
+
+            if retrieved_docs:
+                docs = retrieved_docs
                 break
             else:
                 # 检索失败,尝试改写查询
                 if attempt < self.max_retrieval_attempts - 1:
-                    current_query = self._rewrite_query(plan, attempt + 1)
-        
-        # 如果没有检索到文档
-        if not docs:
-            return "insufficient", plan, "No relevant documents found", retrievals_count
-        
-        # 基于检索到的文档进行验证
-        verdict, corrected_plan, evidence = self._verify_with_docs(plan, docs, question, memory)
-        
-        return verdict, corrected_plan, evidence, retrievals_count
+                    if self._degraded(stats, 'skip_rewrite'):
+                        break
+                    current_query = yield from self._rewrite_query(plan, attempt + 1)
+
+        return docs, retrievals_count
+
+    def _verify_plans_concurrently(self, plans: List[str], question: str, memory: str,
+                                   stats: Optional[Dict] = None) -> List[Tuple[str, str, str, int]]:
+        """
+        并发验证一轮中的所有plan(生成器)
+        所有plan的检索/改写/验证请求在同一步中一起发出, 每轮耗时约为最慢的plan而不是所有plan之和。
+        一旦某个plan被判定为contradicted, 其后的plan不会被提交, 它们尚未发出的请求也直接取消。
+
+        Returns:
+            按plan顺序的验证结果列表, 截止到第一个contradicted(含), 与顺序验证提交的结果一致
+        """
+        all_steps = [self._verify_plan(plan, question, memory, stats) for plan in plans]
+        outcomes = yield from self._gather(all_steps, cutoff=self._first_contradiction)
+        return outcomes[: self._first_contradiction(outcomes) + 1]
+
+    def _gather(self, all_steps: List, cutoff=None) -> List:
+        """
+        同步推进多个阶段生成器(生成器): 每一步把它们的待执行请求合并为一个列表交出
+        cutoff(outcomes) 返回需要保留的最大下标, 其后尚未完成的生成器被取消, 结果保持为None
+
+        Returns:
+            各生成器的返回值列表
+        """
+        outcomes = [None] * len(all_steps)
+        pending = {}  # idx -> pending request
+
+        for idx, steps in enumerate(all_steps):
+            finished, request = self._step(steps)
+            if finished:
+                outcomes[idx] = request
+            else:
+                pending[idx] = request
+
+        while pending:
+            if cutoff is not None:
+                keep = cutoff(outcomes)
+                for idx in [i for i in pending if i > keep]:
+                    all_steps[idx].close()
+                    del pending[idx]
+                if not pending:
+                    break
+
+            flat_requests, spans = self._flatten_requests(pending)
+            responses = self._split_responses(pending, spans, (yield flat_requests))
+
+            for idx in list(pending.keys()):
+                finished, request = self._step(all_steps[idx], responses[idx])
+                if finished:
+                    outcomes[idx] = request
+                    del pending[idx]
+                else:
+                    pending[idx] = request
+
+        return outcomes
+
+    def _verify_plans_jointly(self, plans: List[str], question: str, memory: str,
+                              stats: Optional[Dict] = None) -> List[Tuple[str, str, str, int]]:
+        """
+        多声明验证(生成器): 所有plan的检索合并为一次batch_search, 各plan的文档去重后组成共享证据池,
+        再用一个验证请求让验证器对每个plan各输出一行结论。
+        无法解析的plan退回单独验证; 命中验证缓存的plan不进入联合验证。
+
+        Returns:
+            按plan顺序的验证结果列表, 截止到第一个contradicted(含), 与顺序验证提交的结果一致
+        """
+        retrieved = yield from self._gather([self._retrieve_for_plan(plan, stats) for plan in plans])
+
+        outcomes = [None] * len(plans)
+        claims = []  # 需要联合验证的plan下标
+        for idx, (plan, (docs, retrievals)) in enumerate(zip(plans, retrieved)):
+            if not docs:
+                outcomes[idx] = ("insufficient", plan, "No relevant documents found", retrievals)
+                continue
+            cached = self._get_cached_verification(plan, docs, stats)
+            if cached is not None:
+                outcomes[idx] = (*cached, retrievals)
+            else:
+                claims.append(idx)
+
+        parsed = {}
+        if len(claims) > 1:
+            parsed = yield from self._verify_claims_with_docs(
+                [plans[idx] for idx in claims], [retrieved[idx][0] for idx in claims], stats
+            )
+            if stats is not None:
+                stats['multi_claim']['joint_calls'] += 1
+                stats['multi_claim']['claims'] += len(claims)
+            for claim_idx, result in parsed.items():
+                idx = claims[claim_idx]
+                self._put_cached_verification(plans[idx], retrieved[idx][0], result)
+                outcomes[idx] = (*result, retrieved[idx][1])
+
+        # 单个待验证的plan或无法解析的plan退回单独验证
+        fallback = [idx for claim_idx, idx in enumerate(claims) if claim_idx not in parsed]
+        if len(claims) > 1 and stats is not None:
+            stats['multi_claim']['fallbacks'] += len(fallback)
+        results = yield from self._gather([
+            self._verify_with_docs(plans[idx], retrieved[idx][0], question, memory, stats) for idx in fallback
+        ])
+        for idx, result in zip(fallback, results):
+            outcomes[idx] = (*result, retrieved[idx][1])
+
+        return outcomes[: self._first_contradiction(outcomes) + 1]
+
+    @staticmethod
+    def _first_contradiction(outcomes: List) -> int:
+        """返回第一个已判定为contradicted的plan下标, 没有则返回最后一个下标"""
+        for idx, outcome in enumerate(outcomes):
+            if outcome is not None and outcome[0] == "contradicted":
+                return idx
+        return len(outcomes) - 1
 
     def _rewrite_query(self, plan: str, attempt: int) -> str:
-        """改写检索查询以提高召回"""
+        """改写检索查询以提高召回(生成器)"""
         rewrite_prompt = f"""Rewrite the following statement into a more specific search query to find relevant documents.
 
 Original statement: {plan}
@@ -289,33 +955,36 @@ Original statement: {plan}
 Attempt {attempt}: Generate a different, more specific search query focusing on key entities and relationships.
 
 Rewritten query:"""
-        
+
         messages = [
             {"role": "system", "content": "You are a helpful assistant that rewrites queries for better document retrieval."},
             {"role": "user", "content": rewrite_prompt}
         ]
-        
-        rewritten = self.generator.generate(
-            [messages],
+
+        rewritten = yield self._llm_request(
+            'rewrite', messages,
             temperature=0.5,
             max_tokens=100
-        )[0]
-        
+        )
+
         return rewritten.strip() if rewritten.strip() else plan
 
-    def _verify_with_docs(self, plan: str, docs: List[Dict], question: str, memory: str) -> Tuple[str, str, str]:
+    def _verify_with_docs(self, plan: str, docs: List[Dict], question: str, memory: str,
+                          stats: Optional[Dict] = None) -> Tuple[str, str, str]:
         """
-        基于检索到的文档验证plan
-        
+        基于检索到的文档验证plan(生成器)
+        开启验证缓存时, plan和检索文档都相同的验证直接复用缓存结果, 不再调用验证器
+
         Returns:
             (verdict, corrected_plan, evidence)
         """
-        # 构建验证prompt
-        docs_text = "\n\n".join([
-            f"Document {i+1}: {doc.get('contents', doc.get('text', ''))}"
-            for i, doc in enumerate(docs[:5])  # 只使用前5个文档
-        ])
-        
+        cached = self._get_cached_verification(plan, docs, stats)
+        if cached is not None:
+            return cached
+
+        # 构建验证prompt, 只使用前5个文档
+        docs_text = self._evidence_text(plan, docs[:5], self.evidence_max_tokens, stats)
+
         verify_prompt = f"""Based on the retrieved documents, verify the following statement.
 
 Statement to verify: {plan}
@@ -338,29 +1007,154 @@ Corrected Statement: [the statement, corrected if needed]
 Evidence: [brief explanation]
 
 Your response:"""
-        
+
         messages = [
             {"role": "system", "content": "You are a careful fact-checker that verifies statements against documents."},
             {"role": "user", "content": verify_prompt}
         ]
-        
-        response = self.generator.generate(
-            [messages],
+
+        response = yield self._llm_request(
+            'verifier', messages,
             temperature=self.verifier_temperature,
             max_tokens=300
-        )[0]
-        
+        )
+
         # 解析验证结果
         verdict, corrected_plan, evidence = self._parse_verification_response(response, plan)
-        
+        self._put_cached_verification(plan, docs, (verdict, corrected_plan, evidence))
+
         return verdict, corrected_plan, evidence
 
+    def _evidence_text(self, query: str, docs: List[Dict], max_tokens: Optional[int],
+                       stats: Optional[Dict] = None) -> str:
+        """
+        验证prompt中的文档证据
+        未开启证据打包时为文档全文; 开启时按query打包到max_tokens以内, 并记录本次调用节省的证据token数
+        """
+        if max_tokens is None:
+            return EvidencePacker.format_docs(docs)
+        if self._evidence_packer is None:
+            encoder = getattr(self.retriever, 'encoder', None) if self.evidence_scorer == 'encoder' else None
+            self._evidence_packer = EvidencePacker(self.tokenizer, encoder=encoder)
+        docs_text, counts = self._evidence_packer.pack(query, docs, max_tokens)
+        if stats is not None:
+            stats['evidence']['packed_calls'] += 1
+            stats['evidence']['original_tokens'] += counts['original_tokens']
+            stats['evidence']['packed_tokens'] += counts['packed_tokens']
+            stats['evidence']['saved_tokens'].append(counts['original_tokens'] - counts['packed_tokens'])
+        return docs_text
+
+    def _verification_cache_key(self, plan: str, docs: List[Dict]) -> str:
+        model = getattr(self.generator, 'model_name', self.config['generator_model'])
+        if self.evidence_max_tokens is not None:
+            # 打包后的证据随预算变化, 不与全文证据的验证结果共用缓存
+            model = f"{model}|evidence_max_tokens={self.evidence_max_tokens}"
+        return self.verification_cache.make_key(plan, docs[:5], model, self.verifier_temperature)
+
+    def _get_cached_verification(self, plan: str, docs: List[Dict],
+                                 stats: Optional[Dict] = None) -> Optional[Tuple[str, str, str]]:
+        """查询验证缓存, 未开启缓存或未命中时返回None"""
+        if self.verification_cache is None:
+            return None
+        cached = self.verification_cache.get(self._verification_cache_key(plan, docs))
+        if stats is not None:
+            stats['verification_cache']['hits' if cached is not None else 'misses'] += 1
+        return cached
+
+    def _put_cached_verification(self, plan: str, docs: List[Dict], result: Tuple[str, str, str]):
+        if self.verification_cache is not None:
+            self.verification_cache.put(self._verification_cache_key(plan, docs), result)
+
+    def _verify_claims_with_docs(self, plans: List[str], docs_list: List[List[Dict]],
+                                 stats: Optional[Dict] = None) -> Dict[int, Tuple[str, str, str]]:
+        """
+        在共享证据池上一次验证多个plan(生成器)
+        每个plan取前5个文档, 跨plan去重后统一编号; 每个声明标注其对应的文档编号
+        开启证据打包时, 证据池按全部声明打包, 预算为每个声明evidence_max_tokens之和
+
+        Returns:
+            {声明下标: (verdict, corrected_plan, evidence)}, 只包含成功解析的声明
+        """
+        pool = []
+        doc_index = {}  # doc key -> 证据池中的编号
+        claim_docs = []
+        for docs in docs_list:
+            numbers = []
+            for doc in docs[:5]:
+                key = VerificationCache.doc_key(doc)
+                if key not in doc_index:
+                    pool.append(doc)
+                    doc_index[key] = len(pool)
+                numbers.append(doc_index[key])
+            claim_docs.append(numbers)
+
+        claims_text = "\n".join([
+            f"Claim {i+1} (see Documents {', '.join(str(n) for n in numbers)}): {plan}"
+            for i, (plan, numbers) in enumerate(zip(plans, claim_docs))
+        ])
+        max_tokens = self.evidence_max_tokens * len(plans) if self.evidence_max_tokens is not None else None
+        docs_text = self._evidence_text(" ".join(plans), pool, max_tokens, stats)
+
+        verify_prompt = f"""Based on the retrieved documents, verify each of the following statements independently.
+
+Statements to verify:
+{claims_text}
+
+Retrieved Documents:
+{docs_text}
+
+Instructions:
+1. For each claim, determine if the statement is:
+   - SUPPORTED: The documents provide evidence supporting this statement
+   - CONTRADICTED: The documents contradict this statement
+   - INSUFFICIENT: The documents don't provide enough information
+
+2. If CONTRADICTED, provide the corrected version based on the documents.
+3. If SUPPORTED or INSUFFICIENT, keep the original statement.
+
+Respond with exactly one line per claim, in this exact format:
+Claim [number] | Verdict: [SUPPORTED/CONTRADICTED/INSUFFICIENT] | Corrected Statement: [the statement, corrected if needed] | Evidence: [brief explanation]
+
+Your response:"""
+
+        messages = [
+            {"role": "system", "content": "You are a careful fact-checker that verifies statements against documents."},
+            {"role": "user", "content": verify_prompt}
+        ]
+
+        response = yield self._llm_request(
+            'verifier', messages,
+            temperature=self.verifier_temperature,
+            max_tokens=200 * len(plans)
+        )
+
+        return self._parse_claim_verifications(response, plans)
+
+    def _parse_claim_verifications(self, response: str, plans: List[str]) -> Dict[int, Tuple[str, str, str]]:
+        """
+        解析多声明验证响应: 每行 "Claim i | Verdict: ... | Corrected Statement: ... | Evidence: ..."
+        按字段拆成多行后复用 _parse_verification_response; 缺少Verdict字段或编号越界的行被忽略
+        """
+        results = {}
+        for line in response.strip().split('\n'):
+            match = re.match(r'^\W*claim\s*(\d+)\W*\|(.*)$', line.strip(), re.IGNORECASE)
+            if not match:
+                continue
+            claim_idx = int(match.group(1)) - 1
+            fields = [field.strip() for field in match.group(2).split('|')]
+            if not 0 <= claim_idx < len(plans) or claim_idx in results:
+                continue
+            if not any(field.lower().startswith('verdict:') for field in fields):
+                continue
+            results[claim_idx] = self._parse_verification_response('\n'.join(fields), plans[claim_idx])
+        return results
+
     def _parse_verification_response(self, response: str, original_plan: str) -> Tuple[str, str, str]:
         """解析验证响应"""
         verdict = "insufficient"
         corrected_plan = original_plan
         evidence = ""
-        
+
         lines = response.strip().split('\n')
         for line in lines:
             line = line.strip()
@@ -376,40 +1170,90 @@ Your response:"""
                 corrected_plan = line.split(':', 1)[1].strip()
             elif line.lower().startswith('evidence:'):
                 evidence = line.split(':', 1)[1].strip()
-        
+
         return verdict, corrected_plan if corrected_plan else original_plan, evidence
 
-    def _check_and_summarize_memory(self, memory: str) -> str:
-        """检查记忆长度，如有必要进行摘要"""
-        # 简单估计token数(英文约为单词数的1.3倍)
-        estimated_tokens = len(memory.split()) * 1.3
-        
-        if estimated_tokens > self.memory_max_tokens:
+    @property
+    def tokenizer(self):
+        """
+        记忆token计数使用的分词器: 优先复用生成器的分词器(openai生成器为对应模型的tiktoken编码),
+        否则按generator_model加载tiktoken编码
+        """
+        if self._tokenizer is None:
+            self._tokenizer = getattr(self.generator, 'tokenizer', None)
+        if self._tokenizer is None:
+            try:
+                self._tokenizer = tiktoken.encoding_for_model(self.config['generator_model'])
+            except KeyError:
+                warnings.warn("This model is not supported by tiktoken. Use gpt-3.5-turbo instead.")
+                self._tokenizer = tiktoken.encoding_for_model('gpt-3.5-turbo')
+        return self._tokenizer
+
+    def _memory_view(self, memory: FactMemory, query: str) -> str:
+        """
+        注入prompt的记忆视图
+        memory_injection为relevant且记忆超出top-k/token预算时, 只保留与query最相关的事实
+        """
+        if self.memory_injection != 'relevant' or (
+            len(memory) <= self.memory_injection_topk and memory.total_tokens <= self.memory_injection_max_tokens
+        ):
+            return memory.render()
+        scores = self._fact_scores(memory, query)
+        return memory.render_selected(scores, self.memory_injection_topk, self.memory_injection_max_tokens)
+
+    def _fact_scores(self, memory: FactMemory, query: str) -> List[float]:
+        """
+        计算每条事实与query的相关度
+        检索器带有稠密编码器时用其向量的内积(事实向量缓存在事实中, 只编码新增的事实), 否则用词重叠度
+        """
+        encoder = getattr(self.retriever, 'encoder', None)
+        if encoder is None:
+            query_words = memory.word_set(query)
+            return [len(query_words & memory.word_set(fact['text'])) / max(len(query_words), 1) for fact in memory.facts]
+
+        new_facts = [fact for fact in memory.facts if 'embedding' not in fact]
+        if new_facts:
+            embeddings = encoder.encode([fact['text'] for fact in new_facts], is_query=False)
+            for fact, embedding in zip(new_facts, embeddings):
+                fact['embedding'] = embedding
+        query_emb = encoder.encode([query], is_query=True)[0]
+        return [float(np.dot(fact['embedding'], query_emb)) for fact in memory.facts]
+
+    def _check_and_summarize_memory(self, memory: FactMemory, stats: Dict):
+        """
+        检查记忆长度(生成器): 先做确定性压缩, 仍超过memory_max_tokens时才调用LLM摘要
+        就地修改memory, 压缩和摘要次数记入stats['memory']
+        """
+        if self.memory_compaction:
+            for key, count in memory.compact().items():
+                stats['memory'][key] += count
+
+        if self.enable_memory_summary and memory.total_tokens > self.memory_max_tokens \
+                and not self._degraded(stats, 'no_summary'):
             # 进行摘要
             summary_prompt = f"""Summarize the following verified facts into a concise memory, preserving all key information.
 
 Memory to summarize:
-{memory}
+{memory.render()}
 
 Provide a concise summary that retains all important facts:"""
-            
+
             messages = [
                 {"role": "system", "content": "You are a helpful assistant that summarizes information concisely."},
                 {"role": "user", "content": summary_prompt}
             ]
-            
-            summarized = self.generator.generate(
-                [messages],
+
+            summarized = yield self._llm_request(
+                'summary', messages,
                 temperature=0.3,
                 max_tokens=500
-            )[0]
-            
-            return summarized.strip()
-        
-        return memory
-
-    def _generate_final_answer(self, question: str, memory: str) -> str:
-        """基于记忆生成最终答案"""
+            )
+
+            memory.replace_with_summary(summarized.strip())
+            stats['memory']['summary_calls'] += 1
+
+    def _generate_final_answer(self, question: str, memory: str, stage: str = 'final_answer') -> str:
+        """基于记忆生成最终答案(生成器), 推测生成时stage为speculative_answer"""
         answer_prompt = f"""Based on the verified facts in memory, answer the question directly and concisely.
 
 Question: {question}
@@ -418,22 +1262,22 @@ Verified Memory:
 {memory}
 
 Provide a direct, concise answer to the question:"""
-        
+
         messages = [
             {"role": "system", "content": "You are a helpful assistant that provides direct, accurate answers based on verified information."},
             {"role": "user", "content": answer_prompt}
         ]
-        
-        answer = self.generator.generate(
-            [messages],
+
+        answer = yield self._llm_request(
+            stage, messages,
             temperature=self.final_answer_temperature,
             max_tokens=200
-        )[0]
-        
+        )
+
         return answer.strip()
 
     def _generate_best_effort_answer(self, question: str, memory: str) -> str:
-        """在达到最大迭代次数时生成尽力回答"""
+        """在达到最大迭代次数时生成尽力回答(生成器)"""
         if not memory.strip():
             # 如果没有记忆，直接用模型知识回答
             answer_prompt = f"""Answer the following question based on your knowledge. Be honest if you're uncertain.
@@ -450,28 +1294,54 @@ Verified Memory:
 {memory}
 
 Best effort answer:"""
-        
+
         messages = [
             {"role": "system", "content": "You are a helpful assistant. Provide the best answer you can, and be honest about uncertainty."},
             {"role": "user", "content": answer_prompt}
         ]
-        
-        answer = self.generator.generate(
-            [messages],
+
+        answer = yield self._llm_request(
+            'final_answer', messages,
             temperature=self.final_answer_temperature,
             max_tokens=200
-        )[0]
-        
+        )
+
         return answer.strip()
 
-    def _save_intermediate_data(self):
-        """保存中间数据到文件"""
-        import os
-        os.makedirs(self.config['save_dir'], exist_ok=True)
-        
-        output_path = os.path.join(self.config['save_dir'], 'intermediate_data.jsonl')
-        with open(output_path, 'w', encoding='utf-8') as f:
-            for item in self.intermediate_data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
-        
-        print(f"Intermediate data saved to: {output_path}")
+    def _intermediate_data_path(self) -> str:
+        return os.path.join(self.config['save_dir'], 'intermediate_data.jsonl')
+
+    @staticmethod
+    def _question_key(item) -> str:
+        """问题标识: 优先使用数据集中的id, 没有id时使用问题文本"""
+        return item.id if item.id is not None else item.question
+
+    def _append_intermediate_data(self, record: Dict):
+        """把一条中间数据追加写入文件并立即flush, 中途崩溃时已完成的问题不会丢失"""
+        with open(self._intermediate_data_path(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+
+    def _load_intermediate_data(self) -> List[Dict]:
+        """
+        读取已有的中间数据(用于续跑)
+        崩溃时最后一行可能只写了一半, 解析失败的行会被丢弃, 并把文件重写为只含完整记录
+        """
+        output_path = self._intermediate_data_path()
+        if not os.path.exists(output_path):
+            return []
+
+        records = []
+        with open(output_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+
+        if len(records) != len(lines) or (lines and not lines[-1].endswith('\n')):
+            with open(output_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return records
@@ -8,12 +8,18 @@ python run_rpvm_exp.py --dataset_name 2wikimultihopqa --split test --gpu_id 0
 
 示例运行(小样本测试):
 python run_rpvm_exp.py --dataset_name hotpotqa --split test --gpu_id 0 --num_samples 5
+
+中断后续跑(跳过intermediate_data.jsonl中已完成的问题):
+python run_rpvm_exp.py --dataset_name hotpotqa --split test --gpu_id 0 --resume output/rpvm_experiments/<上次运行的目录>
 """
 import os
 import sys
+import json
 import argparse
 from pathlib import Path
 
+import numpy as np
+
 # 添加flashRAG路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -32,12 +38,68 @@ except ImportError:
     print("提示: 安装python-dotenv可自动加载.env文件: pip install python-dotenv")
 
 
+def summarize_stages(records):
+    """
+    按阶段汇总中间数据中的开销: 每个阶段的调用次数、prompt/completion token数和耗时
+    每项给出总计、每个问题的均值, 耗时额外给出每个问题的p50/p95; question行为整个问题的耗时
+    """
+    stages = sorted({stage for record in records for stage in record['stage_time']})
+    rows = []
+    for stage in stages + ['question']:
+        if stage == 'question':
+            times = [record['wall_time'] for record in records]
+            calls = prompt = completion = [0] * len(records)
+        else:
+            times = [record['stage_time'].get(stage, 0.0) for record in records]
+            calls = [record['llm_calls'].get(stage, 0) for record in records]
+            prompt = [record['prompt_tokens'].get(stage, 0) for record in records]
+            completion = [record['completion_tokens'].get(stage, 0) for record in records]
+            if stage == 'retrieval':
+                calls = [record['total_retrievals'] for record in records]
+        rows.append({
+            'stage': stage,
+            'calls': sum(calls), 'calls_mean': float(np.mean(calls)),
+            'prompt_tokens': sum(prompt), 'prompt_tokens_mean': float(np.mean(prompt)),
+            'completion_tokens': sum(completion), 'completion_tokens_mean': float(np.mean(completion)),
+            'time': sum(times), 'time_mean': float(np.mean(times)),
+            'time_p50': float(np.percentile(times, 50)), 'time_p95': float(np.percentile(times, 95)),
+        })
+    return rows
+
+
+def write_stage_summary(save_dir):
+    """读取intermediate_data.jsonl, 把各阶段的开销汇总表写入save_dir下的stage_summary.txt"""
+    intermediate_path = os.path.join(save_dir, "intermediate_data.jsonl")
+    if not os.path.exists(intermediate_path):
+        return
+    with open(intermediate_path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    if not records:
+        return
+
+    header = f"{'stage':<20}{'calls':>10}{'calls/q':>10}{'prompt_tok':>14}{'prompt/q':>10}" \
+             f"{'compl_tok':>12}{'compl/q':>10}{'time(s)':>12}{'time/q':>10}{'p50':>10}{'p95':>10}"
+    lines = [f"questions: {len(records)}", header]
+    for row in summarize_stages(records):
+        lines.append(
+            f"{row['stage']:<20}{row['calls']:>10}{row['calls_mean']:>10.2f}"
+            f"{row['prompt_tokens']:>14}{row['prompt_tokens_mean']:>10.1f}"
+            f"{row['completion_tokens']:>12}{row['completion_tokens_mean']:>10.1f}"
+            f"{row['time']:>12.2f}{row['time_mean']:>10.3f}{row['time_p50']:>10.3f}{row['time_p95']:>10.3f}"
+        )
+    summary_path = os.path.join(save_dir, "stage_summary.txt")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    print("\n".join(lines))
+    print(f"Stage summary saved to: {summary_path}")
+
+
 def run_rpvm_experiment(args):
     """运行RPVM实验"""
-    
+
     # 设置保存标识
     save_note = f"rpvm_{args.dataset_name}_{args.split}"
-    
+
     # 配置参数覆盖
     config_dict = {
         "dataset_name": args.dataset_name,
@@ -45,7 +107,14 @@ def run_rpvm_experiment(args):
         "gpu_id": args.gpu_id,
         "save_note": save_note,
     }
-    
+
+    # 续跑时沿用上次运行的目录, 不再新建带时间戳的目录
+    if args.resume:
+        if not os.path.exists(os.path.join(args.resume, "intermediate_data.jsonl")):
+            print(f"ERROR: intermediate_data.jsonl not found in {args.resume}")
+            sys.exit(1)
+        config_dict["disable_save"] = True
+
     # 如果指定了OpenAI API Key
     if args.openai_api_key:
         config_dict["openai_setting"] = {
@@ -62,40 +131,51 @@ def run_rpvm_experiment(args):
                 "base_url": openai_base_url
             }
             print(f"使用环境变量中的OpenAI配置: {openai_base_url}")
-    
+
     # 加载配置
     config_file_path = os.path.join(os.path.dirname(__file__), "rpvm_config.yaml")
     config = Config(config_file_path=config_file_path, config_dict=config_dict)
-    
+    if args.resume:
+        config["save_dir"] = args.resume
+
+    # 录制本次运行的所有LLM请求和检索结果, 供benchmark_rpvm.py离线回放
+    if args.record_cassette:
+        config["rpvm_config"] = {
+            **config["rpvm_config"], "cassette_mode": "record", "cassette_path": args.record_cassette
+        }
+
     # 加载数据集
     print(f"Loading datasets: {args.dataset_name}, split: {args.split}")
     all_split = get_dataset(config)
     test_data = all_split[args.split]
-    
+
     # 如果指定了样本数量(用于测试)
     if args.num_samples and args.num_samples > 0:
         print(f"Using only {args.num_samples} samples for testing")
         test_data = test_data[:args.num_samples]
-    
+
     print(f"Dataset size: {len(test_data)}")
-    
+
     # 创建RPVM Pipeline
     print("Initializing RPVM Pipeline...")
     pipeline = RPVMPipeline(config)
-    
+
     # 运行实验
     print("Running RPVM experiment...")
-    result_dataset = pipeline.run(test_data, do_eval=True)
-    
+    result_dataset = pipeline.run(test_data, do_eval=True, resume=bool(args.resume))
+
+    # 各阶段开销汇总表, 与metric_score.txt放在同一目录
+    write_stage_summary(config['save_dir'])
+
     print("Experiment completed!")
     print(f"Results saved to: {config['save_dir']}")
-    
+
     return result_dataset
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run RPVM experiment on multi-hop QA datasets")
-    
+
     # 必需参数
     parser.add_argument(
         "--dataset_name",
@@ -104,7 +184,7 @@ def main():
         choices=["hotpotqa", "2wikimultihopqa"],
         help="Dataset to use for the experiment"
     )
-    
+
     parser.add_argument(
         "--split",
         type=str,
@@ -112,14 +192,14 @@ def main():
         choices=["train", "dev", "test"],
         help="Dataset split to use"
     )
-    
+
     parser.add_argument(
         "--gpu_id",
         type=str,
         default="0",
         help="GPU ID to use (e.g., '0' or '0,1')"
     )
-    
+
     # 可选参数
     parser.add_argument(
         "--num_samples",
@@ -127,23 +207,39 @@ def main():
         default=None,
         help="Number of samples to process (for testing). If not specified, use all samples."
     )
-    
+
     parser.add_argument(
         "--openai_api_key",
         type=str,
         default=None,
         help="OpenAI API key. If not specified, will read from environment variable OPENAI_API_KEY"
     )
-    
+
     parser.add_argument(
         "--openai_base_url",
         type=str,
         default=None,
         help="OpenAI API base URL. If not specified, will read from environment variable OPENAI_BASE_URL"
     )
-    
+
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        help="Directory of a previous run. Questions already in its intermediate_data.jsonl are skipped, "
+             "new records are appended to the same file and evaluation covers old and new records."
+    )
+
+    parser.add_argument(
+        "--record_cassette",
+        type=str,
+        default=None,
+        help="Record every LLM request/response and retrieval result of this run into this cassette file "
+             "for offline replay with benchmark_rpvm.py"
+    )
+
     args = parser.parse_args()
-    
+
     # 检查OpenAI API Key
     if not args.openai_api_key and not os.getenv("OPENAI_API_KEY"):
         print("WARNING: OpenAI API key not found!")
@@ -152,7 +248,7 @@ def main():
         print("  2. Use .env file in project root with OPENAI_API_KEY='your-key'")
         print("  3. Pass via argument: --openai_api_key your-key")
         sys.exit(1)
-    
+
     # 运行实验
     run_rpvm_experiment(args)
 
@@ -3,7 +3,9 @@ RPVM基本功能测试脚本
 测试各个模块的基本功能，不需要实际的检索器和数据集
 """
 import os
+import re
 import sys
+import time
 
 # 添加flashRAG路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -28,20 +30,20 @@ def test_config_loading():
     print("\n测试2: 配置加载...")
     try:
         from flashrag.config import Config
-        
+
         config_file = os.path.join(os.path.dirname(__file__), "rpvm_config.yaml")
-        
+
         # 测试配置文件是否存在
         if not os.path.exists(config_file):
             print(f"✗ 配置文件不存在: {config_file}")
             return False
-        
+
         # 尝试加载配置(可能会失败，因为路径可能不存在)
         config_dict = {
             "gpu_id": None,  # 使用CPU
             "disable_save": True,  # 禁用保存以避免创建目录
         }
-        
+
         try:
             config = Config(config_file_path=config_file, config_dict=config_dict)
             print("✓ 配置加载成功")
@@ -54,7 +56,7 @@ def test_config_loading():
             print(f"⚠ 配置加载警告: {e}")
             print("  (这可能是正常的，如果数据路径尚未设置)")
             return True
-            
+
     except Exception as e:
         print(f"✗ 配置测试失败: {e}")
         return False
@@ -68,11 +70,11 @@ def test_prompt_building():
         class MockGenerator:
             def generate(self, messages, **kwargs):
                 return ["Mock response"]
-        
+
         class MockRetriever:
             def batch_search(self, queries, topk=5):
                 return [[]]
-        
+
         class MockConfig(dict):
             def __getitem__(self, key):
                 defaults = {
@@ -91,12 +93,12 @@ def test_prompt_building():
                     'device': 'cpu'
                 }
                 return defaults.get(key, None)
-            
+
             def get(self, key, default=None):
                 return self.__getitem__(key) or default
-        
+
         from rpvm_pipeline import RPVMPipeline
-        
+
         # 创建mock pipeline
         config = MockConfig()
         pipeline = RPVMPipeline.__new__(RPVMPipeline)
@@ -109,49 +111,49 @@ def test_prompt_building():
         pipeline.planner_temperature = 0.7
         pipeline.verifier_temperature = 0.3
         pipeline.final_answer_temperature = 0.5
-        
+
         # 测试planner prompt
         question = "What is the capital of France?"
         memory = ""
         prompt = pipeline._build_planner_prompt(question, memory)
-        
+
         assert "Question: " in prompt
         assert question in prompt
         print("✓ Planner prompt构建成功")
-        
+
         # 测试带记忆的planner prompt
         memory = "France is a country in Europe. (verified)"
         prompt_with_memory = pipeline._build_planner_prompt(question, memory)
-        
+
         assert "Verified Memory:" in prompt_with_memory
         assert memory in prompt_with_memory
         print("✓ 带记忆的Planner prompt构建成功")
-        
+
         # 测试plans解析
         mock_response = """1. France is a country in Europe.
 2. The capital of France is Paris."""
         plans = pipeline._parse_plans(mock_response)
-        
+
         assert len(plans) == 2
         assert "France is a country in Europe" in plans[0]
         assert "Paris" in plans[1]
         print("✓ Plans解析成功")
-        
+
         # 测试验证响应解析
         mock_verification = """Verdict: SUPPORTED
 Corrected Statement: France is a country in Europe.
 Evidence: The documents confirm this fact."""
-        
+
         verdict, corrected, evidence = pipeline._parse_verification_response(
-            mock_verification, 
+            mock_verification,
             "France is a country in Europe."
         )
-        
+
         assert verdict == "supported"
         print("✓ 验证响应解析成功")
-        
+
         return True
-        
+
     except Exception as e:
         print(f"✗ Prompt构建测试失败: {e}")
         import traceback
@@ -159,21 +161,771 @@ Evidence: The documents confirm this fact."""
         return False
 
 
+class MockTokenizer:
+    """按空白切分的mock分词器"""
+
+    @staticmethod
+    def encode(text):
+        return text.split()
+
+
+class MockGenerator:
+    """按prompt内容给出确定性回复的mock生成器, 记录每次generate的批大小"""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.requests = []
+        self.tokenizer = MockTokenizer()
+
+    def generate(self, input_list, **kwargs):
+        self.batch_sizes.append(len(input_list))
+        self.requests.extend(messages[-1]['content'] for messages in input_list)
+        return [self._respond(messages[-1]['content']) for messages in input_list]
+
+    async def _generate_async(self, input_list, **kwargs):
+        return self.generate(input_list, **kwargs)
+
+    @staticmethod
+    def _respond(prompt):
+        if prompt.startswith("Given the question"):
+            if prompt.count("(verified)") + prompt.count("(corrected)") >= 2:
+                return "ANSWER_READY"
+            question = prompt.split("Question: ")[1].split("\n")[0]
+            return f"1. {question} hop one\n2. {question} hop two"
+        if prompt.startswith("Rewrite"):
+            return prompt.split("Original statement: ")[1].split("\n")[0] + " rewritten"
+        if prompt.startswith("Based on the retrieved documents, verify each"):
+            lines = []
+            for line in prompt.split("Statements to verify:\n")[1].split("\n\n")[0].split("\n"):
+                number, statement = re.match(r"Claim (\d+) \(.*?\): (.*)", line).groups()
+                # 模拟验证器漏掉某些声明, 以触发单独验证
+                if "museum" not in statement:
+                    verdict = MockGenerator._verdict(statement)
+                    lines.append(f"Claim {number} | Verdict: {verdict} | Corrected Statement: {statement} | Evidence: mock")
+            return "\n".join(lines)
+        if prompt.startswith("Based on the retrieved documents"):
+            statement = prompt.split("Statement to verify: ")[1].split("\n")[0]
+            verdict = MockGenerator._verdict(statement)
+            return f"Verdict: {verdict}\nCorrected Statement: {statement}\nEvidence: mock"
+        return "mock answer"
+
+    @staticmethod
+    def _verdict(statement):
+        return "CONTRADICTED" if "Paris" in statement and "hop two" in statement else "SUPPORTED"
+
+
+class SleepingGenerator(MockGenerator):
+    """每次generate耗时delay秒的mock生成器, 记录每次调用的起止时间"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.intervals = []
+
+    def generate(self, input_list, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.delay)
+        outputs = super().generate(input_list, **kwargs)
+        self.intervals.append((start, time.perf_counter()))
+        return outputs
+
+
+def overlapping(intervals):
+    """所有调用是否在某一时刻同时在执行"""
+    return max(start for start, _ in intervals) < min(end for _, end in intervals)
+
+
+class MockRetriever:
+    """对包含'empty'的查询返回空结果, 以触发查询改写"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def batch_search(self, queries, num=5, **kwargs):
+        self.batch_sizes.append(len(queries))
+        return [
+            [] if "empty" in q and "rewritten" not in q else [{"id": str(i), "contents": f"doc {i} for {q}"} for i in range(num)]
+            for q in queries
+        ]
+
+
+def build_mock_config(**rpvm_overrides):
+    """mock pipeline使用的配置"""
+    rpvm_config = {'max_iter': 3, 'enable_memory_summary': False}
+    rpvm_config.update(rpvm_overrides)
+    return {
+        'rpvm_config': rpvm_config,
+        'device': 'cpu',
+        'framework': 'openai',
+        'generator_model': 'gpt-3.5-turbo',
+        'generator_max_input_len': 4096,
+        'save_dir': '/tmp',
+        'save_retrieval_cache': False,
+        'save_intermediate_data': False,
+        'save_metric_score': False,
+        'metrics': [],
+    }
+
+
+def build_mock_pipeline(**rpvm_overrides):
+    """使用mock检索器/生成器构建RPVMPipeline"""
+    from rpvm_pipeline import RPVMPipeline
+
+    return RPVMPipeline(build_mock_config(**rpvm_overrides), retriever=MockRetriever(), generator=MockGenerator())
+
+
+MOCK_QUESTIONS = ["What is the capital of France?", "Which city hosts the empty museum?", "Where is Paris?"]
+
+# 与运行耗时相关、每次运行都不同的统计字段
+TIMING_STATS = {'wall_time', 'stage_time'}
+
+
+def without_timing(result):
+    """去掉结果中与耗时相关的统计, 以便比较不同调度方式的结果"""
+    stats = {key: value for key, value in result['stats'].items() if key not in TIMING_STATS}
+    return {**result, 'stats': stats}
+
+
+def test_batched_scheduler():
+    """测试跨问题批量调度与顺序执行结果一致"""
+    print("\n测试4: 批量调度...")
+    try:
+        sequential = build_mock_pipeline()
+        expected = [sequential._run_single_question(q) for q in MOCK_QUESTIONS]
+
+        batched = build_mock_pipeline(scheduler='batched', max_active_questions=2)
+        results = batched._run_batched(MOCK_QUESTIONS)
+
+        assert [without_timing(r) for r in results] == [without_timing(r) for r in expected]
+        assert max(batched.generator.batch_sizes) > 1
+        assert len(batched.generator.batch_sizes) < len(sequential.generator.batch_sizes)
+        print("✓ 批量调度结果与顺序执行一致")
+        return True
+    except Exception as e:
+        print(f"✗ 批量调度测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_parallel_verification():
+    """测试并发验证与顺序验证的记忆和迭代记录一致"""
+    print("\n测试5: 并发验证...")
+    try:
+        sequential = build_mock_pipeline()
+        parallel = build_mock_pipeline(parallel_verification=True)
+        for question in MOCK_QUESTIONS:
+            assert without_timing(parallel._run_single_question(question)) == \
+                without_timing(sequential._run_single_question(question))
+
+        # 同一轮的plan应在同一次generate中验证
+        assert max(parallel.generator.batch_sizes) > 1
+        print("✓ 并发验证结果与顺序验证一致")
+        return True
+    except Exception as e:
+        print(f"✗ 并发验证测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_async_run():
+    """测试异步执行与顺序执行结果一致"""
+    print("\n测试6: 异步执行...")
+    try:
+        import asyncio
+        from flashrag.dataset import Dataset
+
+        sequential = build_mock_pipeline()
+        expected = [sequential._run_single_question(q) for q in MOCK_QUESTIONS]
+
+        pipeline = build_mock_pipeline(max_concurrent_requests=2, max_concurrent_retrievals=2)
+        dataset = Dataset(config=pipeline.config, data=[{"question": q} for q in MOCK_QUESTIONS])
+        dataset = asyncio.run(pipeline.arun(dataset, do_eval=False))
+
+        assert dataset.pred == [result['final_answer'] for result in expected]
+        print("✓ 异步执行结果与顺序执行一致")
+        return True
+    except Exception as e:
+        print(f"✗ 异步执行测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_verification_cache():
+    """测试验证缓存: 相同plan和文档不再调用验证器, 磁盘缓存可跨pipeline复用"""
+    print("\n测试7: 验证缓存...")
+    try:
+        import tempfile
+
+        def verifier_calls(pipeline):
+            return sum(1 for r in pipeline.generator.requests if r.startswith("Based on the retrieved documents"))
+
+        cache_path = os.path.join(tempfile.mkdtemp(), "verification_cache.db")
+        pipeline = build_mock_pipeline(verification_cache=True, verification_cache_path=cache_path)
+        question = MOCK_QUESTIONS[0]
+        first = pipeline._run_single_question(question)
+        calls = verifier_calls(pipeline)
+        second = pipeline._run_single_question(question)
+
+        assert first['final_memory'] == second['final_memory']
+        assert first['stats']['verification_cache']['hits'] == 0
+        assert second['stats']['verification_cache'] == {'hits': calls, 'misses': 0}
+        assert verifier_calls(pipeline) == calls
+        print("✓ 内存缓存命中")
+
+        pipeline.verification_cache.close()
+        new_pipeline = build_mock_pipeline(verification_cache=True, verification_cache_path=cache_path)
+        third = new_pipeline._run_single_question(question)
+        assert third['stats']['verification_cache']['misses'] == 0
+        assert verifier_calls(new_pipeline) == 0
+        print("✓ 磁盘缓存跨运行复用")
+        return True
+    except Exception as e:
+        print(f"✗ 验证缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_resume():
+    """测试中间数据逐条写入, 以及续跑时跳过已完成的问题"""
+    print("\n测试8: 中间数据续跑...")
+    try:
+        import json
+        import tempfile
+        from flashrag.dataset import Dataset
+
+        save_dir = tempfile.mkdtemp()
+        data = [{"id": f"q{i}", "question": q} for i, q in enumerate(MOCK_QUESTIONS)]
+
+        def build(**rpvm_overrides):
+            pipeline = build_mock_pipeline(**rpvm_overrides)
+            pipeline.config['save_dir'] = save_dir
+            pipeline.config['save_intermediate_data'] = True
+            return pipeline
+
+        pipeline = build()
+        expected = pipeline.run(Dataset(config=pipeline.config, data=data), do_eval=False).pred
+
+        # 模拟在第二个问题完成后崩溃, 且最后一行只写了一半
+        output_path = os.path.join(save_dir, 'intermediate_data.jsonl')
+        with open(output_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        assert [json.loads(line)['id'] for line in lines] == ["q0", "q1", "q2"]
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines[:2])
+            f.write(lines[2][:10])
+
+        for scheduler in ['sequential', 'batched', 'async']:
+            resumed = build(scheduler=scheduler)
+            dataset = resumed.run(Dataset(config=resumed.config, data=data), do_eval=False, resume=True)
+            assert dataset.pred == expected
+            assert all(MOCK_QUESTIONS[2] in r for r in resumed.generator.requests if r.startswith("Given the question"))
+            with open(output_path, 'r', encoding='utf-8') as f:
+                assert [json.loads(line)['id'] for line in f] == ["q0", "q1", "q2"]
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines[:2])
+            print(f"✓ {scheduler} 续跑只处理未完成的问题")
+        return True
+    except Exception as e:
+        print(f"✗ 中间数据续跑测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_fact_memory():
+    """测试结构化记忆: 增量token计数, 确定性压缩, 超出预算时才摘要"""
+    print("\n测试9: 结构化记忆...")
+    try:
+        from rpvm_memory import FactMemory
+
+        memory = FactMemory(MockTokenizer())
+        memory.add("Paris is the capital of France", 'verified')
+        memory.add("paris is the capital of France.", 'verified')
+        memory.add("The Louvre is in Lyon", 'verified')
+        memory.add("The Louvre is in Paris", 'corrected', source="The Louvre is in Lyon")
+        assert memory.total_tokens == 7 + 7 + 6 + 6
+        assert memory.render() == "\nParis is the capital of France (verified)\nparis is the capital of France. (verified)" \
+            "\nThe Louvre is in Lyon (verified)\nThe Louvre is in Paris (corrected)"
+
+        assert memory.compact() == {'superseded': 1, 'deduplicated': 1}
+        assert memory.render() == "\nParis is the capital of France (verified)\nThe Louvre is in Paris (corrected)"
+        assert memory.total_tokens == 7 + 6
+        print("✓ 去重并删除被纠正覆盖的事实")
+
+        memory.replace_with_summary("Paris: capital of France, home of the Louvre")
+        memory.add("The Seine flows through Paris", 'verified')
+        assert memory.render() == "Paris: capital of France, home of the Louvre\nThe Seine flows through Paris (verified)"
+        print("✓ 摘要后的记忆格式正确")
+
+        # 压缩后仍在预算内时不调用摘要
+        pipeline = build_mock_pipeline(enable_memory_summary=True, memory_max_tokens=1000)
+        result = pipeline._run_single_question(MOCK_QUESTIONS[0])
+        assert result['stats']['memory']['summary_calls'] == 0
+        assert not any(r.startswith("Summarize") for r in pipeline.generator.requests)
+
+        pipeline = build_mock_pipeline(enable_memory_summary=True, memory_max_tokens=5)
+        result = pipeline._run_single_question(MOCK_QUESTIONS[0])
+        assert result['stats']['memory']['summary_calls'] == \
+            sum(1 for r in pipeline.generator.requests if r.startswith("Summarize")) > 0
+        print("✓ 仅在超出预算时调用LLM摘要")
+        return True
+    except Exception as e:
+        print(f"✗ 结构化记忆测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_relevant_memory_injection():
+    """测试planner只注入与问题相关的记忆, 并按阶段统计prompt token数"""
+    print("\n测试10: 相关记忆注入...")
+    try:
+        import numpy as np
+        from rpvm_memory import FactMemory
+
+        class MockEncoder:
+            """按词表计数的mock编码器"""
+            vocab = ["capital", "france", "louvre", "seine"]
+
+            def __init__(self):
+                self.encoded = []
+
+            def encode(self, query_list, batch_size=64, is_query=True):
+                self.encoded.extend(query_list)
+                return np.array([[t.lower().count(w) for w in self.vocab] for t in query_list], dtype=np.float32)
+
+        pipeline = build_mock_pipeline(memory_injection='relevant', memory_injection_topk=1)
+        memory = FactMemory(MockTokenizer())
+        memory.add("The Seine flows through Paris", 'verified')
+        memory.add("Paris is the capital of France", 'verified')
+        assert pipeline._memory_view(memory, "What is the capital of France?") == "\nParis is the capital of France (verified)"
+        print("✓ 词重叠度选取相关事实")
+
+        pipeline.retriever.encoder = MockEncoder()
+        assert pipeline._memory_view(memory, "Which river is the Seine?") == "\nThe Seine flows through Paris (verified)"
+        memory.add("The Louvre is a museum", 'verified')
+        assert pipeline._memory_view(memory, "Where is the Louvre?") == "\nThe Louvre is a museum (verified)"
+        assert pipeline.retriever.encoder.encoded.count("The Seine flows through Paris") == 1
+        print("✓ 编码器选取相关事实, 事实向量只计算一次")
+
+        filtered = build_mock_pipeline(memory_injection='relevant', memory_injection_topk=1)
+        result = filtered._run_single_question(MOCK_QUESTIONS[0])
+        planner_prompts = [r for r in filtered.generator.requests if r.startswith("Given the question")]
+        assert all(p.count("(verified)") + p.count("(corrected)") <= 1 for p in planner_prompts)
+        # 14: planner系统提示的token数
+        assert result['stats']['prompt_tokens']['planner'] == sum(
+            len(MockTokenizer.encode(p)) + 14 for p in planner_prompts
+        )
+        assert 'verifier' in result['stats']['prompt_tokens']
+        print("✓ 按阶段统计prompt token数")
+        return True
+    except Exception as e:
+        print(f"✗ 相关记忆注入测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_multi_claim_verification():
+    """测试多声明验证: 一次验证请求验证一轮所有plan, 结果与逐个验证一致"""
+    print("\n测试11: 多声明验证...")
+    try:
+        def verifier_calls(pipeline):
+            return sum(1 for r in pipeline.generator.requests if r.startswith("Based on the retrieved documents"))
+
+        for question in MOCK_QUESTIONS:
+            single = build_mock_pipeline()
+            joint = build_mock_pipeline(verification_mode='multi_claim')
+            expected = single._run_single_question(question)
+            result = joint._run_single_question(question)
+            assert result['final_memory'] == expected['final_memory']
+            assert result['iterations'] == expected['iterations']
+            if "museum" not in question:
+                assert verifier_calls(joint) < verifier_calls(single)
+        print("✓ 结果与逐个验证一致, 验证请求数减少")
+
+        joint = build_mock_pipeline(verification_mode='multi_claim')
+        result = joint._run_single_question("Which museum is the largest?")
+        assert result['stats']['multi_claim']['fallbacks'] == 2
+        assert verifier_calls(joint) == 3
+        print("✓ 无法解析的声明退回单独验证")
+
+        parsed = joint._parse_claim_verifications(
+            "Claim 2 | Verdict: CONTRADICTED | Corrected Statement: B2 | Evidence: e\nClaim 1: SUPPORTED\nClaim 5 | Verdict: SUPPORTED",
+            ["A", "B"]
+        )
+        assert parsed == {1: ("contradicted", "B2", "e")}
+        print("✓ 逐声明解析")
+        return True
+    except Exception as e:
+        print(f"✗ 多声明验证测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_speculative_answer():
+    """测试推测生成最终答案: planner返回ANSWER_READY时采用, 否则丢弃并记录浪费的token"""
+    print("\n测试12: 推测生成答案...")
+    try:
+        def answer_calls(pipeline):
+            return sum(1 for r in pipeline.generator.requests if r.startswith("Based on the verified facts"))
+
+        for question in MOCK_QUESTIONS:
+            baseline = build_mock_pipeline()
+            speculative = build_mock_pipeline(speculative_answer=True)
+            expected = baseline._run_single_question(question)
+            result = speculative._run_single_question(question)
+            assert result['final_answer'] == expected['final_answer']
+            assert result['iterations'] == expected['iterations']
+            assert answer_calls(speculative) == answer_calls(baseline) == 1
+            assert result['stats']['speculation']['hits'] == 1
+            assert result['stats']['speculation']['wasted_token_ratio'] == 0.0
+        print("✓ planner返回ANSWER_READY时采用推测的答案")
+
+        # planner只看到一条事实, 永远不会返回ANSWER_READY
+        speculative = build_mock_pipeline(speculative_answer=True, memory_injection='relevant', memory_injection_topk=1)
+        result = speculative._run_single_question(MOCK_QUESTIONS[0])
+        speculation = result['stats']['speculation']
+        assert speculation['attempts'] == 2 and speculation['hits'] == 0
+        assert speculation['wasted_tokens'] == speculation['speculative_tokens'] > 0
+        assert speculation['wasted_token_ratio'] == 1.0
+        assert result['iterations'][-1]['plans'] != 'ANSWER_READY'
+        print("✓ 推测失败时丢弃答案并记录浪费的token")
+        return True
+    except Exception as e:
+        print(f"✗ 推测生成答案测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_cassette_replay():
+    """测试录制/回放: 回放结果与录制运行一致, 基准脚本输出吞吐和延迟统计"""
+    print("\n测试13: 录制回放与离线基准...")
+    try:
+        import tempfile
+        import warnings
+        from flashrag.dataset import Dataset
+        from rpvm_pipeline import RPVMPipeline
+        from benchmark_rpvm import run_benchmark
+
+        cassette_path = os.path.join(tempfile.mkdtemp(), "mock.cassette.jsonl")
+        recording = build_mock_pipeline(cassette_mode='record', cassette_path=cassette_path)
+        data = [{"id": f"q{i}", "question": q, "golden_answers": ["Paris"]} for i, q in enumerate(MOCK_QUESTIONS)]
+        expected = recording.run(Dataset(config=recording.config, data=data), do_eval=False).pred
+        print("✓ 录制完成")
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for scheduler in ['sequential', 'batched', 'async']:
+                config = build_mock_config(cassette_mode='replay', cassette_path=cassette_path, scheduler=scheduler)
+                replay = RPVMPipeline(config)
+                dataset = Dataset(config=config, data=replay.cassette.questions)
+                assert replay.run(dataset, do_eval=False).pred == expected
+            print("✓ 回放结果与录制一致(不需要生成器和检索器)")
+
+            report = run_benchmark(
+                build_mock_config(), cassette_path, scheduler='async', concurrency=4,
+                llm_latency={'distribution': 'uniform', 'mean': 0.01, 'spread': 0.005}
+            )
+        assert report['questions'] == len(MOCK_QUESTIONS)
+        assert report['questions_per_second'] > 0
+        assert report['latency_p95'] >= report['latency_p50'] > 0
+        assert report['llm_calls_per_question']['planner'] >= 1
+        assert report['retrievals_per_question'] >= 2
+        print("✓ 离线基准统计")
+
+        # 续跑时录制追加到已有的cassette
+        from rpvm_cassette import Cassette
+        save_dir = tempfile.mkdtemp()
+        resume_path = os.path.join(save_dir, "resume.cassette.jsonl")
+        for resume, items in [(False, data[:2]), (True, data)]:
+            pipeline = build_mock_pipeline(cassette_mode='record', cassette_path=resume_path)
+            pipeline.config['save_dir'] = save_dir
+            pipeline.config['save_intermediate_data'] = True
+            pipeline.run(Dataset(config=pipeline.config, data=items), do_eval=False, resume=resume)
+        assert [item['id'] for item in Cassette.load(resume_path).questions] == ["q0", "q1", "q2"]
+        print("✓ 续跑录制保留已录制的请求")
+        return True
+    except Exception as e:
+        print(f"✗ 录制回放测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_stage_instrumentation():
+    """测试各阶段的调用次数、token数(优先使用API usage)和耗时统计, 以及汇总表"""
+    print("\n测试14: 阶段开销统计...")
+    try:
+        import tempfile
+        from flashrag.dataset import Dataset
+        from run_rpvm_exp import summarize_stages, write_stage_summary
+
+        class UsageGenerator(MockGenerator):
+            """返回固定usage的mock生成器"""
+
+            def generate(self, input_list, return_usage=False, **kwargs):
+                outputs = super().generate(input_list, **kwargs)
+                usages = [{'prompt_tokens': 7, 'completion_tokens': 3}] * len(outputs)
+                return (outputs, usages) if return_usage else outputs
+
+        pipeline = build_mock_pipeline()
+        pipeline.generator = UsageGenerator()
+        pipeline._generator_returns_usage = True
+        stats = pipeline._run_single_question(MOCK_QUESTIONS[1])['stats']
+        for stage, calls in stats['llm_calls'].items():
+            assert stats['prompt_tokens'][stage] == 7 * calls
+            assert stats['completion_tokens'][stage] == 3 * calls
+        assert {'planner', 'rewrite', 'verifier', 'final_answer', 'retrieval'} <= set(stats['stage_time'])
+        print("✓ 使用API usage统计token数, 记录各阶段耗时")
+
+        save_dir = tempfile.mkdtemp()
+        pipeline = build_mock_pipeline()
+        pipeline.config['save_dir'] = save_dir
+        pipeline.config['save_intermediate_data'] = True
+        data = [{"id": f"q{i}", "question": q} for i, q in enumerate(MOCK_QUESTIONS)]
+        pipeline.run(Dataset(config=pipeline.config, data=data), do_eval=False)
+        write_stage_summary(save_dir)
+        with open(os.path.join(save_dir, 'stage_summary.txt'), 'r', encoding='utf-8') as f:
+            summary = f.read()
+        assert 'planner' in summary and 'retrieval' in summary and 'question' in summary
+
+        import json
+        with open(os.path.join(save_dir, 'intermediate_data.jsonl'), 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        rows = {row['stage']: row for row in summarize_stages(records)}
+        assert rows['retrieval']['calls'] == sum(r['total_retrievals'] for r in records)
+        assert rows['planner']['calls'] == sum(r['llm_calls']['planner'] for r in records)
+        assert rows['question']['time_p95'] >= rows['question']['time_p50']
+        print("✓ 阶段汇总表")
+        return True
+    except Exception as e:
+        print(f"✗ 阶段开销统计测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_question_budget():
+    """测试单个问题的预算: 用量接近上限时依次降级, 并记录各降级步骤的触发次数"""
+    print("\n测试15: 问题预算与降级...")
+    try:
+        question = MOCK_QUESTIONS[1]
+        unlimited = build_mock_pipeline(enable_memory_summary=True, memory_max_tokens=5)
+        result = unlimited._run_single_question(question)
+        assert 'degradations' not in result['stats']
+        unlimited_calls = sum(result['stats']['llm_calls'].values())
+
+        pipeline = build_mock_pipeline(enable_memory_summary=True, memory_max_tokens=5, budget_max_calls=4)
+        result = pipeline._run_single_question(question)
+        degradations = result['stats']['degradations']
+        assert degradations['skip_rewrite'] >= 1 and degradations['best_effort'] == 1
+        assert sum(result['stats']['llm_calls'].values()) <= 5 < unlimited_calls
+        assert result['iterations'][-1]['plans'] != 'ANSWER_READY'
+        print("✓ 调用次数预算: 跳过改写并提前尽力回答")
+
+        pipeline = build_mock_pipeline(budget_max_tokens=10 ** 6, budget_degrade_thresholds=[0.0, 0.0, 2.0, 2.0])
+        result = pipeline._run_single_question(MOCK_QUESTIONS[0])
+        assert all(len(iteration['verifications']) == 1 for iteration in result['iterations'] if 'verifications' in iteration)
+        assert result['stats']['degradations']['single_plan'] >= 1
+        print("✓ 每轮只验证第一个plan")
+
+        pipeline = build_mock_pipeline(budget_max_seconds=1e-9)
+        result = pipeline._run_single_question(question)
+        assert result['stats']['llm_calls'] == {'final_answer': 1}
+        assert result['stats']['degradations']['best_effort'] == 1
+        print("✓ 时间预算耗尽时直接尽力回答")
+
+        import time
+
+        class SlowGenerator(MockGenerator):
+            """每次generate耗时0.05秒的mock生成器"""
+
+            def generate(self, input_list, **kwargs):
+                time.sleep(0.05)
+                return super().generate(input_list, **kwargs)
+
+        pipeline = build_mock_pipeline()
+        pipeline.generator = SlowGenerator()
+        result = pipeline._run_single_question(question)
+        unlimited_calls = len(pipeline.generator.batch_sizes)
+        # wall_time从问题开始计时, 而不是只计最后一个请求
+        assert result['stats']['wall_time'] >= 0.05 * unlimited_calls
+
+        pipeline = build_mock_pipeline(budget_max_seconds=0.12)
+        pipeline.generator = SlowGenerator()
+        result = pipeline._run_single_question(question)
+        assert result['stats']['degradations']['best_effort'] == 1
+        assert len(pipeline.generator.batch_sizes) < unlimited_calls
+        print("✓ 时间预算按问题总耗时计算")
+        return True
+    except Exception as e:
+        print(f"✗ 问题预算测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_evidence_packing():
+    """测试验证证据打包: 按plan选取相关句子并保留标题, 证据不超过token预算且记录节省的token数"""
+    print("\n测试16: 验证证据打包...")
+    try:
+        from rpvm_evidence import EvidencePacker
+        from rpvm_pipeline import RPVMPipeline
+
+        docs = [
+            {"id": "0", "contents": '"France"\nFrance is a country in Europe. The capital of France is Paris. '
+                                    'France borders Spain and Italy. Its currency is the euro.'},
+            {"id": "1", "contents": '"Cuisine"\nFrench cuisine is famous worldwide. Cheese and wine are common. '
+                                    'Bread is served with most meals.'},
+        ]
+        # ExtractiveRefiner的分句结果不变, 证据打包使用只保护单字母缩写的规则
+        from flashrag.refiner import ExtractiveRefiner
+        text = "The U.S. capital is Washington. J. Smith lives in Paris. It is old."
+        assert ExtractiveRefiner.split_sentences(text) == [
+            i.strip() for i in re.split(r"(?<![A-Za-z]\.)(?<=[.!?])\s+", text) if len(i.strip()) > 5
+        ]
+        assert EvidencePacker.split_doc({"contents": '"T"\n' + text})[1] == [
+            "The U.S. capital is Washington.", "J. Smith lives in Paris.", "It is old."
+        ]
+
+        packer = EvidencePacker(MockTokenizer())
+        full_text, counts = packer.pack("capital of France", docs, max_tokens=1000)
+        assert full_text == EvidencePacker.format_docs(docs) and counts['packed_tokens'] == counts['original_tokens']
+
+        packed, counts = packer.pack("capital of France", docs, max_tokens=12)
+        assert packed == "Document 1 (Title: France): The capital of France is Paris."
+        assert counts['packed_tokens'] <= 12 < counts['original_tokens']
+        print("✓ 预算内选取最相关的句子并保留标题")
+
+        class LongDocRetriever(MockRetriever):
+            def batch_search(self, queries, num=5, **kwargs):
+                return [[{"id": f"{q}-{i}", "contents": f'"Doc {i}"\n{q} fact {i}. Unrelated filler sentence number {i}. '
+                                                         f'More padding that the verifier does not need.'}
+                         for i in range(num)] for q in queries]
+
+        pipeline = RPVMPipeline(build_mock_config(evidence_max_tokens=30), retriever=LongDocRetriever(),
+                                generator=MockGenerator())
+        result = pipeline._run_single_question(MOCK_QUESTIONS[0])
+        evidence = result['stats']['evidence']
+        assert evidence['packed_calls'] == result['stats']['llm_calls']['verifier'] == len(evidence['saved_tokens'])
+        assert evidence['original_tokens'] - evidence['packed_tokens'] == sum(evidence['saved_tokens']) > 0
+        prompts = [r for r in pipeline.generator.requests if r.startswith("Based on the retrieved documents")]
+        assert all("Unrelated filler" not in r and "(Title: Doc" in r for r in prompts)
+
+        baseline = RPVMPipeline(build_mock_config(), retriever=LongDocRetriever(), generator=MockGenerator())
+        assert result['final_answer'] == baseline._run_single_question(MOCK_QUESTIONS[0])['final_answer']
+        print(f"✓ 验证器证据token: {evidence['original_tokens']} -> {evidence['packed_tokens']}")
+
+        pipeline = RPVMPipeline(build_mock_config(evidence_max_tokens=30, verification_mode='multi_claim'),
+                                retriever=LongDocRetriever(), generator=MockGenerator())
+        result = pipeline._run_single_question(MOCK_QUESTIONS[0])
+        assert result['stats']['multi_claim']['joint_calls'] >= 1 and result['stats']['evidence']['packed_calls'] >= 1
+        print("✓ 多声明验证的证据池同样打包")
+        return True
+    except Exception as e:
+        print(f"✗ 验证证据打包测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_concurrent_request_groups():
+    """测试一步中不同生成参数的请求组(如改写和验证)并发执行, 结果仍按请求顺序返回"""
+    print("\n测试17: 请求组并发执行...")
+    try:
+        pipeline = build_mock_pipeline()
+        pipeline.generator = SleepingGenerator(0.3)
+
+        def user_message(content):
+            return [{'role': 'user', 'content': content}]
+
+        requests = [
+            pipeline._llm_request('rewrite', user_message("Rewrite it.\nOriginal statement: a\n"), temperature=0.5, max_tokens=100),
+            pipeline._llm_request(
+                'verifier', user_message("Based on the retrieved documents\nStatement to verify: b\n"),
+                temperature=0.3, max_tokens=300
+            ),
+            pipeline._retrieval_request("b", 2),
+            pipeline._llm_request('rewrite', user_message("Rewrite it.\nOriginal statement: c\n"), temperature=0.5, max_tokens=100),
+        ]
+        start = time.perf_counter()
+        responses = pipeline._execute_requests(requests)
+        elapsed = time.perf_counter() - start
+
+        assert responses[0] == "a rewritten" and responses[3] == "c rewritten"
+        assert responses[1].startswith("Verdict: SUPPORTED") and len(responses[2]) == 2
+        assert sorted(pipeline.generator.batch_sizes) == [1, 2]
+        # 两个组逐个执行需要0.6秒
+        assert overlapping(pipeline.generator.intervals) and elapsed < 0.5, f"耗时{elapsed:.2f}秒"
+        print(f"✓ 改写和验证两组请求并发执行, 耗时{elapsed:.2f}秒")
+        return True
+    except Exception as e:
+        print(f"✗ 请求组并发执行测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_speculative_answer_overlap():
+    """测试推测生成答案在sequential和batched调度下与planner并发执行, 确实减少耗时"""
+    print("\n测试18: 推测答案并发...")
+    try:
+        question = MOCK_QUESTIONS[0]
+
+        def timed_run(scheduler, **rpvm_overrides):
+            pipeline = build_mock_pipeline(scheduler=scheduler, **rpvm_overrides)
+            pipeline.generator = SleepingGenerator(0.2)
+            start = time.perf_counter()
+            if scheduler == 'batched':
+                result = pipeline._run_batched([question])[0]
+            else:
+                result = pipeline._run_single_question(question)
+            return result, time.perf_counter() - start, pipeline.generator.intervals
+
+        for scheduler in ['sequential', 'batched']:
+            expected, baseline_time, baseline_intervals = timed_run(scheduler)
+            result, speculative_time, intervals = timed_run(scheduler, speculative_answer=True)
+            assert result['final_answer'] == expected['final_answer']
+            assert result['stats']['speculation']['hits'] == 1
+            # 最后的planner和推测答案同时在执行, 省去一次0.2秒的串行调用
+            assert len(intervals) == len(baseline_intervals) and overlapping(intervals[-2:])
+            assert speculative_time < baseline_time - 0.1, f"{speculative_time:.2f}秒 vs {baseline_time:.2f}秒"
+            print(f"✓ {scheduler}: 推测 {speculative_time:.2f}秒 vs 不推测 {baseline_time:.2f}秒")
+        return True
+    except Exception as e:
+        print(f"✗ 推测答案并发测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def test_file_structure():
     """测试文件结构"""
-    print("\n测试4: 文件结构...")
-    
+    print("\n测试19: 文件结构...")
+
     base_dir = os.path.dirname(__file__)
     required_files = [
         "rpvm_config.yaml",
         "rpvm_pipeline.py",
+        "rpvm_cache.py",
+        "rpvm_memory.py",
+        "rpvm_cassette.py",
+        "rpvm_evidence.py",
+        "benchmark_rpvm.py",
         "run_rpvm_exp.py",
         "simple_example.py",
         "README.md",
         "PVM.md",
         "需求文档.md"
     ]
-    
+
     all_exist = True
     for file in required_files:
         file_path = os.path.join(base_dir, file)
@@ -182,7 +934,7 @@ def test_file_structure():
         else:
             print(f"✗ {file} 不存在")
             all_exist = False
-    
+
     return all_exist
 
 
@@ -191,36 +943,81 @@ def run_all_tests():
     print("=" * 60)
     print("RPVM 基本功能测试")
     print("=" * 60)
-    
+
     results = []
-    
+
     # 测试1: 导入
     results.append(("导入测试", test_imports()))
-    
+
     # 测试2: 配置
     results.append(("配置加载", test_config_loading()))
-    
+
     # 测试3: Prompt构建
     results.append(("Prompt构建", test_prompt_building()))
-    
-    # 测试4: 文件结构
+
+    # 测试4: 批量调度
+    results.append(("批量调度", test_batched_scheduler()))
+
+    # 测试5: 并发验证
+    results.append(("并发验证", test_parallel_verification()))
+
+    # 测试6: 异步执行
+    results.append(("异步执行", test_async_run()))
+
+    # 测试7: 验证缓存
+    results.append(("验证缓存", test_verification_cache()))
+
+    # 测试8: 中间数据续跑
+    results.append(("中间数据续跑", test_resume()))
+
+    # 测试9: 结构化记忆
+    results.append(("结构化记忆", test_fact_memory()))
+
+    # 测试10: 相关记忆注入
+    results.append(("相关记忆注入", test_relevant_memory_injection()))
+
+    # 测试11: 多声明验证
+    results.append(("多声明验证", test_multi_claim_verification()))
+
+    # 测试12: 推测生成答案
+    results.append(("推测生成答案", test_speculative_answer()))
+
+    # 测试13: 录制回放与离线基准
+    results.append(("录制回放与离线基准", test_cassette_replay()))
+
+    # 测试14: 阶段开销统计
+    results.append(("阶段开销统计", test_stage_instrumentation()))
+
+    # 测试15: 问题预算与降级
+    results.append(("问题预算与降级", test_question_budget()))
+
+    # 测试16: 验证证据打包
+    results.append(("验证证据打包", test_evidence_packing()))
+
+    # 测试17: 请求组并发执行
+    results.append(("请求组并发执行", test_concurrent_request_groups()))
+
+    # 测试18: 推测答案并发
+    results.append(("推测答案并发", test_speculative_answer_overlap()))
+
+    # 测试19: 文件结构
     results.append(("文件结构", test_file_structure()))
-    
+
     # 汇总结果
     print("\n" + "=" * 60)
     print("测试汇总")
     print("=" * 60)
-    
+
     passed = sum(1 for _, result in results if result)
     total = len(results)
-    
+
     for test_name, result in results:
         status = "✓ 通过" if result else "✗ 失败"
         print(f"{test_name}: {status}")
-    
+
     print("-" * 60)
     print(f"总计: {passed}/{total} 测试通过")
-    
+
     if passed == total:
         print("\n🎉 所有测试通过！RPVM实现已准备就绪。")
         print("\n下一步:")
@@ -230,7 +1027,7 @@ def run_all_tests():
         print("4. 运行 python simple_example.py 测试")
     else:
         print("\n⚠️  部分测试失败，请检查上述错误信息。")
-    
+
     print("=" * 60)
 
 
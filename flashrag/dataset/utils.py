@@ -4,7 +4,10 @@ from flashrag.dataset import Dataset
 
 
 def convert_numpy(data: Any) -> Any:
-    if isinstance(data, dict):
+    if hasattr(data, "to_json"):
+        # compact retrieval results are saved as ids and scores
+        return data.to_json()
+    elif isinstance(data, dict):
         return {key: convert_numpy(value) for key, value in data.items()}
     elif isinstance(data, list):
         return [convert_numpy(element) for element in data]
@@ -64,33 +64,28 @@ class OpenaiGenerator:
         pass
     
     async def _get_response(self, messages: Union[list, str], mode: str = 'chat', **params):
-        print(messages)
-        print("----asd-asd-a--------")
         if mode == 'chat':
             response = await self.client.chat.completions.create(
                 model=self.model_name, messages=messages, **params
             )
-            if not response.choices:
-                raise ValueError("No choices returned from API.")
-            return response.choices[0]
         else:
             response = await self.client.completions.create(
                 model=self.model_name, prompt=messages, **params
             )
-            if not response.choices:
-                raise ValueError("No choices returned from API.")
-            return response.choices[0]
+        if not response.choices:
+            raise ValueError("No choices returned from API.")
+        return response.choices[0], response.usage
 
     async def _get_batch_response(self, input_list: List[List], batch_size, mode, **params):
         tasks = [self._get_response(messages, mode, **params) for messages in input_list]
         all_results = []
-        for idx in tqdm(range(0, len(tasks), batch_size), desc="Generation process: "):
+        for idx in tqdm(range(0, len(tasks), batch_size), desc="Generation process: ", disable=len(tasks) <= batch_size):
             batch_tasks = tasks[idx: idx + batch_size]
             batch_results = await asyncio.gather(*batch_tasks)
             all_results.extend(batch_results)
         return all_results
 
-    async def _generate_async(self, input_list: List, batch_size=None, return_scores=False, **params) -> List[str]:
+    async def _generate_async(self, input_list: List, batch_size=None, return_scores=False, return_usage=False, **params) -> List[str]:
         if isinstance(input_list, dict):
             input_list = [[input_list]]
         elif isinstance(input_list[0], dict):
@@ -125,7 +120,12 @@ class OpenaiGenerator:
 
         response_texts = []
         scores = []
-        for res in results:
+        usages = []
+        for res, usage in results:
+            usages.append(
+                {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+                if usage is not None else None
+            )
             if mode == 'chat':
                 text = res.message.content
             else:
@@ -141,13 +141,21 @@ class OpenaiGenerator:
                 except:
                     warnings.warn('Fail to get logprobs in openai generation!')
                     scores.append(None)
-        return (response_texts, scores) if return_scores else response_texts
+        outputs = (response_texts,)
+        if return_scores:
+            outputs += (scores,)
+        if return_usage:
+            # token usage reported by the API, None when the endpoint does not return it
+            outputs += (usages,)
+        return outputs if len(outputs) > 1 else response_texts
 
     # ----------------- 同步包装接口 -----------------
-    def generate(self, input_list: List, batch_size=None, return_scores=False, **params) -> List[str]:
+    def generate(self, input_list: List, batch_size=None, return_scores=False, return_usage=False, **params) -> List[str]:
         loop = get_background_loop()
         future = asyncio.run_coroutine_threadsafe(
-            self._generate_async(input_list, batch_size=batch_size, return_scores=return_scores, **params),
+            self._generate_async(
+                input_list, batch_size=batch_size, return_scores=return_scores, return_usage=return_usage, **params
+            ),
             loop
         )
         return future.result()
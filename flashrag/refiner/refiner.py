@@ -157,6 +157,13 @@ class ExtractiveRefiner(BaseRefiner):
             use_fp16=True
         )
 
+    SENTENCE_SPLIT_PATTERN = r"(?<![A-Za-z]\.)(?<=[.!?])\s+"
+
+    @staticmethod
+    def split_sentences(text: str, pattern: str = SENTENCE_SPLIT_PATTERN) -> List[str]:
+        """Split text into sentences at ``pattern``, dropping fragments of 5 characters or fewer."""
+        return [i.strip() for i in re.split(pattern, text) if len(i.strip()) > 5]
+
     def batch_run(self, dataset, batch_size=16):
         questions = dataset.question
         # only use text
@@ -167,10 +174,7 @@ class ExtractiveRefiner(BaseRefiner):
         ]
 
         # split into sentences: [[sent1, sent2,...], [...]]
-        sent_lists = [
-            [i.strip() for i in re.split(r"(?<![A-Za-z]\.)(?<=[.!?])\s+", " ".join(res)) if len(i.strip()) > 5]
-            for res in retrieval_results
-        ]
+        sent_lists = [self.split_sentences(" ".join(res)) for res in retrieval_results]
         score_lists = []  # matching scores, size == sent_lists
         for idx in tqdm(range(0, len(questions), batch_size), desc="Refining process: "):
             batch_questions = questions[idx : idx + batch_size]
@@ -1,3 +1,4 @@
 from flashrag.retriever.retriever import *
 from flashrag.retriever.reranker import *
+from flashrag.retriever.dispatcher import *
 from flashrag.retriever.utils import *
\ No newline at end of file
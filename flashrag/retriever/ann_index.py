@@ -0,0 +1,268 @@
+import re
+import json
+import time
+import math
+import argparse
+import warnings
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+
+# names tried in order for each search parameter: IndexRefine uses k_factor_rf, IVFPQR uses k_factor
+_PARAMETER_NAMES = {
+    "nprobe": ["nprobe"],
+    "efSearch": ["efSearch"],
+    "k_factor": ["k_factor_rf", "k_factor"],
+}
+
+
+def set_search_params(index, nprobe: Optional[int] = None, efSearch: Optional[int] = None, k_factor: Optional[int] = None):
+    """Apply search-time ANN parameters to a loaded faiss index through ``faiss.ParameterSpace``.
+
+    Parameters left as None keep the faiss defaults; parameters that do not apply to the index type
+    (e.g. nprobe on an HNSW index) are skipped with a warning. Set them on the CPU index before moving
+    it to GPU, the cloner keeps nprobe.
+    """
+    params = {"nprobe": nprobe, "efSearch": efSearch, "k_factor": k_factor}
+    params = {name: value for name, value in params.items() if value is not None}
+    if not params:
+        return index
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        for faiss_name in _PARAMETER_NAMES[name]:
+            try:
+                space.set_index_parameter(index, faiss_name, value)
+                break
+            except RuntimeError:
+                continue
+        else:
+            warnings.warn(f"Search parameter {name} does not apply to {type(index).__name__}, ignored.")
+    return index
+
+
+def read_faiss_index(index_path: str, mmap: bool = False):
+    """Load a faiss index; with ``mmap`` the codes stay on disk and are paged in on demand.
+
+    Flat, scalar-quantized and PQ codes are mapped with ``IO_FLAG_MMAP_IFC`` and IVF inverted lists with
+    ``IO_FLAG_MMAP``, so the index is shared through the page cache instead of being copied into RAM.
+    Index types that cannot be mapped are read normally.
+    """
+    if not mmap:
+        return faiss.read_index(index_path)
+    io_flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(index_path, io_flags)
+    except RuntimeError as e:
+        warnings.warn(f"Index {index_path} cannot be memory-mapped, reading it into memory: {e}")
+        return faiss.read_index(index_path)
+
+
+class ExactRescorer:
+    """Re-scores ANN candidates with exact inner products against the float32 corpus embeddings.
+
+    The embeddings are the ``emb_<method>.memmap`` saved by ``Index_Builder``; only the candidate rows
+    are read, so quantized indexes keep their small memory footprint while returning exact scores.
+    """
+
+    def __init__(self, embedding_path: str, dim: int):
+        self.embeddings = np.memmap(embedding_path, mode="r", dtype=np.float32).reshape(-1, dim)
+
+    def rescore(self, queries: np.ndarray, idxs: np.ndarray, k: int):
+        """Keep the ``k`` best of the candidate ``idxs`` (-1 for missing) of each query, by exact score."""
+        candidates = self.embeddings[np.maximum(idxs, 0).reshape(-1)].reshape(*idxs.shape, -1)
+        scores = np.einsum("qd,qcd->qc", queries.astype(np.float32), candidates)
+        scores[idxs < 0] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idxs, order, axis=1)
+
+
+# compressed index variants built by Index_Builder --faiss_variants
+QUANTIZED_VARIANTS = ("sq8", "fp16", "opq_pq")
+
+
+def quantized_faiss_type(variant: str, dim: int) -> str:
+    """Factory string of a compressed variant: 8-bit or fp16 scalar quantization, or OPQ rotation + PQ."""
+    if variant == "sq8":
+        return "SQ8"
+    if variant == "fp16":
+        return "SQfp16"
+    if variant == "opq_pq":
+        m = next(m for m in (64, 48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0 and m <= max(dim // 4, 1))
+        return f"OPQ{m},PQ{m}"
+    raise ValueError(f"Unknown index variant {variant}, choose from {QUANTIZED_VARIANTS}")
+
+
+def faiss_type_file_name(faiss_type: str) -> str:
+    """Factory string made safe for file names and comma-separated path lists: ``OPQ64,PQ64`` -> ``OPQ64_PQ64``."""
+    return faiss_type.replace(",", "_")
+
+
+def choose_faiss_type(num_vectors: int, dim: int, memory_budget_gb: Optional[float] = None) -> str:
+    """Pick a faiss factory string for ``faiss_type='auto'`` from the corpus size and a memory budget.
+
+    - up to 100k vectors: ``Flat`` (exact search is already fast)
+    - up to 5M vectors whose HNSW graph fits the budget: ``HNSW32``
+    - vectors that fit the budget uncompressed: ``IVF<nlist>,Flat``
+    - otherwise: ``IVF<nlist>,PQ<m>`` with the largest m whose codes fit the budget
+    """
+    flat_bytes = num_vectors * dim * 4
+    budget = math.inf if memory_budget_gb is None else memory_budget_gb * 1024**3
+    if num_vectors <= 100_000 and flat_bytes <= budget:
+        return "Flat"
+    # HNSW32 keeps the vectors plus 2 * 32 neighbour ids per vector on the base level
+    if num_vectors <= 5_000_000 and flat_bytes + num_vectors * 64 * 4 <= budget:
+        return "HNSW32"
+
+    nlist = suggest_nlist(num_vectors)
+    if flat_bytes <= budget:
+        return f"IVF{nlist},Flat"
+    candidates = [m for m in (64, 48, 32, 24, 16, 8, 4) if dim % m == 0 and num_vectors * m <= budget]
+    if not candidates:
+        warnings.warn(f"No PQ code size fits the memory budget of {memory_budget_gb} GB, using the smallest one.")
+        candidates = [m for m in (4, 2, 1) if dim % m == 0]
+    return f"IVF{nlist},PQ{candidates[0]}"
+
+
+def suggest_nlist(num_vectors: int) -> int:
+    """Number of IVF lists: about 4 * sqrt(n), rounded to a power of two."""
+    return int(2 ** round(math.log2(max(4 * math.sqrt(num_vectors), 1))))
+
+
+# faiss subsamples k-means to 256 points per centroid, e.g. 256 * 256 for the 256 centroids of each PQ sub-quantizer
+MAX_POINTS_PER_CENTROID = 256
+DEFAULT_MAX_TRAIN_SIZE = 256 * MAX_POINTS_PER_CENTROID
+
+
+def train_sample(
+    embeddings: np.ndarray,
+    index,
+    max_train_size: Optional[int] = None,
+    seed: int = 2024,
+    faiss_type: Optional[str] = None,
+) -> np.ndarray:
+    """Rows used to train ``index``: a random subset for large corpora instead of the whole matrix.
+
+    By default 256 points per IVF list are kept (faiss itself subsamples k-means to this size), so the
+    memory-mapped embeddings are not read in full just for training. ``nlist`` is taken from the index,
+    or from the ``IVF<nlist>`` part of ``faiss_type`` when the IVF cannot be extracted (GPU clones and
+    shards); indexes without IVF lists (PQ, OPQ, SQ) are trained on at most ``DEFAULT_MAX_TRAIN_SIZE`` rows.
+    """
+    if max_train_size is None:
+        ivf = faiss.try_extract_index_ivf(index)
+        match = re.search(r"IVF(\d+)", faiss_type) if faiss_type is not None else None
+        if ivf is not None:
+            max_train_size = ivf.nlist * MAX_POINTS_PER_CENTROID
+        elif match is not None:
+            max_train_size = int(match.group(1)) * MAX_POINTS_PER_CENTROID
+        else:
+            max_train_size = DEFAULT_MAX_TRAIN_SIZE
+    if len(embeddings) <= max_train_size:
+        return embeddings
+    rng = np.random.default_rng(seed)
+    sample_ids = np.sort(rng.choice(len(embeddings), size=max_train_size, replace=False))
+    return np.ascontiguousarray(embeddings[sample_ids], dtype=np.float32)
+
+
+def exact_search(embeddings: np.ndarray, queries: np.ndarray, topk: int) -> np.ndarray:
+    """Ground-truth ids of exact inner-product search, adding the (memory-mapped) embeddings in chunks."""
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    for start in range(0, len(embeddings), 100_000):
+        exact.add(np.ascontiguousarray(embeddings[start : start + 100_000], dtype=np.float32))
+    _, truth = exact.search(queries, topk)
+    return truth
+
+
+def recall_at_k(idxs: np.ndarray, truth: np.ndarray) -> float:
+    topk = truth.shape[1]
+    return float(np.mean([len(set(row[:topk]) & set(true_row)) / topk for row, true_row in zip(idxs, truth)]))
+
+
+def sample_queries(embeddings: np.ndarray, num_queries: int, query_path: Optional[str] = None) -> np.ndarray:
+    """Query embeddings loaded from a ``.npy`` file, or corpus rows sampled as queries."""
+    if query_path is not None:
+        return np.load(query_path).astype(np.float32)[:num_queries]
+    rng = np.random.default_rng(2024)
+    sample_ids = np.sort(rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False))
+    return np.ascontiguousarray(embeddings[sample_ids], dtype=np.float32)
+
+
+def sweep(
+    index,
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    topk: int = 10,
+    nprobe_list: List[Optional[int]] = (None,),
+    efSearch_list: List[Optional[int]] = (None,),
+    k_factor_list: List[Optional[int]] = (None,),
+) -> List[Dict]:
+    """Measure recall@k against exact inner-product search and QPS for each combination of parameters."""
+    truth = exact_search(embeddings, queries, topk)
+
+    results = []
+    for nprobe in nprobe_list:
+        for efSearch in efSearch_list:
+            for k_factor in k_factor_list:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    set_search_params(index, nprobe=nprobe, efSearch=efSearch, k_factor=k_factor)
+                start_time = time.perf_counter()
+                _, idxs = index.search(queries, topk)
+                elapsed = time.perf_counter() - start_time
+                results.append(
+                    {
+                        "nprobe": nprobe,
+                        "efSearch": efSearch,
+                        "k_factor": k_factor,
+                        f"recall@{topk}": recall_at_k(idxs, truth),
+                        "qps": len(queries) / elapsed,
+                    }
+                )
+    return results
+
+
+def _parse_list(value: Optional[str]):
+    return [None] if value is None else [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep ANN search parameters: recall@k against exact search vs QPS.")
+    parser.add_argument("--index_path", type=str, required=True)
+    parser.add_argument("--embedding_path", type=str, required=True, help="Corpus embeddings saved by index_builder")
+    parser.add_argument("--query_path", type=str, default=None, help=".npy query embeddings; by default corpus rows are sampled")
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--nprobe", type=str, default=None, help="Comma-separated values, e.g. 1,4,16,64")
+    parser.add_argument("--efSearch", type=str, default=None, help="Comma-separated values, e.g. 16,32,64,128")
+    parser.add_argument("--k_factor", type=str, default=None, help="Comma-separated values, e.g. 1,2,4")
+    parser.add_argument("--save_path", type=str, default=None, help="Write the results to this json file")
+    args = parser.parse_args()
+
+    index = faiss.read_index(args.index_path)
+    embeddings = np.memmap(args.embedding_path, mode="r", dtype=np.float32).reshape(-1, index.d)
+    queries = sample_queries(embeddings, args.num_queries, args.query_path)
+
+    results = sweep(
+        index,
+        embeddings,
+        queries,
+        topk=args.topk,
+        nprobe_list=_parse_list(args.nprobe),
+        efSearch_list=_parse_list(args.efSearch),
+        k_factor_list=_parse_list(args.k_factor),
+    )
+    recall_key = f"recall@{args.topk}"
+    print(f"{'nprobe':>8} {'efSearch':>9} {'k_factor':>9} {recall_key:>10} {'QPS':>10}")
+    for row in results:
+        print(
+            f"{str(row['nprobe']):>8} {str(row['efSearch']):>9} {str(row['k_factor']):>9} "
+            f"{row[recall_key]:>10.4f} {row['qps']:>10.1f}"
+        )
+    if args.save_path is not None:
+        with open(args.save_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
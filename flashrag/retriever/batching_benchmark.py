@@ -0,0 +1,147 @@
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+from flashrag.retriever.utils import load_corpus, token_budget_batches
+
+
+def padding_ratio(lengths: List[int], batches: List[np.ndarray]) -> float:
+    """Fraction of the encoded tokens that are padding."""
+    lengths = np.asarray(lengths)
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches)
+    return 1 - lengths.sum() / padded
+
+
+def sample_contents(corpus_path: str, num_docs: int, seed: int = 2024) -> List[str]:
+    corpus = load_corpus(corpus_path)
+    rng = np.random.default_rng(seed)
+    sample_ids = np.sort(rng.choice(len(corpus), size=min(num_docs, len(corpus)), replace=False))
+    return [corpus[int(idx)]["contents"] for idx in sample_ids]
+
+
+def benchmark_encoder(
+    model_path: str,
+    contents: List[str],
+    batch_size: int = 64,
+    max_tokens_per_batch: int = 16384,
+    pooling_method: str = "mean",
+    max_length: int = 512,
+    use_fp16: bool = False,
+) -> Dict:
+    """Docs/sec of ``Encoder`` with fixed ``batch_size`` chunks vs. length-bucketed token-budget batches."""
+    from flashrag.retriever.encoder import Encoder
+
+    encoder = Encoder(
+        model_name=model_path,
+        model_path=model_path,
+        pooling_method=pooling_method,
+        max_length=max_length,
+        use_fp16=use_fp16,
+        silent=True,
+    )
+    lengths = [len(ids) for ids in encoder.tokenizer(contents, max_length=max_length, truncation=True)["input_ids"]]
+    fixed_batches = [np.arange(i, min(i + batch_size, len(contents))) for i in range(0, len(contents), batch_size)]
+    budget_batches = token_budget_batches(lengths, max_tokens_per_batch)
+
+    # warm up, so the first measurement does not pay for lazy initialization
+    encoder.encode(contents[:batch_size], batch_size=batch_size, is_query=False)
+
+    start_time = time.perf_counter()
+    fixed_emb = encoder.encode(contents, batch_size=batch_size, is_query=False)
+    fixed_time = time.perf_counter() - start_time
+
+    encoder.max_tokens_per_batch = max_tokens_per_batch
+    start_time = time.perf_counter()
+    budget_emb = encoder.encode(contents, batch_size=batch_size, is_query=False)
+    budget_time = time.perf_counter() - start_time
+
+    return {
+        "fixed_docs_per_sec": len(contents) / fixed_time,
+        "bucketed_docs_per_sec": len(contents) / budget_time,
+        "fixed_padding_ratio": padding_ratio(lengths, fixed_batches),
+        "bucketed_padding_ratio": padding_ratio(lengths, budget_batches),
+        "num_bucketed_batches": len(budget_batches),
+        "max_abs_diff": float(np.abs(fixed_emb - budget_emb).max()),
+    }
+
+
+def benchmark_reranker(
+    model_path: str,
+    contents: List[str],
+    batch_size: int = 64,
+    max_tokens_per_batch: int = 16384,
+    max_length: int = 512,
+    device: str = "cpu",
+) -> Dict:
+    """Pairs/sec of ``CrossReranker``, using the title of each sampled document as the query for its text."""
+    from flashrag.retriever.reranker import CrossReranker
+
+    config = {
+        "rerank_model_name": model_path,
+        "rerank_model_path": model_path,
+        "rerank_topk": 1,
+        "rerank_max_length": max_length,
+        "rerank_batch_size": batch_size,
+        "device": device,
+    }
+    reranker = CrossReranker(config)
+    queries = [text.split("\n")[0] for text in contents]
+    docs = [[text] for text in contents]
+
+    start_time = time.perf_counter()
+    fixed_scores = reranker.get_rerank_scores(queries, docs, batch_size)
+    fixed_time = time.perf_counter() - start_time
+
+    reranker.max_tokens_per_batch = max_tokens_per_batch
+    start_time = time.perf_counter()
+    budget_scores = reranker.get_rerank_scores(queries, docs, batch_size)
+    budget_time = time.perf_counter() - start_time
+
+    return {
+        "fixed_pairs_per_sec": len(contents) / fixed_time,
+        "bucketed_pairs_per_sec": len(contents) / budget_time,
+        "max_abs_diff": float(np.abs(np.asarray(fixed_scores, dtype=np.float32) - np.asarray(budget_scores)).max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fixed-size vs. length-bucketed token-budget batching.")
+    parser.add_argument("--model_path", type=str, required=True, help="Dense retrieval model")
+    parser.add_argument("--corpus_path", type=str, required=True)
+    parser.add_argument("--num_docs", type=int, default=2000)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--max_tokens_per_batch", type=int, default=16384)
+    parser.add_argument("--pooling_method", type=str, default="mean")
+    parser.add_argument("--max_length", type=int, default=512)
+    parser.add_argument("--rerank_model_path", type=str, default=None, help="Also benchmark this cross-encoder")
+    args = parser.parse_args()
+
+    contents = sample_contents(args.corpus_path, args.num_docs)
+    results = {
+        "encoder": benchmark_encoder(
+            args.model_path,
+            contents,
+            batch_size=args.batch_size,
+            max_tokens_per_batch=args.max_tokens_per_batch,
+            pooling_method=args.pooling_method,
+            max_length=args.max_length,
+        )
+    }
+    if args.rerank_model_path is not None:
+        results["reranker"] = benchmark_reranker(
+            args.rerank_model_path,
+            contents,
+            batch_size=args.batch_size,
+            max_tokens_per_batch=args.max_tokens_per_batch,
+            max_length=args.max_length,
+        )
+    for name, metrics in results.items():
+        print(name)
+        for key, value in metrics.items():
+            print(f"  {key:<24} {value:.4f}")
+
+
+if __name__ == "__main__":
+    main()
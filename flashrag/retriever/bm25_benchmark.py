@@ -0,0 +1,99 @@
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from flashrag.retriever.utils import load_corpus
+
+
+def sample_queries(corpus_path: str, num_queries: int, query_path: Optional[str] = None, seed: int = 2024) -> List[str]:
+    """Questions of a ``.jsonl`` dataset, or the titles of sampled corpus documents used as queries."""
+    if query_path is not None:
+        with open(query_path, "r") as f:
+            return [json.loads(line)["question"] for line in f][:num_queries]
+    corpus = load_corpus(corpus_path)
+    rng = np.random.default_rng(seed)
+    sample_ids = np.sort(rng.choice(len(corpus), size=min(num_queries, len(corpus)), replace=False))
+    return [corpus[int(idx)]["contents"].split("\n")[0].strip('"') for idx in sample_ids]
+
+
+def load_bm25_retriever(index_path: str, corpus_path: str, backend: str, topk: int = 10):
+    from flashrag.config import Config
+    from flashrag.retriever.retriever import BM25Retriever
+
+    config = Config(
+        config_dict={
+            "retrieval_method": "bm25",
+            "index_path": index_path,
+            "corpus_path": corpus_path,
+            "bm25_backend": backend,
+            "retrieval_topk": topk,
+            "save_retrieval_cache": False,
+            "use_retrieval_cache": False,
+            "use_reranker": False,
+            "disable_save": True,
+        }
+    )
+    return BM25Retriever(config)
+
+
+def benchmark_bm25(retriever, queries: List[str], topk: int = 10, threads_list: List[int] = (1, 8)) -> List[Dict]:
+    """QPS of searching the queries one by one vs. one batched, multi-threaded search per thread count.
+
+    ``overlap`` is the fraction of the per-query top-k documents also returned by the batched search.
+    """
+
+    def doc_ids(results):
+        return [[doc["id"] for doc in docs] for docs in results]
+
+    retriever.bm25_threads = 1
+    # warm up, so the first measurement does not pay for jit compilation / analyzer loading
+    retriever._batch_search(queries[:8], topk)
+
+    start_time = time.perf_counter()
+    loop_results = [retriever._search(query, topk) for query in queries]
+    loop_time = time.perf_counter() - start_time
+    loop_ids = doc_ids(loop_results)
+
+    rows = [{"mode": "per_query", "threads": 1, "qps": len(queries) / loop_time, "overlap": 1.0}]
+    for threads in threads_list:
+        retriever.bm25_threads = threads
+        start_time = time.perf_counter()
+        batch_results = retriever._batch_search(queries, topk)
+        batch_time = time.perf_counter() - start_time
+        overlap = np.mean(
+            [len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(loop_ids, doc_ids(batch_results))]
+        )
+        rows.append({"mode": "batch", "threads": threads, "qps": len(queries) / batch_time, "overlap": float(overlap)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-query vs. batched multi-threaded BM25 search.")
+    parser.add_argument("--index_path", type=str, required=True)
+    parser.add_argument("--corpus_path", type=str, required=True)
+    parser.add_argument("--bm25_backend", type=str, default="bm25s", choices=["bm25s", "pyserini"])
+    parser.add_argument("--query_path", type=str, default=None, help=".jsonl dataset; by default corpus titles are sampled")
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--threads", type=str, default="1,8", help="Comma-separated thread counts for batch search")
+    parser.add_argument("--save_path", type=str, default=None, help="Write the results to this json file")
+    args = parser.parse_args()
+
+    queries = sample_queries(args.corpus_path, args.num_queries, args.query_path)
+    retriever = load_bm25_retriever(args.index_path, args.corpus_path, args.bm25_backend, args.topk)
+    results = benchmark_bm25(
+        retriever, queries, topk=args.topk, threads_list=[int(t) for t in args.threads.split(",")]
+    )
+    print(f"{'mode':>10} {'threads':>8} {'QPS':>10} {'overlap':>8}")
+    for row in results:
+        print(f"{row['mode']:>10} {row['threads']:>8} {row['qps']:>10.1f} {row['overlap']:>8.4f}")
+    if args.save_path is not None:
+        with open(args.save_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
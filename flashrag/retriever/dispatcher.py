@@ -0,0 +1,122 @@
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, List, Union
+
+__all__ = ["RetrievalDispatcher"]
+
+
+class RetrievalDispatcher:
+    """Thread-safe micro-batching front end for a retriever.
+
+    Callers that search one query at a time (per-question threads, async tasks, chat sessions) submit
+    their queries to a shared queue. A background worker collects the requests arriving within
+    ``max_wait_ms`` of the first one (or until ``max_batch_size`` queries are pending), runs a single
+    ``batch_search`` on the wrapped retriever and resolves each caller's future with its own results.
+    Requests with different ``num`` are searched in separate batches.
+
+    The dispatcher exposes the ``search``/``batch_search`` interface of the wrapped retriever, other
+    attributes are forwarded to it.
+    """
+
+    def __init__(self, retriever, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.retriever = retriever
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_sizes = Counter()
+        self._queue = queue.Queue()
+        self._closed = False
+        # guards _closed and the puts, so no request can be queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def __getattr__(self, name):
+        # only called for attributes not set on the dispatcher itself
+        if name == "retriever":
+            raise AttributeError(name)
+        return getattr(self.retriever, name)
+
+    def submit(self, query: str, num: int = None) -> Future:
+        """Queue one query; the future resolves to ``(docs, scores)``."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("RetrievalDispatcher is closed")
+            self._queue.put((query, self.retriever.topk if num is None else num, future))
+        return future
+
+    def search(self, query: str, num: int = None, return_score: bool = False):
+        docs, scores = self.submit(query, num).result()
+        return (docs, scores) if return_score else docs
+
+    def batch_search(self, query: Union[str, List[str]], num: int = None, return_score: bool = False):
+        if isinstance(query, str):
+            query = [query]
+        outputs = [future.result() for future in [self.submit(q, num) for q in query]]
+        results = [docs for docs, _ in outputs]
+        scores = [doc_scores for _, doc_scores in outputs]
+        return (results, scores) if return_score else results
+
+    async def asearch(self, query: str, num: int = None, return_score: bool = False):
+        docs, scores = await asyncio.wrap_future(self.submit(query, num))
+        return (docs, scores) if return_score else docs
+
+    def _collect(self) -> List:
+        """Block for the first request, then gather more until the window closes or the batch is full."""
+        requests = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while requests[-1] is not None and len(requests) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            stop = requests[-1] is None
+            if stop:
+                requests = requests[:-1]
+
+            by_num = {}
+            for request in requests:
+                by_num.setdefault(request[1], []).append(request)
+            for num, group in by_num.items():
+                self.batch_sizes[len(group)] += 1
+                try:
+                    results, scores = self.retriever.batch_search([q for q, _, _ in group], num=num, return_score=True)
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future), docs, doc_scores in zip(group, results, scores):
+                    future.set_result((docs, doc_scores))
+            if stop:
+                return
+
+    def close(self):
+        """Search the pending requests and stop the worker."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def stats(self) -> Dict:
+        num_batches = sum(self.batch_sizes.values())
+        num_queries = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": num_batches,
+            "queries": num_queries,
+            "mean_batch_size": num_queries / num_batches if num_batches > 0 else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+        }
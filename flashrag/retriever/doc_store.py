@@ -0,0 +1,207 @@
+import os
+import json
+import argparse
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+
+class DocStore:
+    """Memory-mapped corpus built by ``build_doc_store``.
+
+    The store is a directory with one utf-8 blob per column (``id.bin``, ``contents.bin``), int64 offsets
+    (``<column>.offsets.npy``, n + 1 entries) and the byte length of each title line (``title_len.npy``),
+    so ``title`` and ``text`` are sliced out of ``contents`` without re-splitting it.
+    All files are opened with ``mmap``, so retrievers and worker processes on the same host share
+    one copy through the OS page cache.
+    """
+
+    FIELDS = ("id", "contents", "title", "text")
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        with open(os.path.join(store_path, "doc_store.json"), "r") as f:
+            self.meta = json.load(f)
+        self.num_docs = self.meta["num_docs"]
+        self.blobs = {}
+        self.offsets = {}
+        for column in ("id", "contents"):
+            self.blobs[column] = self._load_blob(column)
+            self.offsets[column] = np.load(os.path.join(store_path, f"{column}.offsets.npy"), mmap_mode="r")
+        self.title_len = np.load(os.path.join(store_path, "title_len.npy"), mmap_mode="r")
+
+    def _load_blob(self, column: str) -> np.ndarray:
+        path = os.path.join(self.store_path, f"{column}.bin")
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return self.num_docs
+
+    def __getitem__(self, idx: int) -> Dict[str, str]:
+        return self.take([idx])[0]
+
+    def __iter__(self):
+        batch_size = 10000
+        for start in range(0, self.num_docs, batch_size):
+            yield from self.take(np.arange(start, min(start + batch_size, self.num_docs)))
+
+    @staticmethod
+    def _gather(blob: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> List[bytes]:
+        """Read the byte ranges [starts[i], ends[i]) of ``blob`` with a single vectorized gather."""
+        lengths = ends - starts
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(starts - bounds[:-1], lengths) + np.arange(bounds[-1])
+        data = blob[positions].tobytes()
+        return [data[bounds[i] : bounds[i + 1]] for i in range(len(lengths))]
+
+    def _column(self, column: str, ids: np.ndarray) -> List[bytes]:
+        offsets = self.offsets[column]
+        return self._gather(self.blobs[column], offsets[ids], offsets[ids + 1])
+
+    def take(self, ids: Iterable[int], fields: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """Fetch a batch of documents; only the requested ``fields`` are decoded."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        # negative ids index from the end, as with list indexing
+        ids = np.where(ids < 0, ids + self.num_docs, ids)
+        fields = self.FIELDS if fields is None else fields
+        columns = {}
+        if "id" in fields:
+            columns["id"] = [value.decode("utf-8") for value in self._column("id", ids)]
+        if any(field in fields for field in ("contents", "title", "text")):
+            contents = self._column("contents", ids)
+            title_len = self.title_len[ids]
+            if "contents" in fields:
+                columns["contents"] = [value.decode("utf-8") for value in contents]
+            if "title" in fields:
+                columns["title"] = [value[:n].decode("utf-8").strip('"') for value, n in zip(contents, title_len)]
+            if "text" in fields:
+                columns["text"] = [value[n + 1 :].decode("utf-8") for value, n in zip(contents, title_len)]
+        return [{field: columns[field][i] for field in fields} for i in range(len(ids))]
+
+
+class DocResolver:
+    """Resolves corpus row ids to document dicts, interning recently used documents.
+
+    The same document retrieved for many queries (or iterations) is resolved once and shared,
+    so the returned dicts must be treated as read-only.
+    """
+
+    def __init__(self, corpus, max_size: int = 100000):
+        self.corpus = corpus
+        self.max_size = max_size
+        self.docs = OrderedDict()
+
+    def get(self, ids: Iterable[int]) -> List[Dict]:
+        ids = [int(idx) for idx in ids]
+        missing = list(dict.fromkeys(idx for idx in ids if idx not in self.docs))
+        if missing:
+            if isinstance(self.corpus, DocStore):
+                fetched = self.corpus.take(missing)
+            else:
+                fetched = [self.corpus[idx] for idx in missing]
+            for idx, doc in zip(missing, fetched):
+                self.docs[idx] = doc
+        docs = []
+        for idx in ids:
+            self.docs.move_to_end(idx)
+            docs.append(self.docs[idx])
+        while len(self.docs) > self.max_size:
+            self.docs.popitem(last=False)
+        return docs
+
+
+class RetrievalResult:
+    """Compact retrieval result of one query: corpus row ids and scores as parallel numpy arrays.
+
+    It behaves like the list of retrieved document dicts (indexing, iteration, ``len``), resolving
+    the documents lazily through a shared ``DocResolver``. When saved with the dataset only the ids
+    and scores are written, plus the contents when ``save_contents`` is set.
+    """
+
+    __slots__ = ("resolver", "ids", "scores", "save_contents")
+
+    def __init__(self, resolver: DocResolver, ids, scores, save_contents: bool = False):
+        self.resolver = resolver
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.save_contents = save_contents
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return RetrievalResult(self.resolver, self.ids[idx], self.scores[idx], self.save_contents)
+        return self.resolver.get([self.ids[idx]])[0]
+
+    def __iter__(self):
+        return iter(self.resolver.get(self.ids))
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return f"RetrievalResult(ids={self.ids.tolist()}, scores={self.scores.tolist()})"
+
+    def to_docs(self) -> List[Dict]:
+        """Copies of the documents with their ``score``, in the format of non-compact results."""
+        return [{**doc, "score": float(score)} for doc, score in zip(self, self.scores)]
+
+    def to_json(self) -> Dict:
+        result = {"ids": self.ids.tolist(), "scores": self.scores.tolist()}
+        if self.save_contents:
+            result["contents"] = [doc["contents"] for doc in self]
+        return result
+
+
+def is_doc_store(corpus_path: str) -> bool:
+    return os.path.isdir(corpus_path) and os.path.exists(os.path.join(corpus_path, "doc_store.json"))
+
+
+def build_doc_store(corpus_path: str, store_path: str) -> DocStore:
+    """Convert a ``.jsonl`` corpus (``id`` and ``contents`` or ``text`` per line) into a DocStore."""
+    os.makedirs(store_path, exist_ok=True)
+    offsets = {"id": [0], "contents": [0]}
+    title_len = []
+    with open(corpus_path, "r") as f, open(os.path.join(store_path, "id.bin"), "wb") as id_file, open(
+        os.path.join(store_path, "contents.bin"), "wb"
+    ) as contents_file:
+        for idx, line in enumerate(tqdm(f, desc="Building doc store: ")):
+            item = json.loads(line)
+            doc_id = str(item.get("id", idx)).encode("utf-8")
+            contents = item["contents"] if "contents" in item else item["text"]
+            contents = contents.encode("utf-8")
+            id_file.write(doc_id)
+            contents_file.write(contents)
+            offsets["id"].append(offsets["id"][-1] + len(doc_id))
+            offsets["contents"].append(offsets["contents"][-1] + len(contents))
+            newline = contents.find(b"\n")
+            title_len.append(newline if newline >= 0 else len(contents))
+
+    for column, column_offsets in offsets.items():
+        np.save(os.path.join(store_path, f"{column}.offsets.npy"), np.asarray(column_offsets, dtype=np.int64))
+    np.save(os.path.join(store_path, "title_len.npy"), np.asarray(title_len, dtype=np.int64))
+    with open(os.path.join(store_path, "doc_store.json"), "w") as f:
+        json.dump({"num_docs": len(title_len), "source": os.path.abspath(corpus_path)}, f, indent=4)
+    return DocStore(store_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a memory-mapped doc store from a jsonl corpus.")
+    parser.add_argument("--corpus_path", type=str, required=True)
+    parser.add_argument("--save_dir", type=str, required=True, help="Directory of the doc store, used as corpus_path")
+    args = parser.parse_args()
+
+    store = build_doc_store(args.corpus_path, args.save_dir)
+    print(f"Saved {len(store)} documents to {args.save_dir}")
+
+
+if __name__ == "__main__":
+    main()
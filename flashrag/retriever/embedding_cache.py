@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import threading
+import warnings
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of text embeddings, keyed on the parsed text and ``is_query``.
+
+    Without ``cache_path`` the embeddings are kept in memory as float32.
+    With ``cache_path`` (a directory) they are stored as rows of a memory-mapped ``dtype`` matrix
+    (``embeddings.f32`` or ``embeddings.f16``) with a hash index (``index.log``, one ``key<TAB>row`` line per insert),
+    so the cache survives restarts; the least recently used row is overwritten when the cache is full.
+    float32 (the default) returns exactly what the encoder produced; float16 halves the file size, but cached
+    embeddings come back rounded, so their scores differ slightly from a fresh encode and near-ties may reorder.
+    ``namespace`` identifies the encoder (model, pooling, max length): each namespace is persisted in its own
+    subdirectory of ``cache_path``, so encoders sharing a cache path never read each other's embeddings.
+    """
+
+    def __init__(
+        self, max_size: int = 100000, cache_path: Optional[str] = None, namespace: str = "", dtype: str = "float32"
+    ):
+        assert dtype in ("float32", "float16"), f"Unsupported embedding cache dtype {dtype}"
+        self.max_size = max_size
+        self.namespace = namespace
+        self.dtype = dtype
+        if cache_path is not None and namespace:
+            cache_path = os.path.join(cache_path, hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:16])
+        self.cache_path = cache_path
+        self.entries = OrderedDict()  # key -> embedding (in memory) or row (persistent), in LRU order
+        self.embeddings = None
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if cache_path is not None:
+            os.makedirs(cache_path, exist_ok=True)
+            if os.path.exists(self._meta_path):
+                self._load()
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.cache_path, "meta.json")
+
+    @property
+    def _embedding_path(self):
+        return os.path.join(self.cache_path, "embeddings.f16" if self.dtype == "float16" else "embeddings.f32")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.cache_path, "index.log")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(text: str, is_query: bool) -> str:
+        return hashlib.sha1(f"{int(is_query)}\t{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        with open(self._meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["max_size"] != self.max_size:
+            warnings.warn(
+                f"Embedding cache at {self.cache_path} was created with max_size {meta['max_size']}, using it instead."
+            )
+            self.max_size = meta["max_size"]
+        # caches written before the dtype option stored float16
+        stored_dtype = meta["dtype"] if "dtype" in meta else "float16"
+        if stored_dtype != self.dtype:
+            warnings.warn(f"Embedding cache at {self.cache_path} stores {stored_dtype} embeddings, using it instead.")
+            self.dtype = stored_dtype
+        self.dim = meta["dim"]
+        self.embeddings = np.memmap(self._embedding_path, dtype=self.dtype, mode="r+", shape=(self.max_size, self.dim))
+
+        # replay the index log: a later line for the same row replaces the key stored there before
+        row_keys = {}
+        with open(self._index_path, "r") as f:
+            for line in f:
+                key, row = line.split()
+                row = int(row)
+                if row_keys.get(row) is not None:
+                    self.entries.pop(row_keys[row], None)
+                self.entries.pop(key, None)
+                self.entries[key] = row
+                row_keys[row] = key
+        # compact the log
+        with open(self._index_path, "w") as f:
+            f.writelines(f"{key}\t{row}\n" for key, row in self.entries.items())
+
+    def _allocate(self, dim: int):
+        self.dim = dim
+        if self.cache_path is None:
+            return
+        self.embeddings = np.memmap(self._embedding_path, dtype=self.dtype, mode="w+", shape=(self.max_size, dim))
+        open(self._index_path, "w").close()
+        with open(self._meta_path, "w") as f:
+            json.dump({"max_size": self.max_size, "dim": dim, "dtype": self.dtype, "namespace": self.namespace}, f)
+
+    def get_many(self, texts: List[str], is_query: bool) -> List[Optional[np.ndarray]]:
+        """Return the cached embedding of each text, or None for texts that are not cached."""
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.make_key(text, is_query)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    value = self.entries[key]
+                    results.append(value if self.cache_path is None else np.asarray(self.embeddings[value], dtype=np.float32))
+                    self.hits += 1
+                else:
+                    results.append(None)
+                    self.misses += 1
+        return results
+
+    def put_many(self, texts: List[str], is_query: bool, embeddings: np.ndarray):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if self.dim is None:
+                self._allocate(embeddings.shape[1])
+            new_rows = []
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(text, is_query)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    continue
+                if self.cache_path is None:
+                    self.entries[key] = np.array(embedding, dtype=np.float32)
+                    if len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+                    continue
+                if len(self.entries) < self.max_size:
+                    row = len(self.entries)
+                else:
+                    _, row = self.entries.popitem(last=False)
+                self.embeddings[row] = embedding
+                self.entries[key] = row
+                new_rows.append((key, row))
+
+            if new_rows:
+                self.embeddings.flush()
+                with open(self._index_path, "a") as f:
+                    f.writelines(f"{key}\t{row}\n" for key, row in new_rows)
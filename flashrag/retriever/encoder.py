@@ -4,10 +4,45 @@ import json
 import torch
 import numpy as np
 from tqdm import tqdm
-from flashrag.retriever.utils import load_model, pooling, parse_query, parse_image
+from flashrag.retriever.utils import load_model, pooling, parse_query, parse_image, token_budget_batches
 from flashrag.utils import get_device
 
 
+def dedup_encode(text_list: List[str], is_query: bool, encode_fn, embedding_cache=None) -> np.ndarray:
+    """
+    Encode already parsed texts, running ``encode_fn`` only once per distinct text
+    and only for texts that are not found in ``embedding_cache``.
+    """
+    first_idx = {}
+    inverse = np.fromiter(
+        (first_idx.setdefault(text, len(first_idx)) for text in text_list), dtype=np.int64, count=len(text_list)
+    )
+    unique_texts = list(first_idx)
+
+    if embedding_cache is None:
+        unique_emb = encode_fn(unique_texts)
+    else:
+        cached = embedding_cache.get_many(unique_texts, is_query)
+        miss_idx = [i for i, emb in enumerate(cached) if emb is None]
+        if miss_idx:
+            miss_texts = [unique_texts[i] for i in miss_idx]
+            miss_emb = encode_fn(miss_texts)
+            embedding_cache.put_many(miss_texts, is_query, miss_emb)
+            dim = miss_emb.shape[1]
+        else:
+            dim = cached[0].shape[0]
+        unique_emb = np.empty((len(unique_texts), dim), dtype=np.float32)
+        for i, emb in enumerate(cached):
+            if emb is not None:
+                unique_emb[i] = emb
+        if miss_idx:
+            unique_emb[miss_idx] = miss_emb
+
+    if len(unique_texts) == len(text_list):
+        return unique_emb
+    return unique_emb[inverse]
+
+
 class Encoder:
     """
     Encoder class for encoding queries using a specified model.
@@ -19,13 +54,27 @@ class Encoder:
         max_length (int): The maximum length of the input sequences.
         use_fp16 (bool): Whether to use FP16 precision.
         instruction (str): Additional instructions for parsing queries.
+        embedding_cache (EmbeddingCache): Optional cache of recent embeddings consulted before the model.
+        max_tokens_per_batch (int): If set, inputs are sorted by tokenized length and batched under this
+            padded-token budget instead of fixed ``batch_size`` chunks.
 
     Methods:
         encode(query_list: List[str], is_query=True) -> np.ndarray:
             Encodes a list of queries into embeddings.
     """
 
-    def __init__(self, model_name, model_path, pooling_method, max_length, use_fp16=True, instruction=None, silent=False):
+    def __init__(
+        self,
+        model_name,
+        model_path,
+        pooling_method,
+        max_length,
+        use_fp16=True,
+        instruction=None,
+        silent=False,
+        embedding_cache=None,
+        max_tokens_per_batch=None,
+    ):
         self.model_name = model_name
         self.model_path = model_path
         self.pooling_method = pooling_method
@@ -33,16 +82,25 @@ class Encoder:
         self.use_fp16 = use_fp16
         self.instruction = instruction
         self.silent = silent
+        self.embedding_cache = embedding_cache
+        self.max_tokens_per_batch = max_tokens_per_batch
         self.gpu_num = torch.cuda.device_count()
         self.model, self.tokenizer = load_model(model_path=model_path, use_fp16=use_fp16)
 
     @torch.inference_mode()
     def single_batch_encode(self, query_list: Union[List[str], str], is_query=True) -> np.ndarray:
         query_list = parse_query(self.model_name, query_list, self.instruction, is_query)
+        return self._single_batch_encode_parsed(query_list)
 
+    @torch.inference_mode()
+    def _single_batch_encode_parsed(self, query_list: List[str]) -> np.ndarray:
         inputs = self.tokenizer(
             query_list, max_length=self.max_length, padding=True, truncation=True, return_tensors="pt"
         )
+        return self._encode_inputs(inputs)
+
+    @torch.inference_mode()
+    def _encode_inputs(self, inputs) -> np.ndarray:
         inputs = {k: v.to(get_device()) for k, v in inputs.items()}
 
         if "T5" in type(self.model).__name__ or (
@@ -68,15 +126,40 @@ class Encoder:
 
     @torch.inference_mode()
     def encode(self, query_list: List[str], batch_size=64, is_query=True) -> np.ndarray:
-        query_emb = []
-        for i in tqdm(range(0, len(query_list), batch_size), desc="Encoding process: ", disable=self.silent):
-            query_emb.append(self.single_batch_encode(query_list[i : i + batch_size], is_query))
-        query_emb = np.concatenate(query_emb, axis=0)
+        query_list = parse_query(self.model_name, query_list, self.instruction, is_query)
+
+        def encode_fn(text_list):
+            if self.max_tokens_per_batch is not None:
+                return self._token_budget_encode(text_list)
+            query_emb = []
+            for i in tqdm(range(0, len(text_list), batch_size), desc="Encoding process: ", disable=self.silent):
+                query_emb.append(self._single_batch_encode_parsed(text_list[i : i + batch_size]))
+            return np.concatenate(query_emb, axis=0)
+
+        return dedup_encode(query_list, is_query, encode_fn, self.embedding_cache)
+
+    @torch.inference_mode()
+    def _token_budget_encode(self, text_list: List[str]) -> np.ndarray:
+        """Tokenize once, encode length-sorted batches under the token budget and restore the input order."""
+        encoded = self.tokenizer(text_list, max_length=self.max_length, truncation=True)
+        lengths = [len(input_ids) for input_ids in encoded["input_ids"]]
+        query_emb = None
+        for batch_idxs in tqdm(
+            token_budget_batches(lengths, self.max_tokens_per_batch), desc="Encoding process: ", disable=self.silent
+        ):
+            inputs = self.tokenizer.pad(
+                {key: [values[i] for i in batch_idxs] for key, values in encoded.items()}, return_tensors="pt"
+            )
+            batch_emb = self._encode_inputs(inputs)
+            if query_emb is None:
+                query_emb = np.empty((len(text_list), batch_emb.shape[1]), dtype=np.float32)
+            query_emb[batch_idxs] = batch_emb
         return query_emb
 
     @torch.inference_mode()
     def multi_gpu_encode(self, query_list: Union[List[str], str], batch_size=64, is_query=True) -> np.ndarray:
-        if self.gpu_num > 1:
+        # wrap only once, repeated calls (e.g. one per corpus shard) reuse the DataParallel model
+        if self.gpu_num > 1 and not isinstance(self.model, torch.nn.DataParallel):
             self.model = torch.nn.DataParallel(self.model)
         query_emb = self.encode(query_list, batch_size, is_query)
         return query_emb
@@ -92,6 +175,7 @@ class STEncoder:
         max_length (int): The maximum length of the input sequences.
         use_fp16 (bool): Whether to use FP16 precision.
         instruction (str): Additional instructions for parsing queries.
+        embedding_cache (EmbeddingCache): Optional cache of recent embeddings consulted before the model.
 
     Methods:
         encode(query_list: List[str], batch_size=64, is_query=True) -> np.ndarray:
@@ -100,7 +184,7 @@ class STEncoder:
             Encodes a list of queries into embeddings using multiple GPUs.
     """
 
-    def __init__(self, model_name, model_path, max_length, use_fp16, instruction, silent=False):
+    def __init__(self, model_name, model_path, max_length, use_fp16, instruction, silent=False, embedding_cache=None):
         import torch
         from sentence_transformers import SentenceTransformer
 
@@ -110,6 +194,7 @@ class STEncoder:
         self.use_fp16 = use_fp16
         self.instruction = instruction
         self.silent = silent
+        self.embedding_cache = embedding_cache
         self.model = SentenceTransformer(
             model_path, trust_remote_code=True, model_kwargs={"torch_dtype": torch.float16 if use_fp16 else torch.float}
         )
@@ -117,21 +202,26 @@ class STEncoder:
     @torch.inference_mode()
     def encode(self, query_list: Union[List[str], str], batch_size=64, is_query=True) -> np.ndarray:
         query_list = parse_query(self.model_name, query_list, self.instruction, is_query)
-        query_emb = self.model.encode(
-            query_list,
-            batch_size=batch_size,
-            convert_to_numpy=True,
-            normalize_embeddings=True,
-            show_progress_bar=not self.silent,
-        )
-        query_emb = query_emb.astype(np.float32, order="C")
 
-        return query_emb
+        def encode_fn(text_list):
+            query_emb = self.model.encode(
+                text_list,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=not self.silent,
+            )
+            return query_emb.astype(np.float32, order="C")
+
+        return dedup_encode(query_list, is_query, encode_fn, self.embedding_cache)
 
     @torch.inference_mode()
-    def multi_gpu_encode(self, query_list: Union[List[str], str], batch_size=None, is_query=True) -> np.ndarray:
+    def multi_gpu_encode(self, query_list: Union[List[str], str], batch_size=None, is_query=True, pool=None) -> np.ndarray:
         query_list = parse_query(self.model_name, query_list, self.instruction, is_query)
-        pool = self.model.start_multi_process_pool()
+        # a pool passed in (e.g. shared across corpus shards) is left running for the caller to stop
+        own_pool = pool is None
+        if own_pool:
+            pool = self.model.start_multi_process_pool()
         query_emb = self.model.encode_multi_process(
             query_list,
             pool,
@@ -139,7 +229,8 @@ class STEncoder:
             batch_size=batch_size,
             show_progress_bar=not self.silent,
         )
-        self.model.stop_multi_process_pool(pool)
+        if own_pool:
+            self.model.stop_multi_process_pool(pool)
         query_emb = query_emb.astype(np.float32, order="C")
 
         return query_emb
@@ -204,7 +295,8 @@ class ClipEncoder:
 
     @torch.inference_mode()
     def multi_gpu_encode(self, query_list: Union[List[str], str], batch_size=64, is_query=True) -> np.ndarray:
-        if self.gpu_num > 1:
+        # wrap only once, repeated calls (e.g. one per corpus shard) reuse the DataParallel model
+        if self.gpu_num > 1 and not isinstance(self.model, torch.nn.DataParallel):
             self.model = torch.nn.DataParallel(self.model)
         query_emb = self.encode(query_list, batch_size, is_query)
         return query_emb
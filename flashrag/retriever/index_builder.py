@@ -14,6 +14,8 @@ import datasets
 import torch
 from tqdm import tqdm
 from flashrag.retriever.utils import load_model, load_corpus, pooling, set_default_instruction, judge_zh
+from flashrag.retriever.doc_store import DocStore
+from flashrag.retriever.ann_index import choose_faiss_type, train_sample, quantized_faiss_type, faiss_type_file_name
 from transformers import AutoTokenizer, AutoModelForMaskedLM
 
 import os
@@ -51,6 +53,12 @@ class Index_Builder:
             bm25_backend="bm25s",
             index_modal="all",
             nknn=0,
+            memory_budget_gb=None,
+            max_train_size=None,
+            faiss_variants=None,
+            shard_size=100000,
+            resume=False,
+            max_tokens_per_batch=None,
     ):
         self.retrieval_method = retrieval_method.lower()
         self.model_path = model_path
@@ -74,6 +82,15 @@ class Index_Builder:
         self.summary_energy = summary_energy
         self.batched_indexing = batched_indexing
         self.nknn = nknn
+        # used by faiss_type "auto" and for training IVF indexes on a sample of large corpora
+        self.memory_budget_gb = memory_budget_gb
+        self.max_train_size = max_train_size
+        # compressed variants (sq8, fp16, opq_pq) built next to the main index
+        self.faiss_variants = faiss_variants if faiss_variants is not None else []
+        # corpus shard encoded (and added to faiss) at a time; resume continues an interrupted encoding
+        self.shard_size = shard_size
+        self.resume = resume
+        self.max_tokens_per_batch = max_tokens_per_batch
 
         # judge if the retrieval model is clip
         self.is_clip = ("clip" in self.retrieval_method) or (self.model_path is not None and "clip" in self.model_path)
@@ -481,16 +498,65 @@ class Index_Builder:
         else:
             memmap[:] = all_embeddings
 
-    def encode_all(self):
-        encode_data = [item["contents"] for item in self.corpus]
+    def _corpus_contents(self, start, end):
+        if isinstance(self.corpus, DocStore):
+            return [item["contents"] for item in self.corpus.take(np.arange(start, end), fields=["contents"])]
+        return self.corpus[start:end]["contents"]
+
+    def encode_all(self, hidden_size):
+        """Encode the corpus shard by shard straight into a preallocated ``emb_*.memmap``.
+
+        After each shard the memmap is flushed and the number of encoded rows is written to
+        ``<memmap>.progress.json``, so with ``resume`` an interrupted run continues from the last completed shard.
+        """
+        corpus_size = len(self.corpus)
+        progress_path = self.embedding_save_path + ".progress.json"
+        progress = {"corpus_size": corpus_size, "hidden_size": hidden_size, "completed": 0}
+        if self.resume and os.path.exists(progress_path) and os.path.exists(self.embedding_save_path):
+            with open(progress_path, "r") as f:
+                saved_progress = json.load(f)
+            if saved_progress["corpus_size"] == corpus_size and saved_progress["hidden_size"] == hidden_size:
+                progress = saved_progress
+                print(f"Resume encoding from document {progress['completed']}")
+            else:
+                warnings.warn("Saved encoding progress does not match the corpus or the model, encoding from scratch.")
+        mode = "r+" if progress["completed"] > 0 else "w+"
+        all_embeddings = np.memmap(self.embedding_save_path, mode=mode, dtype=np.float32, shape=(corpus_size, hidden_size))
+
+        batch_size = self.batch_size
+        multi_gpu_kwargs = {}
         if self.gpu_num > 1:
             print("Use multi gpu!")
-            self.batch_size = self.batch_size * self.gpu_num
-            all_embeddings = self.encoder.multi_gpu_encode(encode_data, batch_size=self.batch_size, is_query=False)
-        else:
-            all_embeddings = self.encoder.encode(encode_data, batch_size=self.batch_size, is_query=False)
-
-        return all_embeddings
+            batch_size = self.batch_size * self.gpu_num
+            if self.use_sentence_transformer:
+                # one worker pool for all shards instead of starting one per shard
+                multi_gpu_kwargs["pool"] = self.encoder.model.start_multi_process_pool()
+        try:
+            for start in tqdm(
+                range(progress["completed"], corpus_size, self.shard_size),
+                desc="Encoding shards: ",
+                total=(corpus_size - progress["completed"] + self.shard_size - 1) // self.shard_size,
+            ):
+                end = min(start + self.shard_size, corpus_size)
+                encode_data = self._corpus_contents(start, end)
+                if self.gpu_num > 1:
+                    shard_embeddings = self.encoder.multi_gpu_encode(
+                        encode_data, batch_size=batch_size, is_query=False, **multi_gpu_kwargs
+                    )
+                else:
+                    shard_embeddings = self.encoder.encode(encode_data, batch_size=batch_size, is_query=False)
+                all_embeddings[start:end] = shard_embeddings
+                all_embeddings.flush()
+
+                progress["completed"] = end
+                with open(progress_path + ".tmp", "w") as f:
+                    json.dump(progress, f)
+                os.replace(progress_path + ".tmp", progress_path)
+        finally:
+            if "pool" in multi_gpu_kwargs:
+                self.encoder.model.stop_multi_process_pool(multi_gpu_kwargs["pool"])
+
+        return np.memmap(self.embedding_save_path, mode="r", dtype=np.float32, shape=(corpus_size, hidden_size))
 
     def encode_all_clip(self):
         if self.index_modal == "all":
@@ -546,17 +612,28 @@ class Index_Builder:
                 max_length=self.max_length,
                 use_fp16=self.use_fp16,
                 instruction=self.instruction,
+                max_tokens_per_batch=self.max_tokens_per_batch,
             )
             hidden_size = self.encoder.model.config.hidden_size
 
         if self.embedding_path is not None:
             corpus_size = len(self.corpus)
             all_embeddings = self._load_embedding(self.embedding_path, corpus_size, hidden_size)
-        else:
-            all_embeddings = self.encode_all_clip() if self.is_clip else self.encode_all()
+        elif self.is_clip:
+            all_embeddings = self.encode_all_clip()
             if self.save_embedding:
                 self._save_embedding(all_embeddings)
             del self.corpus
+        else:
+            all_embeddings = self.encode_all(hidden_size)
+            del self.corpus
+
+        if self.faiss_type == "auto":
+            num_vectors = all_embeddings.shape[0]
+            if self.is_clip and self.index_modal == "all":
+                num_vectors = num_vectors // 2
+            self.faiss_type = choose_faiss_type(num_vectors, all_embeddings.shape[-1], self.memory_budget_gb)
+            print(f"Auto selected faiss type: {self.faiss_type}")
 
         # build index
         if self.is_clip:
@@ -583,6 +660,21 @@ class Index_Builder:
             if os.path.exists(self.index_save_path):
                 print("The index file already exists and will be overwritten.")
             self.save_faiss_index(all_embeddings, self.faiss_type, self.index_save_path)
+
+            if self.faiss_variants and not self.save_embedding and self.embedding_path is None:
+                print(f"Keeping the embeddings at {self.embedding_save_path} for exact re-scoring of the index variants.")
+            for variant in self.faiss_variants:
+                variant_type = quantized_faiss_type(variant, all_embeddings.shape[-1])
+                variant_save_path = os.path.join(
+                    self.save_dir, f"{self.retrieval_method}_{faiss_type_file_name(variant_type)}.index"
+                )
+                self.save_faiss_index(all_embeddings, variant_type, variant_save_path)
+
+            if self.embedding_path is None and not self.save_embedding and not self.faiss_variants:
+                # the memmap was only needed to stream the encoding
+                del all_embeddings
+                os.remove(self.embedding_save_path)
+                os.remove(self.embedding_save_path + ".progress.json")
         print("Finish!")
 
     def save_faiss_index(
@@ -602,16 +694,21 @@ class Index_Builder:
             co.shard = True
             faiss_index = faiss.index_cpu_to_all_gpus(faiss_index, co)
             if not faiss_index.is_trained:
-                faiss_index.train(all_embeddings)
-            faiss_index.add(all_embeddings)
+                faiss_index.train(train_sample(all_embeddings, faiss_index, self.max_train_size, faiss_type=faiss_type))
+            self._add_in_chunks(faiss_index, all_embeddings)
             faiss_index = faiss.index_gpu_to_cpu(faiss_index)
         else:
             if not faiss_index.is_trained:
-                faiss_index.train(all_embeddings)
-            faiss_index.add(all_embeddings)
+                faiss_index.train(train_sample(all_embeddings, faiss_index, self.max_train_size, faiss_type=faiss_type))
+            self._add_in_chunks(faiss_index, all_embeddings)
 
         faiss.write_index(faiss_index, index_save_path)
 
+    def _add_in_chunks(self, faiss_index, all_embeddings):
+        # read the (memory-mapped) embeddings chunk by chunk instead of materializing them at once
+        for start in tqdm(range(0, len(all_embeddings), self.shard_size), desc="Adding to index: ", leave=False):
+            faiss_index.add(np.ascontiguousarray(all_embeddings[start : start + self.shard_size], dtype=np.float32))
+
 
 import argparse
 
@@ -631,10 +728,22 @@ def main():
     parser.add_argument("--batch_size", type=int, default=512)
     parser.add_argument("--use_fp16", default=False, action="store_true")
     parser.add_argument("--pooling_method", type=str, default=None)
+    parser.add_argument(
+        "--max_tokens_per_batch", type=int, default=None, help="Batch length-sorted documents under this token budget"
+    )
     parser.add_argument("--instruction", type=str, default=None)
-    parser.add_argument("--faiss_type", default=None, type=str)
+    parser.add_argument("--faiss_type", default=None, type=str, help="faiss factory string, or auto")
+    parser.add_argument("--memory_budget_gb", default=None, type=float, help="Index memory budget for --faiss_type auto")
+    parser.add_argument("--max_train_size", default=None, type=int, help="Number of sampled vectors to train IVF on")
+    parser.add_argument(
+        "--faiss_variants", default=None, type=str, help="Also build compressed indexes, comma-separated: sq8,fp16,opq_pq"
+    )
     parser.add_argument("--embedding_path", default=None, type=str)
     parser.add_argument("--save_embedding", action="store_true", default=False)
+    parser.add_argument("--shard_size", type=int, default=100000, help="Documents encoded per checkpointed shard")
+    parser.add_argument(
+        "--resume", action="store_true", default=False, help="Continue encoding from the last completed shard"
+    )
     parser.add_argument("--faiss_gpu", default=False, action="store_true")
     parser.add_argument("--sentence_transformer", action="store_true", default=False)
     parser.add_argument("--bm25_backend", default="pyserini", choices=["bm25s", "pyserini"])
@@ -675,7 +784,13 @@ def main():
         summary_energy=args.summary_energy,
         batched_indexing=args.batched_indexing,
         corpus_embedded_path=args.corpus_embedded_path,
-        nknn=args.nknn
+        nknn=args.nknn,
+        memory_budget_gb=args.memory_budget_gb,
+        max_train_size=args.max_train_size,
+        faiss_variants=args.faiss_variants.split(",") if args.faiss_variants else None,
+        shard_size=args.shard_size,
+        resume=args.resume,
+        max_tokens_per_batch=args.max_tokens_per_batch,
     )
     index_builder.build_index()
 
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from flashrag.retriever.ann_index import ExactRescorer, exact_search, read_faiss_index, recall_at_k, sample_queries
+
+
+def compare_indexes(
+    index_paths: List[str],
+    embedding_path: str,
+    queries: Optional[np.ndarray] = None,
+    num_queries: int = 1000,
+    topk: int = 10,
+    rescore_k_factor: int = 4,
+    mmap: bool = False,
+) -> List[Dict]:
+    """Index size, load time, QPS and recall@k against exact search for each index built on the same corpus.
+
+    With ``rescore_k_factor`` > 0 the top ``topk * rescore_k_factor`` candidates are also re-scored exactly
+    with the float32 embeddings, as ``faiss_rescore_embedding_path`` does in the dense retriever.
+    """
+    results = []
+    embeddings = None
+    rescorer = None
+    truth = None
+    for index_path in index_paths:
+        start_time = time.perf_counter()
+        index = read_faiss_index(index_path, mmap=mmap)
+        load_time = time.perf_counter() - start_time
+
+        if embeddings is None:
+            embeddings = np.memmap(embedding_path, mode="r", dtype=np.float32).reshape(-1, index.d)
+            queries = sample_queries(embeddings, num_queries) if queries is None else queries
+            truth = exact_search(embeddings, queries, topk)
+            rescorer = ExactRescorer(embedding_path, index.d)
+
+        start_time = time.perf_counter()
+        _, idxs = index.search(queries, topk)
+        search_time = time.perf_counter() - start_time
+        row = {
+            "index": os.path.basename(index_path),
+            "size_mb": os.path.getsize(index_path) / 1024**2,
+            "load_s": load_time,
+            "qps": len(queries) / search_time,
+            f"recall@{topk}": recall_at_k(idxs, truth),
+        }
+        if rescore_k_factor > 0:
+            start_time = time.perf_counter()
+            _, candidates = index.search(queries, topk * rescore_k_factor)
+            _, idxs = rescorer.rescore(queries, candidates, topk)
+            search_time = time.perf_counter() - start_time
+            row["rescored_qps"] = len(queries) / search_time
+            row[f"rescored_recall@{topk}"] = recall_at_k(idxs, truth)
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare faiss index variants: size, load time, QPS and recall@k.")
+    parser.add_argument("--index_paths", type=str, nargs="+", required=True)
+    parser.add_argument("--embedding_path", type=str, required=True, help="Corpus embeddings saved by index_builder")
+    parser.add_argument("--query_path", type=str, default=None, help=".npy query embeddings; by default corpus rows are sampled")
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--rescore_k_factor", type=int, default=4, help="0 to skip exact re-scoring")
+    parser.add_argument("--mmap", action="store_true", default=False, help="Load the indexes memory-mapped")
+    parser.add_argument("--save_path", type=str, default=None, help="Write the results to this json file")
+    args = parser.parse_args()
+
+    queries = np.load(args.query_path).astype(np.float32)[: args.num_queries] if args.query_path else None
+    results = compare_indexes(
+        args.index_paths,
+        args.embedding_path,
+        queries=queries,
+        num_queries=args.num_queries,
+        topk=args.topk,
+        rescore_k_factor=args.rescore_k_factor,
+        mmap=args.mmap,
+    )
+    columns = [key for key in results[0] if key != "index"]
+    width = max(len(row["index"]) for row in results)
+    print(f"{'index':<{width}} " + " ".join(f"{column:>18}" for column in columns))
+    for row in results:
+        print(f"{row['index']:<{width}} " + " ".join(f"{row[column]:>18.4f}" for column in columns))
+    if args.save_path is not None:
+        with open(args.save_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import numpy as np
 from tqdm import tqdm
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from flashrag.retriever.encoder import Encoder
+from flashrag.retriever.utils import token_budget_batches
 
 
 class BaseReranker:
@@ -18,6 +19,10 @@ class BaseReranker:
         self.max_length = config["rerank_max_length"]
         self.batch_size = config["rerank_batch_size"]
         self.device = config["device"]
+        # batch inputs of similar length under a padded-token budget instead of fixed batch_size chunks
+        self.max_tokens_per_batch = (
+            config["rerank_max_tokens_per_batch"] if "rerank_max_tokens_per_batch" in config else None
+        )
 
     def get_rerank_scores(self, query_list: List[str], doc_list: List[str], batch_size):
         """Return flatten list of scores for each (query,doc) pair
@@ -88,6 +93,8 @@ class CrossReranker(BaseReranker):
         all_pairs = []
         for query, docs in zip(query_list, doc_list):
             all_pairs.extend([[query, doc] for doc in docs])
+        if self.max_tokens_per_batch is not None:
+            return self._token_budget_scores(all_pairs)
         all_scores = []
         for start_idx in tqdm(range(0, len(all_pairs), batch_size), desc="Reranking process: "):
             pair_batch = all_pairs[start_idx : start_idx + batch_size]
@@ -107,6 +114,18 @@ class CrossReranker(BaseReranker):
 
         return all_scores
 
+    @torch.inference_mode(mode=True)
+    def _token_budget_scores(self, all_pairs):
+        encoded = self.tokenizer(all_pairs, truncation=True, max_length=self.max_length)
+        lengths = [len(input_ids) for input_ids in encoded["input_ids"]]
+        all_scores = np.empty(len(all_pairs), dtype=np.float32)
+        for batch_idxs in tqdm(token_budget_batches(lengths, self.max_tokens_per_batch), desc="Reranking process: "):
+            inputs = self.tokenizer.pad(
+                {key: [values[i] for i in batch_idxs] for key, values in encoded.items()}, return_tensors="pt"
+            ).to(self.device)
+            all_scores[batch_idxs] = self.ranker(**inputs, return_dict=True).logits.view(-1).float().cpu().numpy()
+        return all_scores.tolist()
+
 
 class BiReranker(BaseReranker):
     def __init__(self, config):
@@ -117,6 +136,7 @@ class BiReranker(BaseReranker):
             pooling_method=config["rerank_pooling_method"],
             max_length=self.max_length,
             use_fp16=config["rerank_use_fp16"],
+            max_tokens_per_batch=self.max_tokens_per_batch,
         )
 
     def get_rerank_scores(self, query_list, doc_list, batch_size):
@@ -0,0 +1,196 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from flashrag.retriever.utils import convert_numpy
+
+
+class JSONRetrievalCache:
+    """Retrieval cache kept entirely in memory and dumped to a single json file.
+
+    Results are stored per query as the list of retrieved documents, each with its ``score``.
+    ``get`` returns copies of the documents, so callers can modify their results without changing the cache.
+    """
+
+    def __init__(self, load_path: Optional[str] = None, save_path: Optional[str] = None):
+        self.save_path = save_path
+        self.cache = {}
+        if load_path is not None:
+            with open(load_path, "r") as f:
+                self.cache = json.load(f)
+
+    def __contains__(self, query: str):
+        return query in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get(self, query: str, num: int) -> Optional[List[Dict]]:
+        if query not in self.cache:
+            return None
+        cache_res = self.cache[query]
+        if len(cache_res) < num:
+            warnings.warn(f"The number of cached retrieval results is less than topk ({num})")
+        return [dict(item) for item in cache_res[:num]]
+
+    def put_many(self, queries: List[str], results: List[List[Dict]]):
+        for query, doc_items in zip(queries, results):
+            self.cache[query] = doc_items
+
+    def save(self):
+        self.cache = convert_numpy(self.cache)
+
+        def custom_serializer(obj):
+            if isinstance(obj, np.float32):
+                return float(obj)
+            raise TypeError(f"Type {type(obj)} not serializable")
+
+        with open(self.save_path, "w") as f:
+            json.dump(self.cache, f, indent=4, default=custom_serializer)
+
+    def close(self):
+        pass
+
+
+class SQLiteRetrievalCache:
+    """Retrieval cache stored in a SQLite file, with a bounded in-memory LRU in front.
+
+    Queries are looked up lazily instead of loading the whole cache at startup, and new results are
+    written through as soon as they are retrieved, so an interrupted run keeps everything searched so far.
+    The LRU holds its own copies of the documents, and ``get`` returns copies as well, so a caller that
+    modifies its results does not change later cache hits.
+    Each entry records its depth (number of stored documents): a request for ``num`` results is only
+    served from the cache when the stored depth is at least ``num``, and a deeper result replaces a
+    shallower one.
+    """
+
+    def __init__(self, path: str, lru_size: int = 10000):
+        self.path = path
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_cache (query TEXT PRIMARY KEY, depth INTEGER, results TEXT)"
+        )
+        self.db.commit()
+
+    def __contains__(self, query: str):
+        return self._lookup(query) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM retrieval_cache").fetchone()[0]
+
+    def _put_lru(self, query: str, doc_items: List[Dict]):
+        self.lru[query] = doc_items
+        self.lru.move_to_end(query)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def _lookup(self, query: str) -> Optional[List[Dict]]:
+        with self._lock:
+            if query in self.lru:
+                self.lru.move_to_end(query)
+                return self.lru[query]
+            row = self.db.execute("SELECT results FROM retrieval_cache WHERE query = ?", (query,)).fetchone()
+            if row is None:
+                return None
+            doc_items = json.loads(row[0])
+            self._put_lru(query, doc_items)
+            return doc_items
+
+    def get(self, query: str, num: int) -> Optional[List[Dict]]:
+        doc_items = self._lookup(query)
+        if doc_items is None or len(doc_items) < num:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [dict(item) for item in doc_items[:num]]
+
+    def put_many(self, queries: List[str], results: List[List[Dict]]):
+        rows = [
+            (query, len(doc_items), json.dumps(convert_numpy(doc_items), ensure_ascii=False))
+            for query, doc_items in zip(queries, results)
+        ]
+        with self._lock:
+            # keep the deeper result when a query is already cached
+            self.db.executemany(
+                "INSERT INTO retrieval_cache (query, depth, results) VALUES (?, ?, ?) "
+                "ON CONFLICT(query) DO UPDATE SET depth = excluded.depth, results = excluded.results "
+                "WHERE excluded.depth >= retrieval_cache.depth",
+                rows,
+            )
+            self.db.commit()
+            for query, doc_items in zip(queries, results):
+                if query not in self.lru or len(doc_items) >= len(self.lru[query]):
+                    self._put_lru(query, [dict(item) for item in doc_items])
+
+    def save(self):
+        with self._lock:
+            self.db.commit()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+def get_retrieval_cache(config, use_cache: bool, save_cache: bool):
+    """Build the retrieval cache backend selected by ``retrieval_cache_backend`` (json or sqlite)."""
+    backend = config["retrieval_cache_backend"] if "retrieval_cache_backend" in config else "json"
+    cache_path = config["retrieval_cache_path"]
+    if use_cache:
+        assert cache_path is not None
+
+    if backend == "json":
+        save_path = os.path.join(config["save_dir"], "retrieval_cache.json") if save_cache else None
+        return JSONRetrievalCache(load_path=cache_path if use_cache else None, save_path=save_path)
+    elif backend == "sqlite":
+        # with use_retrieval_cache the existing database is reused; new results are only written into it
+        # (through cache_manager) when save_retrieval_cache is set as well
+        path = cache_path if use_cache else os.path.join(config["save_dir"], "retrieval_cache.db")
+        lru_size = config["retrieval_cache_lru_size"] if "retrieval_cache_lru_size" in config else 10000
+        return SQLiteRetrievalCache(path, lru_size=lru_size)
+    else:
+        raise NotImplementedError(f"Retrieval cache backend {backend} is not supported")
+
+
+def migrate_json_cache(json_path: str, db_path: str, batch_size: int = 10000) -> int:
+    """Import a ``retrieval_cache.json`` file into a SQLite retrieval cache. Returns the number of queries."""
+    with open(json_path, "r") as f:
+        cache = json.load(f)
+    db_cache = SQLiteRetrievalCache(db_path, lru_size=0)
+    queries = list(cache.keys())
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start : start + batch_size]
+        db_cache.put_many(batch, [cache[query] for query in batch])
+    db_cache.close()
+    return len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a json retrieval cache into a SQLite retrieval cache.")
+    parser.add_argument("--json_path", type=str, required=True, help="retrieval_cache.json saved by a previous run")
+    parser.add_argument("--db_path", type=str, required=True, help="SQLite file to create or update")
+    parser.add_argument("--batch_size", type=int, default=10000)
+    args = parser.parse_args()
+
+    num_queries = migrate_json_cache(args.json_path, args.db_path, args.batch_size)
+    print(f"Imported {num_queries} queries into {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import json
 import os
 import time
+import socket
 import requests
+import http.client
+from urllib.parse import urlparse
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 import warnings
@@ -13,8 +16,13 @@ import copy
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from flashrag.utils import get_reranker, get_device
-from flashrag.retriever.utils import load_corpus, load_docs, convert_numpy, judge_image, judge_zh
+from flashrag.retriever.utils import load_corpus, load_docs, judge_image, judge_zh
+from flashrag.retriever.doc_store import DocResolver, RetrievalResult
 from flashrag.retriever.encoder import Encoder, STEncoder, ClipEncoder
+from flashrag.retriever.retrieval_cache import get_retrieval_cache
+from flashrag.retriever.embedding_cache import EmbeddingCache
+from flashrag.retriever.semantic_cache import SemanticCache
+from flashrag.retriever.ann_index import set_search_params, read_faiss_index, ExactRescorer
 import torch
 
 if get_device() == "cpu":
@@ -36,14 +44,11 @@ def cache_manager(func):
             else:
                 new_query_list = query
 
-            no_cache_query = []
+            no_cache_query, no_cache_results, no_cache_scores = [], [], []
             cache_results = []
             for new_query in new_query_list:
-                if new_query in self.cache:
-                    cache_res = self.cache[new_query]
-                    if len(cache_res) < num:
-                        warnings.warn(f"The number of cached retrieval results is less than topk ({num})")
-                    cache_res = cache_res[:num]
+                cache_res = self.cache.get(new_query, num)
+                if cache_res is not None:
                     # separate the doc score
                     doc_scores = [item["score"] for item in cache_res]
                     cache_results.append((cache_res, doc_scores))
@@ -68,23 +73,29 @@ def cache_manager(func):
                 [t[0] for t in cache_results],
                 [t[1] for t in cache_results],
             )
+            if isinstance(query, str):
+                results, scores = results[0], scores[0]
+
+            # only the newly retrieved queries need to be written to the cache
+            save_query, save_results, save_scores = no_cache_query, no_cache_results, no_cache_scores
 
         else:
             results, scores = func(self, query=query, num=num, return_score=True)
-
-        if self.save_cache:
-            # merge result and score
-            save_results = results.copy()
-            save_scores = scores.copy()
+            # compact results (RetrievalResult) have no copy(); the documents are copied when merged below
+            save_query, save_results, save_scores = query, results, scores
             if isinstance(query, str):
-                query = [query]
+                save_query = [query]
                 if "batch" not in func.__name__:
                     save_results = [save_results]
                     save_scores = [save_scores]
-            for new_query, doc_items, doc_scores in zip(query, save_results, save_scores):
-                for item, score in zip(doc_items, doc_scores):
-                    item["score"] = score
-                self.cache[new_query] = doc_items
+
+        if self.save_cache and save_query != []:
+            # merge result and score into copies, so documents shared with the caller or the cache are not mutated
+            save_results = [
+                [{**item, "score": score} for item, score in zip(doc_items, doc_scores)]
+                for doc_items, doc_scores in zip(save_results, save_scores)
+            ]
+            self.cache.put_many(save_query, save_results)
 
         if return_score:
             return results, scores
@@ -152,28 +163,33 @@ class BaseRetriever:
         else:
             self.reranker = None
 
-        if self.save_cache:
-            self.cache_save_path = os.path.join(self._config["save_dir"], "retrieval_cache.json")
-            self.cache = {}
-        if self.use_cache:
-            assert self.cache_path is not None
-            with open(self.cache_path, "r") as f:
-                self.cache = json.load(f)
+        # json: whole cache in memory, saved at the end of the run; sqlite: lazy lookups, inserts written through with save_cache
+        if self.save_cache or self.use_cache:
+            self.cache = get_retrieval_cache(self._config, use_cache=self.use_cache, save_cache=self.save_cache)
+
+        # compact results: corpus row ids and scores per query, documents resolved lazily and shared across queries
+        self.compact_results = (
+            self._config["compact_retrieval_result"] if "compact_retrieval_result" in self._config else False
+        )
+        self.save_retrieval_contents = (
+            self._config["save_retrieval_contents"] if "save_retrieval_contents" in self._config else False
+        )
+        self._doc_resolver = None
         self.silent = self._config["silent_retrieval"] if "silent_retrieval" in self._config else False
 
     def update_additional_setting(self):
         pass
 
     def _save_cache(self):
-        self.cache = convert_numpy(self.cache)
-
-        def custom_serializer(obj):
-            if isinstance(obj, np.float32):
-                return float(obj)
-            raise TypeError(f"Type {type(obj)} not serializable")
+        self.cache.save()
 
-        with open(self.cache_save_path, "w") as f:
-            json.dump(self.cache, f, indent=4, default=custom_serializer)
+    def _load_results(self, idxs, scores):
+        """Documents for the hits of one query: a RetrievalResult when compact results are enabled."""
+        if not self.compact_results:
+            return load_docs(self.corpus, idxs)
+        if self._doc_resolver is None:
+            self._doc_resolver = DocResolver(self.corpus)
+        return RetrievalResult(self._doc_resolver, idxs, scores, save_contents=self.save_retrieval_contents)
 
     def _search(self, query: str, num: int, return_score: bool) -> List[Dict[str, str]]:
         r"""Retrieve topk relevant documents in corpus.
@@ -232,6 +248,8 @@ class BM25Retriever(BaseTextRetriever):
 
     def update_additional_setting(self):
         self.backend = self._config["bm25_backend"]
+        # threads used by batch search: lucene searcher threads for pyserini, numba threads for bm25s (-1 for all cores)
+        self.bm25_threads = self._config["bm25_threads"] if "bm25_threads" in self._config else 8
 
     def load_model_corpus(self, corpus):
         if self.backend == "pyserini":
@@ -245,13 +263,12 @@ class BM25Retriever(BaseTextRetriever):
                     self.corpus = load_corpus(self.corpus_path)
                 else:
                     self.corpus = corpus
-            self.max_process_num = 8
-               
+
         elif self.backend == "bm25s":
             import Stemmer
             import bm25s
 
-            self.corpus = load_corpus(self.corpus_path)
+            self.corpus = load_corpus(self.corpus_path) if corpus is None else corpus
             is_zh = judge_zh(self.corpus[0]["contents"])
 
             self.searcher = bm25s.BM25.load(self.index_path, mmap=True, load_corpus=False)
@@ -265,7 +282,8 @@ class BM25Retriever(BaseTextRetriever):
                 self.tokenizer.load_stopwords(self.index_path)
                 self.tokenizer.load_vocab(self.index_path)
 
-            self.searcher.corpus = self.corpus
+            # bm25s only returns doc indices, documents are gathered from the corpus in one bulk lookup
+            self.searcher.corpus = None
             self.searcher.backend = "numba"
 
         else:
@@ -275,74 +293,82 @@ class BM25Retriever(BaseTextRetriever):
         r"""Check if the index contains document content"""
         return self.searcher.doc(0).raw() is not None
 
-    def _search(self, query: str, num: int = None, return_score=False) -> List[Dict[str, str]]:
-        if num is None:
-            num = self.topk
-        if self.backend == "pyserini":
-            is_zh = judge_zh(query)
-            if is_zh:
-                self.searcher.set_language("zh")
-            hits = self.searcher.search(query, num)
-            if len(hits) < 1:
-                if return_score:
-                    return [], []
-                else:
-                    return []
-
-            scores = [hit.score for hit in hits]
-            if len(hits) < num:
-                warnings.warn("Not enough documents retrieved!")
-            else:
-                hits = hits[:num]
+    def _tokenize(self, query: List[str]):
+        """Token ids of the queries, using the stemmer, stopwords and vocab saved with the bm25s index."""
+        return self.tokenizer.tokenize(query, update_vocab=False, return_as="ids", show_progress=False)
 
-            if self.contain_doc:
-                all_contents = [json.loads(self.searcher.doc(hit.docid).raw())["contents"] for hit in hits]
-                results = [
-                    {
-                        "id": hit.docid, 
-                        "title": content.split("\n")[0].strip('"'),
-                        "text": "\n".join(content.split("\n")[1:]),
-                        "contents": content,
-                    }
-                    for content, hit in zip(all_contents, hits)
-                ]
-            else:
-                results = load_docs(self.corpus, [hit.docid for hit in hits])
-        elif self.backend == "bm25s":
-            import bm25s
+    def _parse_hits(self, hits):
+        """Documents of pyserini hits whose raw json is stored in the index."""
+        results = []
+        for hit in hits:
+            content = json.loads(hit.lucene_document.get("raw"))["contents"]
+            results.append(
+                {
+                    "id": hit.docid,
+                    "title": content.split("\n")[0].strip('"'),
+                    "text": "\n".join(content.split("\n")[1:]),
+                    "contents": content,
+                }
+            )
+        return results
 
-            # query_tokens = self.tokenizer.tokenize([query], return_as="tuple", update_vocab=False)
-            query_tokens = bm25s.tokenize([query])
-            results, scores = self.searcher.retrieve(query_tokens, k=num)
-            results = list(results[0])
-            scores = list(scores[0])
-        else:
-            assert False, "Invalid bm25 backend!"
+    def _load_batch_results(self, batch_idxs, batch_scores):
+        """Documents for the hits of a batch of queries, fetched from the corpus in one bulk lookup."""
+        if self.compact_results:
+            return [self._load_results(idxs, scores) for idxs, scores in zip(batch_idxs, batch_scores)]
+        flat_results = load_docs(self.corpus, [int(idx) for idxs in batch_idxs for idx in idxs])
+        results = []
+        start = 0
+        for idxs in batch_idxs:
+            results.append(flat_results[start : start + len(idxs)])
+            start += len(idxs)
+        return results
 
+    def _search(self, query: str, num: int = None, return_score=False) -> List[Dict[str, str]]:
+        if num is None:
+            num = self.topk
+        results, scores = self._batch_search([query], num, True)
         if return_score:
-            return results, scores
+            return results[0], scores[0]
         else:
-            return results
+            return results[0]
 
     def _batch_search(self, query, num: int = None, return_score=False):
+        if num is None:
+            num = self.topk
         if self.backend == "pyserini":
-            # TODO: modify batch method
-            results = []
-            scores = []
-            for _query in query:
-                item_result, item_score = self._search(_query, num, True)
-                results.append(item_result)
-                scores.append(item_score)
-        elif self.backend == "bm25s":
-            import bm25s
+            # the analyzer is shared by a whole batch, so zh and en queries are searched as separate batches
+            batch_hits = [None] * len(query)
+            for language in ["zh", "en"]:
+                qids = [str(i) for i, _query in enumerate(query) if judge_zh(_query) == (language == "zh")]
+                if len(qids) == 0:
+                    continue
+                self.searcher.set_language(language)
+                language_hits = self.searcher.batch_search(
+                    [query[int(qid)] for qid in qids], qids, k=num, threads=max(self.bm25_threads, 1)
+                )
+                for qid in qids:
+                    batch_hits[int(qid)] = language_hits[qid][:num]
+            if any(len(hits) < num for hits in batch_hits):
+                warnings.warn("Not enough documents retrieved!")
 
-            # query_tokens = self.tokenizer.tokenize(query, return_as="tuple", update_vocab=False)
-            query_tokens = bm25s.tokenize(query)
-            results, scores = self.searcher.retrieve(query_tokens, k=num)
+            scores = [[hit.score for hit in hits] for hits in batch_hits]
+            if self.contain_doc:
+                results = [self._parse_hits(hits) for hits in batch_hits]
+            else:
+                results = self._load_batch_results([[int(hit.docid) for hit in hits] for hits in batch_hits], scores)
+        elif self.backend == "bm25s":
+            import numba
+
+            # numba refuses more threads than its pool size (the number of cores by default)
+            n_threads = numba.config.NUMBA_NUM_THREADS if self.bm25_threads < 0 else self.bm25_threads
+            n_threads = min(n_threads, numba.config.NUMBA_NUM_THREADS)
+            query_tokens = self._tokenize(query)
+            idxs, scores = self.searcher.retrieve(query_tokens, k=num, n_threads=n_threads, show_progress=False)
+            scores = scores.tolist()
+            results = self._load_batch_results(idxs.tolist(), scores)
         else:
             assert False, "Invalid bm25 backend!"
-        results = results.tolist() if isinstance(results, np.ndarray) else results
-        scores = scores.tolist() if isinstance(scores, np.ndarray) else scores
         if return_score:
             return results, scores
         else:
@@ -358,6 +384,7 @@ class DenseRetriever(BaseTextRetriever):
         self.load_corpus(corpus)
         self.load_index()
         self.load_model()
+        self.load_semantic_cache()
 
     def load_corpus(self, corpus):
         if corpus is None:
@@ -365,16 +392,41 @@ class DenseRetriever(BaseTextRetriever):
         else:
             self.corpus = corpus
 
+    def load_semantic_cache(self):
+        # approximate cache for near-duplicate queries, disabled unless a similarity threshold is set
+        threshold = self._config["semantic_cache_threshold"] if "semantic_cache_threshold" in self._config else None
+        if threshold is None:
+            self.semantic_cache = None
+            return
+        self.semantic_cache = SemanticCache(
+            threshold=threshold,
+            max_size=self._config["semantic_cache_size"] if "semantic_cache_size" in self._config else 10000,
+            shadow=self._config["semantic_cache_shadow"] if "semantic_cache_shadow" in self._config else False,
+        )
+
     def load_index(self):
         if self.index_path is None or not os.path.exists(self.index_path):
             raise Warning(f"Index file {self.index_path} does not exist!")
-        self.index = faiss.read_index(self.index_path)
+        self.index = read_faiss_index(self.index_path, mmap=self.faiss_mmap and not self.use_faiss_gpu)
+        set_search_params(self.index, **self.search_params)
         if self.use_faiss_gpu:
             co = faiss.GpuMultipleClonerOptions()
             co.useFloat16 = True
             co.shard = True
             self.index = faiss.index_cpu_to_all_gpus(self.index, co=co)
 
+        # exact re-scoring of the top candidates of a quantized index with the saved float32 embeddings
+        if self.rescore_embedding_path is not None:
+            self.rescorer = ExactRescorer(self.rescore_embedding_path, self.index.d)
+        else:
+            self.rescorer = None
+
+    def _index_search(self, emb, num):
+        if self.rescorer is None:
+            return self.index.search(emb, k=num)
+        _, idxs = self.index.search(emb, k=num * self.rescore_k_factor)
+        return self.rescorer.rescore(emb, idxs, num)
+
     def update_additional_setting(self):
         self.query_max_length = self._config["retrieval_query_max_length"]
         self.pooling_method = self._config["retrieval_pooling_method"]
@@ -385,8 +437,34 @@ class DenseRetriever(BaseTextRetriever):
         self.retrieval_model_path = self._config["retrieval_model_path"]
         self.use_st = self._config["use_sentence_transformer"]
         self.use_faiss_gpu = self._config["faiss_gpu"]
+        # search-time ANN parameters (IVF nprobe, HNSW efSearch, refinement k_factor), None keeps the faiss default
+        self.search_params = {
+            name: self._config[key] if key in self._config else None
+            for name, key in [("nprobe", "faiss_nprobe"), ("efSearch", "faiss_efsearch"), ("k_factor", "faiss_k_factor")]
+        }
+        self.faiss_mmap = self._config["faiss_mmap"] if "faiss_mmap" in self._config else False
+        self.rescore_embedding_path = (
+            self._config["faiss_rescore_embedding_path"] if "faiss_rescore_embedding_path" in self._config else None
+        )
+        self.rescore_k_factor = (
+            self._config["faiss_rescore_k_factor"] if "faiss_rescore_k_factor" in self._config else None
+        ) or 4
 
     def load_model(self):
+        # cache of recent query embeddings, so repeated queries skip the model
+        embedding_cache_size = self._config["embedding_cache_size"] if "embedding_cache_size" in self._config else 0
+        if embedding_cache_size:
+            model_path = self._config["retrieval_model_path"] if self.use_st else self.retrieval_model_path
+            pooling_method = "sentence_transformer" if self.use_st else self.pooling_method
+            embedding_cache = EmbeddingCache(
+                max_size=embedding_cache_size,
+                cache_path=self._config["embedding_cache_path"] if "embedding_cache_path" in self._config else None,
+                namespace=f"{model_path}\t{pooling_method}\t{self.query_max_length}",
+                dtype=self._config["embedding_cache_dtype"] if "embedding_cache_dtype" in self._config else "float32",
+            )
+        else:
+            embedding_cache = None
+
         if self.use_st:
             self.encoder = STEncoder(
                 model_name=self.retrieval_method,
@@ -395,6 +473,7 @@ class DenseRetriever(BaseTextRetriever):
                 use_fp16=self.use_fp16,
                 instruction=self.instruction,
                 silent=self.silent,
+                embedding_cache=embedding_cache,
             )
         else:
             # check pooling method
@@ -406,6 +485,12 @@ class DenseRetriever(BaseTextRetriever):
                 max_length=self.query_max_length,
                 use_fp16=self.use_fp16,
                 instruction=self.instruction,
+                embedding_cache=embedding_cache,
+                max_tokens_per_batch=(
+                    self._config["retrieval_max_tokens_per_batch"]
+                    if "retrieval_max_tokens_per_batch" in self._config
+                    else None
+                ),
             )
 
     def _check_pooling_method(self, model_path, pooling_method):
@@ -432,16 +517,51 @@ class DenseRetriever(BaseTextRetriever):
                 f"Pooling method in model config file is {detect_pooling_method}, but the input is {pooling_method}. Please check carefully."
             )
 
+    def _semantic_cache_search(self, emb, num):
+        """Index search that serves near-duplicate queries from the semantic cache.
+
+        Hits reuse the row ids and scores of the cached query; only the misses are searched in the index
+        and then added to the cache. In shadow mode every query is searched and the real results are
+        returned, while overlap@k with the would-be cached hits is recorded.
+        """
+        cached = self.semantic_cache.lookup(emb, num)
+        if self.semantic_cache.shadow:
+            search_ids = list(range(len(emb)))
+        else:
+            search_ids = [i for i, item in enumerate(cached) if item is None]
+
+        scores = np.zeros((len(emb), num), dtype=np.float32)
+        idxs = np.zeros((len(emb), num), dtype=np.int64)
+        for i, item in enumerate(cached):
+            if item is not None:
+                idxs[i], scores[i] = item
+        if search_ids:
+            search_scores, search_idxs = self._index_search(emb[search_ids], num)
+            scores[search_ids] = search_scores
+            idxs[search_ids] = search_idxs
+            miss_ids = [pos for pos, i in enumerate(search_ids) if cached[i] is None]
+            for pos, i in enumerate(search_ids):
+                if cached[i] is not None:
+                    self.semantic_cache.record_overlap(cached[i][0], search_idxs[pos])
+            if miss_ids:
+                self.semantic_cache.add(
+                    emb[[search_ids[pos] for pos in miss_ids]], search_idxs[miss_ids], search_scores[miss_ids]
+                )
+        return scores, idxs
+
     def _search(self, query: str, num: int = None, return_score=False):
         if num is None:
             num = self.topk
         query_emb = self.encoder.encode(query)
-        scores, idxs = self.index.search(query_emb, k=num)
+        if self.semantic_cache is not None:
+            scores, idxs = self._semantic_cache_search(query_emb, num)
+        else:
+            scores, idxs = self._index_search(query_emb, num)
         scores = scores.tolist()
         idxs = idxs[0]
         scores = scores[0]
 
-        results = load_docs(self.corpus, idxs)
+        results = self._load_results(idxs, scores)
         if return_score:
             return results, scores
         else:
@@ -457,13 +577,19 @@ class DenseRetriever(BaseTextRetriever):
         results = []
         scores = []
         emb = self.encoder.encode(query, batch_size=batch_size, is_query=True)
-        scores, idxs = self.index.search(emb, k=num)
+        if self.semantic_cache is not None:
+            scores, idxs = self._semantic_cache_search(emb, num)
+        else:
+            scores, idxs = self._index_search(emb, num)
         scores = scores.tolist()
         idxs = idxs.tolist()
 
-        flat_idxs = [idx for sublist in idxs for idx in sublist]
-        results = load_docs(self.corpus, flat_idxs)
-        results = [results[i * num : (i + 1) * num] for i in range(len(idxs))]
+        if self.compact_results:
+            results = [self._load_results(row_idxs, row_scores) for row_idxs, row_scores in zip(idxs, scores)]
+        else:
+            flat_idxs = [idx for sublist in idxs for idx in sublist]
+            results = load_docs(self.corpus, flat_idxs)
+            results = [results[i * num : (i + 1) * num] for i in range(len(idxs))]
 
         if return_score:
             return results, scores
@@ -484,6 +610,12 @@ class MultiModalRetriever(BaseRetriever):
             idx_path = self.mm_index_dict[modal]
             if idx_path is not None:
                 self.index_dict[modal] = faiss.read_index(idx_path)
+                set_search_params(
+                    self.index_dict[modal],
+                    nprobe=config["faiss_nprobe"] if "faiss_nprobe" in config else None,
+                    efSearch=config["faiss_efsearch"] if "faiss_efsearch" in config else None,
+                    k_factor=config["faiss_k_factor"] if "faiss_k_factor" in config else None,
+                )
             if config["faiss_gpu"]:
                 co = faiss.GpuMultipleClonerOptions()
                 co.useFloat16 = True
@@ -1143,6 +1275,74 @@ class SparseRetriever(BaseTextRetriever):
         )
         return search_results
 
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RemoteRetriever(BaseTextRetriever):
+    r"""Client of a retriever served by ``python -m flashrag.retriever.server``.
+
+    ``retrieval_server_url`` is either ``http://host:port`` or ``unix:///path/to/socket``. Caching and
+    reranking configured on the client side are applied on top of the server results.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+
+    def update_additional_setting(self):
+        self.server_url = self._config["retrieval_server_url"]
+        self.timeout = self._config["retrieval_server_timeout"] if "retrieval_server_timeout" in self._config else 300
+
+    def _connect(self):
+        if self.server_url.startswith("unix://"):
+            return _UnixHTTPConnection(self.server_url[len("unix://") :], timeout=self.timeout)
+        parsed = urlparse(self.server_url)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload=None):
+        connection = self._connect()
+        try:
+            body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Retrieval server at {self.server_url} returned {response.status}: {data.get('error')}")
+        return data
+
+    def health(self) -> Dict:
+        return self._request("GET", "/health")
+
+    def _search(self, query: str, num: int = None, return_score=False):
+        if num is None:
+            num = self.topk
+        data = self._request("POST", "/search", {"query": query, "num": num})
+        if return_score:
+            return data["results"], data["scores"]
+        else:
+            return data["results"]
+
+    def _batch_search(self, query: List[str], num: int = None, return_score=False):
+        if isinstance(query, str):
+            query = [query]
+        if num is None:
+            num = self.topk
+        data = self._request("POST", "/batch_search", {"query": query, "num": num})
+        if return_score:
+            return data["results"], data["scores"]
+        else:
+            return data["results"]
+
+
 class SerperRetriever(BaseRetriever):
     """Retriever based on Google Serper API for web search."""
 
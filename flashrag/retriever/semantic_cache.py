@@ -0,0 +1,118 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """Approximate retrieval cache for near-duplicate queries.
+
+    The normalized embeddings of cached queries are kept in a small FAISS inner-product index together
+    with the corpus row ids and scores of their hits. A query whose cosine similarity to its nearest cached
+    query is at least ``threshold`` (and whose ``num`` does not exceed the cached depth) reuses those hits,
+    so the main index search is skipped. The oldest entries are evicted beyond ``max_size``.
+
+    In ``shadow`` mode the real search still runs for every query and its results are returned; for would-be
+    hits the overlap@k between cached and real hits is recorded, so the threshold can be tuned safely.
+
+    Nearest-neighbour similarities are counted in ``SIMILARITY_BINS`` fixed bins over [-1, 1] rather than kept
+    one by one, so the statistics take constant memory however long the retriever lives; the percentiles in
+    ``summary()`` are accurate to the bin width (0.002).
+    """
+
+    SIMILARITY_BINS = 1000
+
+    def __init__(self, threshold: float = 0.95, max_size: int = 10000, shadow: bool = False):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.shadow = shadow
+        self.index = None
+        self.entries = {}  # entry id -> (row ids, scores)
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.similarity_counts = np.zeros(self.SIMILARITY_BINS, dtype=np.int64)
+        self.overlap_sum = 0.0
+        self.overlap_checks = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(emb: np.ndarray) -> np.ndarray:
+        emb = np.array(emb, dtype=np.float32, order="C")
+        faiss.normalize_L2(emb)
+        return emb
+
+    def lookup(self, emb: np.ndarray, num: int) -> List[Optional[Tuple[np.ndarray, np.ndarray]]]:
+        """Return the cached (row ids, scores) for each query embedding, or None on a miss."""
+        emb = self._normalize(emb)
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                self.misses += len(emb)
+                return [None] * len(emb)
+            sims, entry_ids = self.index.search(emb, 1)
+            bins = np.floor((sims[:, 0] + 1.0) / 2.0 * self.SIMILARITY_BINS).astype(np.int64)
+            np.add.at(self.similarity_counts, np.clip(bins, 0, self.SIMILARITY_BINS - 1), 1)
+            results = []
+            for sim, entry_id in zip(sims[:, 0], entry_ids[:, 0]):
+                entry = self.entries.get(int(entry_id))
+                if entry is not None and sim >= self.threshold and len(entry[0]) >= num:
+                    self.hits += 1
+                    results.append((entry[0][:num], entry[1][:num]))
+                else:
+                    self.misses += 1
+                    results.append(None)
+            return results
+
+    def add(self, emb: np.ndarray, idxs: np.ndarray, scores: np.ndarray):
+        emb = self._normalize(emb)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(emb.shape[1]))
+            entry_ids = np.arange(self.next_id, self.next_id + len(emb), dtype=np.int64)
+            self.next_id += len(emb)
+            self.index.add_with_ids(emb, entry_ids)
+            for entry_id, row_idxs, row_scores in zip(entry_ids, idxs, scores):
+                self.entries[int(entry_id)] = (np.asarray(row_idxs), np.asarray(row_scores))
+
+            if len(self.entries) > self.max_size:
+                expired = np.array(sorted(self.entries)[: len(self.entries) - self.max_size], dtype=np.int64)
+                self.index.remove_ids(expired)
+                for entry_id in expired:
+                    del self.entries[int(entry_id)]
+
+    def record_overlap(self, cached_idxs: np.ndarray, real_idxs: np.ndarray):
+        """Shadow mode: overlap@k between the cached hits and the hits of the real search."""
+        k = len(real_idxs)
+        if k > 0:
+            self.overlap_sum += len(set(np.asarray(cached_idxs).tolist()) & set(np.asarray(real_idxs).tolist())) / k
+            self.overlap_checks += 1
+
+    def summary(self) -> Dict:
+        """Hit counts, the distribution of nearest-neighbour similarities and (in shadow mode) overlap@k."""
+        lookups = self.hits + self.misses
+        result = {
+            "lookups": lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "threshold": self.threshold,
+            "size": len(self.entries),
+        }
+        total = int(self.similarity_counts.sum())
+        if total > 0:
+            # percentile q is the centre of the first bin whose cumulative count reaches q% of the lookups
+            cumulative = np.cumsum(self.similarity_counts)
+            bin_width = 2.0 / self.SIMILARITY_BINS
+            result["similarity_percentiles"] = {
+                f"p{q}": round(-1.0 + (int(np.searchsorted(cumulative, q / 100 * total)) + 0.5) * bin_width, 4)
+                for q in (10, 25, 50, 75, 90, 99)
+            }
+            # ten 0.1-wide bins over [0, 1], negative similarities counted in the first one
+            half = self.SIMILARITY_BINS // 2
+            counts = self.similarity_counts[half:].reshape(10, -1).sum(axis=1)
+            counts[0] += self.similarity_counts[:half].sum()
+            result["similarity_histogram"] = {f"{i / 10:.1f}-{(i + 1) / 10:.1f}": int(c) for i, c in enumerate(counts)}
+        if self.shadow:
+            result["shadow_overlap_at_k"] = self.overlap_sum / self.overlap_checks if self.overlap_checks else None
+            result["shadow_checks"] = self.overlap_checks
+        return result
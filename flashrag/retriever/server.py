@@ -0,0 +1,128 @@
+import os
+import json
+import argparse
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flashrag.retriever.utils import convert_numpy
+from flashrag.retriever.dispatcher import RetrievalDispatcher
+
+
+class _RetrievalRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints: ``GET /health``, ``POST /search`` and ``POST /batch_search``."""
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        retriever = self.server.retriever
+        self._send_json(
+            200,
+            {
+                "retrieval_method": getattr(retriever, "retrieval_method", None),
+                "topk": getattr(retriever, "topk", None),
+                "batching": retriever.stats() if isinstance(retriever, RetrievalDispatcher) else None,
+            },
+        )
+
+    def do_POST(self):
+        if self.path not in ("/search", "/batch_search"):
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            query = request["query"]
+            if self.path == "/search":
+                query = [query]
+            results, scores = self.server.retriever.batch_search(query, num=request.get("num"), return_score=True)
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        # compact results are sent as plain documents
+        results = convert_numpy([[dict(doc) for doc in docs] for docs in results])
+        scores = convert_numpy([list(doc_scores) for doc_scores in scores])
+        if self.path == "/search":
+            results, scores = results[0], scores[0]
+        self._send_json(200, {"results": results, "scores": scores})
+
+    def log_message(self, format, *args):
+        if not self.server.silent:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class _ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    # many pipeline workers may connect at once
+    request_queue_size = 1024
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def build_server(retriever, host: str = "127.0.0.1", port: int = 8000, unix_socket: str = None, silent: bool = True):
+    """HTTP server exposing ``retriever`` over TCP, or over a Unix socket when ``unix_socket`` is given.
+
+    Each connection is handled in its own thread, so wrap the retriever in a ``RetrievalDispatcher``
+    to merge concurrent requests into batched searches.
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _ThreadingUnixHTTPServer(unix_socket, _RetrievalRequestHandler)
+    else:
+        server = _ThreadingTCPHTTPServer((host, port), _RetrievalRequestHandler)
+    server.retriever = retriever
+    server.silent = silent
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a FlashRAG retriever to other processes over HTTP.")
+    parser.add_argument("--config_path", type=str, required=True, help="Config used to build the retriever")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix_socket", type=str, default=None, help="Serve on this Unix socket instead of TCP")
+    parser.add_argument("--max_batch_size", type=int, default=64)
+    parser.add_argument("--wait_ms", type=float, default=5, help="Batching window after the first pending query")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    from flashrag.config import Config
+    from flashrag.utils import get_retriever
+
+    # the server loads the retriever itself and batches requests with its own dispatcher
+    config = Config(
+        args.config_path,
+        {"retrieval_server_url": None, "use_retrieval_dispatcher": False, "disable_save": True},
+    )
+    retriever = RetrievalDispatcher(get_retriever(config), max_batch_size=args.max_batch_size, max_wait_ms=args.wait_ms)
+    server = build_server(retriever, args.host, args.port, args.unix_socket, silent=not args.verbose)
+    address = args.unix_socket if args.unix_socket is not None else f"http://{args.host}:{args.port}"
+    print(f"Serving {config['retrieval_method']} retriever at {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        retriever.close()
+        if args.unix_socket is not None and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
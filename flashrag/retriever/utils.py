@@ -8,6 +8,7 @@ import re
 import langid
 from transformers import AutoTokenizer, AutoModel, AutoConfig
 from flashrag.utils import get_device
+from flashrag.retriever.doc_store import DocStore, is_doc_store
 
 _has_printed_instruction = False  # trigger instruction print once
 
@@ -127,6 +128,8 @@ def parse_query(model_name, query_list, instruction=None, is_query=True):
 
 
 def load_corpus(corpus_path: str):
+    if is_doc_store(corpus_path):
+        return DocStore(corpus_path)
     if corpus_path.endswith(".jsonl"):
         corpus = datasets.load_dataset('json', data_files=corpus_path, split="train")
     elif corpus_path.endswith(".parquet"):
@@ -154,11 +157,41 @@ def read_jsonl(file_path):
 
 
 def load_docs(corpus, doc_idxs: List[int]):
+    if isinstance(corpus, DocStore):
+        return corpus.take(doc_idxs)
+    if isinstance(corpus, datasets.Dataset):
+        # one arrow take for the whole batch instead of a row lookup per id
+        columns = corpus[[int(idx) for idx in doc_idxs]]
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
     results = [corpus[int(idx)] for idx in doc_idxs]
 
     return results
 
 
+def token_budget_batches(lengths: List[int], max_tokens: int) -> List[np.ndarray]:
+    """Group inputs of similar length into batches whose padded size stays within ``max_tokens``.
+
+    Inputs are sorted by length (longest first) and a batch is closed when adding the next input would make
+    ``batch size * longest length`` exceed the budget. Returns the input indices of each batch; an input
+    longer than the budget forms a batch of its own.
+    """
+    lengths = np.asarray(lengths)
+    batches = []
+    current = []
+    longest = 0
+    for idx in np.argsort(-lengths, kind="stable"):
+        longest_after = max(longest, int(lengths[idx]))
+        if current and (len(current) + 1) * longest_after > max_tokens:
+            batches.append(np.asarray(current))
+            current = []
+            longest_after = int(lengths[idx])
+        current.append(idx)
+        longest = longest_after
+    if current:
+        batches.append(np.asarray(current))
+    return batches
+
+
 def parse_image(image):
     from PIL import Image
 
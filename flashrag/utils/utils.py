@@ -78,6 +78,22 @@ def get_retriever(config):
     Returns:
         Retriever: retriever instance
     """
+    retriever = _get_retriever(config)
+    if config["use_retrieval_dispatcher"]:
+        # micro-batch concurrent single-query searches into one batch_search call
+        return getattr(importlib.import_module("flashrag.retriever"), "RetrievalDispatcher")(
+            retriever,
+            max_batch_size=config["retrieval_dispatcher_max_batch_size"] or 64,
+            max_wait_ms=config["retrieval_dispatcher_wait_ms"] or 5,
+        )
+    return retriever
+
+
+def _get_retriever(config):
+    if config["retrieval_server_url"]:
+        # retriever loaded once by a separate server process
+        return getattr(importlib.import_module("flashrag.retriever"), "RemoteRetriever")(config)
+
     if config["use_multi_retriever"]:
         # must load special class for manage multi retriever
         return getattr(importlib.import_module("flashrag.retriever"), "MultiRetrieverRouter")(config)
@@ -0,0 +1,54 @@
+"""Small deterministic corpus and retriever shared by the retriever tests."""
+
+from flashrag.retriever.retriever import BaseTextRetriever
+
+FAKE_CORPUS = [{"id": str(i), "contents": f'"Doc {i}"\nword{i} word{i % 3} common'} for i in range(20)]
+
+
+def build_retriever_config(**overrides):
+    config = {
+        "retrieval_method": "fake",
+        "retrieval_topk": 3,
+        "index_path": None,
+        "corpus_path": None,
+        "save_retrieval_cache": False,
+        "use_retrieval_cache": False,
+        "retrieval_cache_path": None,
+        "use_reranker": False,
+        "save_dir": "/tmp",
+    }
+    config.update(overrides)
+    return config
+
+
+class FakeTextRetriever(BaseTextRetriever):
+    """Scores FAKE_CORPUS by term overlap with the query and records every query it actually searched."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.corpus = FAKE_CORPUS
+        self.searched = []
+
+    def _search(self, query, num=None, return_score=False):
+        results, scores = self._batch_search([query], num, True)
+        return (results[0], scores[0]) if return_score else results[0]
+
+    def _batch_search(self, query, num=None, return_score=False):
+        num = self.topk if num is None else num
+        self.searched.extend(query)
+        results, scores = [], []
+        for q in query:
+            overlap = [len(set(q.split()) & set(doc["contents"].split())) for doc in FAKE_CORPUS]
+            idxs = sorted(range(len(FAKE_CORPUS)), key=lambda i: (-overlap[i], i))[:num]
+            scores.append([float(overlap[i]) for i in idxs])
+            results.append(self._load_results(idxs, scores[-1]))
+        return (results, scores) if return_score else results
+
+
+def build_fake_retriever(**config_overrides):
+    return FakeTextRetriever(build_retriever_config(**config_overrides))
+
+
+def doc_ids(results):
+    """Document ids of the results of each query."""
+    return [[doc["id"] for doc in docs] for docs in results]
@@ -0,0 +1,97 @@
+import faiss
+import numpy as np
+import pytest
+
+from flashrag.retriever.ann_index import (
+    DEFAULT_MAX_TRAIN_SIZE,
+    ExactRescorer,
+    choose_faiss_type,
+    faiss_type_file_name,
+    quantized_faiss_type,
+    set_search_params,
+    suggest_nlist,
+    train_sample,
+)
+
+
+def test_choose_faiss_type():
+    assert choose_faiss_type(50_000, 768) == "Flat"
+    assert choose_faiss_type(1_000_000, 768) == "HNSW32"
+    assert choose_faiss_type(1_000_000, 768, memory_budget_gb=2) == f"IVF{suggest_nlist(1_000_000)},PQ64"
+    assert choose_faiss_type(10_000_000, 768) == f"IVF{suggest_nlist(10_000_000)},Flat"
+    assert suggest_nlist(1_000_000) == 4096
+
+
+def test_set_search_params():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((2000, 16)).astype(np.float32)
+    ivf = faiss.index_factory(16, "IVF16,Flat", faiss.METRIC_INNER_PRODUCT)
+    ivf.train(data)
+    ivf.add(data)
+    _, default_idxs = ivf.search(data[:20], 5)
+
+    set_search_params(ivf, nprobe=16)
+    assert faiss.extract_index_ivf(ivf).nprobe == 16
+    _, exact_idxs = faiss.knn(data[:20], data, 5, metric=faiss.METRIC_INNER_PRODUCT)
+    _, idxs = ivf.search(data[:20], 5)
+    assert (idxs == exact_idxs).all()
+    assert not (default_idxs == exact_idxs).all()
+
+    hnsw = faiss.index_factory(16, "HNSW8", faiss.METRIC_INNER_PRODUCT)
+    with pytest.warns(UserWarning, match="nprobe"):
+        set_search_params(hnsw, nprobe=4, efSearch=64)
+    assert hnsw.hnsw.efSearch == 64
+
+
+@pytest.fixture(scope="module")
+def embeddings(tmp_path_factory):
+    path = tmp_path_factory.mktemp("emb") / "emb_test.memmap"
+    memmap = np.memmap(path, mode="w+", dtype=np.float32, shape=(DEFAULT_MAX_TRAIN_SIZE + 4000, 8))
+    memmap[:] = np.random.default_rng(0).standard_normal(memmap.shape)
+    memmap.flush()
+    return np.memmap(path, mode="r", dtype=np.float32, shape=memmap.shape)
+
+
+def test_train_sample_size(embeddings):
+    ivf = faiss.index_factory(8, "IVF4,Flat", faiss.METRIC_INNER_PRODUCT)
+    assert len(train_sample(embeddings, ivf)) == 4 * 256
+    assert len(train_sample(embeddings, ivf, max_train_size=100)) == 100
+
+    # the IVF of GPU clones and shards cannot be extracted: nlist comes from the factory string
+    pq = faiss.index_factory(8, "PQ4", faiss.METRIC_INNER_PRODUCT)
+    assert faiss.try_extract_index_ivf(pq) is None
+    assert len(train_sample(embeddings, pq, faiss_type="IVF8,PQ4")) == 8 * 256
+    # indexes without IVF lists are capped instead of reading the whole matrix
+    sample = train_sample(embeddings, pq, faiss_type="PQ4")
+    assert len(sample) == DEFAULT_MAX_TRAIN_SIZE
+    assert isinstance(sample, np.ndarray) and not isinstance(sample, np.memmap)
+
+
+def test_train_sample_keeps_small_corpora(embeddings):
+    small = embeddings[:500]
+    assert train_sample(small, faiss.index_factory(8, "IVF4,Flat", faiss.METRIC_INNER_PRODUCT)) is small
+
+
+def test_exact_rescorer_orders_candidates(tmp_path):
+    embeddings = np.array([[1, 0], [0.9, 0.1], [0, 1], [0.5, 0.5]], dtype=np.float32)
+    embedding_path = tmp_path / "emb_test.memmap"
+    memmap = np.memmap(embedding_path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+    memmap[:] = embeddings
+    memmap.flush()
+
+    rescorer = ExactRescorer(str(embedding_path), 2)
+    queries = np.array([[1, 0], [0, 1]], dtype=np.float32)
+    scores, idxs = rescorer.rescore(queries, np.array([[2, 3, 1, 0], [0, -1, 3, 2]]), 3)
+    assert idxs.tolist() == [[0, 1, 3], [2, 3, 0]]
+    assert np.allclose(scores, [[1.0, 0.9, 0.5], [1.0, 0.5, 0.0]])
+
+    # missing candidates (-1) sort last
+    scores, idxs = rescorer.rescore(queries[:1], np.array([[2, -1, -1]]), 2)
+    assert idxs.tolist() == [[2, -1]]
+    assert scores[0, 1] == -np.inf
+
+
+def test_variant_file_names_have_no_commas():
+    assert quantized_faiss_type("opq_pq", 768) == "OPQ64,PQ64"
+    assert faiss_type_file_name(quantized_faiss_type("opq_pq", 768)) == "OPQ64_PQ64"
+    assert faiss_type_file_name(quantized_faiss_type("sq8", 768)) == "SQ8"
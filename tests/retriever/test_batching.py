@@ -0,0 +1,40 @@
+import torch
+
+from flashrag.retriever.encoder import Encoder
+from flashrag.retriever.utils import token_budget_batches
+
+LENGTHS = [3, 12, 5, 5, 40, 1, 8, 12, 2]
+
+
+def test_batches_cover_every_input_within_budget():
+    batches = token_budget_batches(LENGTHS, 24)
+    assert sorted(int(i) for batch in batches for i in batch) == list(range(len(LENGTHS)))
+    for batch in batches:
+        # only an input longer than the budget may exceed it, in a batch of its own
+        assert len(batch) * max(LENGTHS[i] for i in batch) <= 24 or len(batch) == 1
+    assert [4] in [batch.tolist() for batch in batches]
+
+
+class FakeTokenizer:
+    """Tokenizes "<i> <i> ..." into as many copies of token id i as there are words."""
+
+    def __call__(self, texts, max_length=None, truncation=True):
+        return {"input_ids": [[int(text.split()[0])] * len(text.split()) for text in texts]}
+
+    def pad(self, features, return_tensors="pt"):
+        longest = max(len(ids) for ids in features["input_ids"])
+        return {"input_ids": torch.tensor([ids + [0] * (longest - len(ids)) for ids in features["input_ids"]])}
+
+
+def test_token_budget_encode_restores_input_order():
+    encoder = Encoder.__new__(Encoder)
+    encoder.tokenizer = FakeTokenizer()
+    encoder.max_length = 64
+    encoder.max_tokens_per_batch = 24
+    encoder.silent = True
+    # the "embedding" of each input is its own index, recovered from its token ids
+    encoder._encode_inputs = lambda inputs: inputs["input_ids"].max(dim=1, keepdim=True).values.numpy()
+
+    texts = [" ".join([str(i)] * length) for i, length in enumerate(LENGTHS)]
+    query_emb = encoder._token_budget_encode(texts)
+    assert query_emb[:, 0].tolist() == list(range(len(LENGTHS)))
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+
+from flashrag.retriever.retriever import BM25Retriever
+from tests.retriever.fakes import FAKE_CORPUS, build_retriever_config, doc_ids
+
+QUERIES = ["word1 common", "word4 word1", "word2", "word7 word0 word1"]
+
+
+def overlap_hits(query, k):
+    overlap = [len(set(query.split()) & set(doc["contents"].split())) for doc in FAKE_CORPUS]
+    idxs = sorted(range(len(FAKE_CORPUS)), key=lambda i: (-overlap[i], i))[:k]
+    return [SimpleNamespace(docid=str(i), score=float(overlap[i])) for i in idxs]
+
+
+class FakeLuceneSearcher:
+    """Stand-in for pyserini's LuceneSearcher that scores by term overlap and records the analyzer of each query."""
+
+    def __init__(self):
+        self.language = "en"
+        self.searched_languages = {}
+
+    def set_language(self, language):
+        self.language = language
+
+    def search(self, query, k):
+        return overlap_hits(query, k)
+
+    def batch_search(self, queries, qids, k, threads):
+        for query in queries:
+            self.searched_languages[query] = self.language
+        # pyserini returns a dict keyed by qid, in no particular order and possibly with more than k hits
+        return {qid: overlap_hits(query, k + 2) for query, qid in reversed(list(zip(queries, qids)))}
+
+
+class FakeBM25Retriever(BM25Retriever):
+    def load_model_corpus(self, corpus):
+        self.searcher = FakeLuceneSearcher()
+        self.contain_doc = False
+        self.corpus = corpus
+
+
+def build_pyserini_retriever(**config_overrides):
+    config = build_retriever_config(
+        retrieval_method="bm25", bm25_backend="pyserini", bm25_threads=4, **config_overrides
+    )
+    return FakeBM25Retriever(config, corpus=FAKE_CORPUS)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_pyserini_batch_search_matches_single_search(compact):
+    retriever = build_pyserini_retriever(compact_retrieval_result=compact)
+    results, scores = retriever._batch_search(QUERIES, 3, True)
+    expected_hits = [retriever.searcher.search(query, 3) for query in QUERIES]
+    assert doc_ids(results) == [[hit.docid for hit in hits] for hits in expected_hits]
+    assert scores == [[hit.score for hit in hits] for hits in expected_hits]
+    for query, result in zip(QUERIES, results):
+        assert list(retriever._search(query, 3)) == list(result)
+
+
+def test_pyserini_batch_search_uses_analyzer_per_language():
+    retriever = build_pyserini_retriever()
+    queries = ["word1 common", "中文 word2", "word4 word1", "检索 word7"]
+    results, scores = retriever._batch_search(queries, 3, True)
+    assert retriever.searcher.searched_languages == {
+        "word1 common": "en",
+        "中文 word2": "zh",
+        "word4 word1": "en",
+        "检索 word7": "zh",
+    }
+    assert doc_ids(results) == [[hit.docid for hit in overlap_hits(query, 3)] for query in queries]
+
+    # a later english-only batch does not keep the zh analyzer
+    retriever._batch_search(["word2 common"], 3)
+    assert retriever.searcher.searched_languages["word2 common"] == "en"
+
+
+def test_bm25s_batch_search_matches_single_search(tmp_path):
+    bm25s = pytest.importorskip("bm25s")
+    Stemmer = pytest.importorskip("Stemmer")
+
+    index_path = str(tmp_path)
+    tokenizer = bm25s.tokenization.Tokenizer(stopwords="en", stemmer=Stemmer.Stemmer("english"))
+    searcher = bm25s.BM25(backend="numba")
+    corpus_tokens = tokenizer.tokenize([doc["contents"] for doc in FAKE_CORPUS], return_as="tuple", show_progress=False)
+    searcher.index(corpus_tokens, show_progress=False)
+    searcher.save(index_path, corpus=None)
+    tokenizer.save_vocab(index_path)
+    tokenizer.save_stopwords(index_path)
+
+    config = build_retriever_config(retrieval_method="bm25", bm25_backend="bm25s", bm25_threads=2, index_path=index_path)
+    retriever = BM25Retriever(config, corpus=FAKE_CORPUS)
+    results, scores = retriever._batch_search(QUERIES, 3, True)
+    for query, result, score in zip(QUERIES, results, scores):
+        idxs, query_scores = retriever.searcher.retrieve(retriever._tokenize([query]), k=3, n_threads=1, show_progress=False)
+        assert [doc["id"] for doc in result] == [str(i) for i in idxs[0]]
+        assert score == query_scores[0].tolist()
@@ -0,0 +1,42 @@
+import pytest
+
+from flashrag.retriever.doc_store import DocResolver, RetrievalResult
+from tests.retriever.fakes import FAKE_CORPUS, build_fake_retriever
+
+QUERIES = ["word1 common", "word4 word1"]
+
+
+@pytest.mark.parametrize("save_cache", [False, True])
+def test_compact_results_match_full_results(tmp_path, save_cache):
+    expected, expected_scores = build_fake_retriever().batch_search(QUERIES, return_score=True)
+    retriever = build_fake_retriever(
+        compact_retrieval_result=True, save_retrieval_cache=save_cache, save_dir=str(tmp_path)
+    )
+
+    results, scores = retriever.batch_search(QUERIES, return_score=True)
+    assert all(isinstance(result, RetrievalResult) for result in results)
+    assert [list(result) for result in results] == expected
+    assert scores == expected_scores
+
+    result = retriever.search(QUERIES[0])
+    assert isinstance(result, RetrievalResult)
+    assert list(result) == expected[0]
+    if save_cache:
+        cached = retriever.cache.get(QUERIES[0], 3)
+        assert cached == [{**doc, "score": score} for doc, score in zip(expected[0], expected_scores[0])]
+
+
+def test_documents_are_resolved_lazily_and_shared():
+    resolver = DocResolver(FAKE_CORPUS, max_size=2)
+    first = RetrievalResult(resolver, [1, 4], [2.0, 1.0])
+    second = RetrievalResult(resolver, [4, 0], [3.0, 1.0])
+
+    assert first[1] is second[0]
+    assert first[1] == FAKE_CORPUS[4]
+    assert list(resolver.docs) == [4]
+    assert first[:1].ids.tolist() == [1]
+
+    list(first), list(second)
+    assert list(resolver.docs) == [4, 0]
+    assert second.to_json() == {"ids": [4, 0], "scores": [3.0, 1.0]}
+    assert second.to_docs()[0] == {**FAKE_CORPUS[4], "score": 3.0}
@@ -0,0 +1,80 @@
+import asyncio
+import queue
+import threading
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import flashrag.retriever.dispatcher as dispatcher_module
+from flashrag.retriever import RetrievalDispatcher
+from tests.retriever.fakes import build_fake_retriever
+
+QUERIES = [f"word{i} common" for i in range(8)]
+
+
+def test_concurrent_searches_are_batched():
+    expected, expected_scores = build_fake_retriever().batch_search(QUERIES, return_score=True)
+    dispatcher = RetrievalDispatcher(build_fake_retriever(), max_batch_size=4, max_wait_ms=200)
+    with ThreadPoolExecutor(8) as pool:
+        outputs = list(pool.map(lambda q: dispatcher.search(q, return_score=True), QUERIES))
+    dispatcher.close()
+
+    assert [docs for docs, _ in outputs] == expected
+    assert [scores for _, scores in outputs] == expected_scores
+    stats = dispatcher.stats()
+    assert stats["queries"] == 8
+    assert stats["batches"] < 8
+    assert max(stats["batch_size_histogram"]) <= 4
+
+
+def test_async_search_num_groups_and_attribute_forwarding():
+    expected = build_fake_retriever().batch_search(QUERIES)
+    retriever = build_fake_retriever()
+    dispatcher = RetrievalDispatcher(retriever, max_wait_ms=50)
+
+    async def search_all():
+        return await asyncio.gather(*[dispatcher.asearch(q, num=2) for q in QUERIES[:3]])
+
+    assert asyncio.run(search_all()) == [docs[:2] for docs in expected[:3]]
+    assert dispatcher.batch_search(QUERIES[:2], num=1) == [docs[:1] for docs in expected[:2]]
+    assert dispatcher.topk == retriever.topk
+    dispatcher.close()
+
+
+def test_search_errors_reach_every_caller():
+    retriever = build_fake_retriever()
+
+    def failing_batch_search(query, num=None, return_score=False):
+        raise ValueError("index unavailable")
+
+    retriever.batch_search = failing_batch_search
+    dispatcher = RetrievalDispatcher(retriever, max_wait_ms=50)
+    futures = [dispatcher.submit(q) for q in QUERIES[:2]]
+    assert all(isinstance(future.exception(timeout=5), ValueError) for future in futures)
+    dispatcher.close()
+
+
+def test_request_racing_close_is_searched(monkeypatch):
+    class SlowQueue(queue.Queue):
+        """Widens the gap between the closed check in submit() and the request reaching the queue."""
+
+        def put(self, item, *args, **kwargs):
+            if item is not None:
+                time.sleep(0.2)
+            super().put(item, *args, **kwargs)
+
+    monkeypatch.setattr(dispatcher_module, "queue", SimpleNamespace(Queue=SlowQueue, Empty=queue.Empty))
+    dispatcher = RetrievalDispatcher(build_fake_retriever(), max_wait_ms=1)
+    futures = []
+    submitter = threading.Thread(target=lambda: futures.append(dispatcher.submit(QUERIES[0])))
+    submitter.start()
+    time.sleep(0.05)
+    dispatcher.close()
+    submitter.join()
+
+    # the request accepted before close is searched instead of being queued behind the stop sentinel
+    assert len(futures[0].result(timeout=2)[0]) == 3
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(QUERIES[0])
@@ -0,0 +1,39 @@
+import json
+
+from flashrag.retriever.doc_store import build_doc_store, is_doc_store
+from flashrag.retriever.utils import load_corpus, load_docs
+
+ITEMS = [
+    {"id": "a", "contents": '"France"\nParis is the capital.'},
+    {"id": "b", "contents": '"北京"\n北京是中国的首都。\n第二段。'},
+    {"id": "c", "contents": "no title line"},
+]
+
+
+def build_store(tmp_path):
+    corpus_path = tmp_path / "corpus.jsonl"
+    with open(corpus_path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(item, ensure_ascii=False) + "\n" for item in ITEMS)
+    store_path = str(tmp_path / "doc_store")
+    build_doc_store(str(corpus_path), store_path)
+    return store_path
+
+
+def test_take_matches_jsonl_corpus(tmp_path):
+    store_path = build_store(tmp_path)
+    assert is_doc_store(store_path)
+
+    store = load_corpus(store_path)
+    docs = store.take([2, 0, 1, -1])
+    assert [doc["id"] for doc in docs] == ["c", "a", "b", "c"]
+    assert docs[2] == {"id": "b", "contents": ITEMS[1]["contents"], "title": "北京", "text": "北京是中国的首都。\n第二段。"}
+    assert docs[1]["title"] == "France"
+    assert docs[0]["text"] == ""
+    assert [doc["contents"] for doc in store] == [item["contents"] for item in ITEMS]
+
+
+def test_take_selected_fields(tmp_path):
+    store = load_corpus(build_store(tmp_path))
+    assert store.take([1], fields=["id"]) == [{"id": "b"}]
+    assert load_docs(store, [0, 1]) == store.take([0, 1])
+    assert list(store) == store.take([0, 1, 2])
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from flashrag.retriever.embedding_cache import EmbeddingCache
+from flashrag.retriever.encoder import dedup_encode
+
+
+def test_dedup_encode_only_encodes_misses():
+    encoded = []
+
+    def encode_fn(texts):
+        encoded.extend(texts)
+        return np.array([[len(text), text.count("a")] for text in texts], dtype=np.float32)
+
+    cache = EmbeddingCache(max_size=2)
+    emb = dedup_encode(["aa", "b", "aa"], True, encode_fn, cache)
+    assert encoded == ["aa", "b"]
+    assert emb.tolist() == [[2, 2], [1, 0], [2, 2]]
+
+    dedup_encode(["aa", "ccc"], True, encode_fn, cache)
+    assert encoded == ["aa", "b", "ccc"]
+    assert cache.hits == 1 and cache.misses == 3
+    # "b" is the least recently used entry once the cache is full; query and document embeddings are separate
+    assert cache.get_many(["b", "aa"], True)[0] is None
+    assert cache.get_many(["aa"], False) == [None]
+
+
+def test_persistent_cache_is_reused_per_namespace(tmp_path):
+    EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="e5\tmean").put_many(
+        ["aa", "b"], True, np.array([[1, 2], [3, 4]], dtype=np.float32)
+    )
+    reloaded = EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="e5\tmean")
+    assert [emb.tolist() for emb in reloaded.get_many(["b", "aa"], True)] == [[3, 4], [1, 2]]
+
+    other = EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="bge\tcls")
+    assert other.get_many(["aa"], True) == [None]
+
+
+def test_persistent_cache_keeps_float32_unless_float16_is_requested(tmp_path):
+    embeddings = np.random.default_rng(0).standard_normal((2, 8)).astype(np.float32)
+
+    EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="exact").put_many(["a", "b"], True, embeddings)
+    exact = EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="exact")
+    assert np.array_equal(np.stack(exact.get_many(["a", "b"], True)), embeddings)
+
+    EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="half", dtype="float16").put_many(
+        ["a", "b"], True, embeddings
+    )
+    # an existing cache keeps the dtype it was created with
+    with pytest.warns(UserWarning, match="float16"):
+        half = EmbeddingCache(max_size=4, cache_path=str(tmp_path), namespace="half")
+    assert half.dtype == "float16"
+    cached = np.stack(half.get_many(["a", "b"], True))
+    assert cached.dtype == np.float32
+    assert np.array_equal(cached, embeddings.astype(np.float16).astype(np.float32))
+    assert not np.array_equal(cached, embeddings)
@@ -0,0 +1,49 @@
+import json
+
+import datasets
+import numpy as np
+import pytest
+
+from flashrag.retriever.index_builder import Index_Builder
+
+
+class FakeEncoder:
+    """Embeds "doc <i>" as [len, i]; raises once ``fail_after`` shards have been encoded."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.encoded = []
+
+    def encode(self, texts, batch_size=None, is_query=False):
+        if self.fail_after is not None and len(self.encoded) >= self.fail_after:
+            raise RuntimeError("encoding interrupted")
+        self.encoded.append(list(texts))
+        return np.array([[len(t), int(t.split()[-1])] for t in texts], dtype=np.float32)
+
+
+def build_index_builder(embedding_save_path, encoder, resume):
+    builder = Index_Builder.__new__(Index_Builder)
+    builder.corpus = datasets.Dataset.from_list([{"contents": f"doc {i}"} for i in range(10)])
+    builder.embedding_save_path = str(embedding_save_path)
+    builder.encoder = encoder
+    builder.batch_size = 4
+    builder.gpu_num = 1
+    builder.shard_size = 4
+    builder.resume = resume
+    return builder
+
+
+def test_resume_encodes_only_remaining_shards(tmp_path):
+    expected = np.array(build_index_builder(tmp_path / "emb_full.memmap", FakeEncoder(), resume=False).encode_all(2))
+
+    embedding_save_path = tmp_path / "emb_test.memmap"
+    with pytest.raises(RuntimeError, match="interrupted"):
+        build_index_builder(embedding_save_path, FakeEncoder(fail_after=1), resume=False).encode_all(2)
+    with open(f"{embedding_save_path}.progress.json", "r") as f:
+        assert json.load(f)["completed"] == 4
+
+    encoder = FakeEncoder()
+    resumed = build_index_builder(embedding_save_path, encoder, resume=True).encode_all(2)
+    assert encoder.encoded == [[f"doc {i}" for i in range(4, 8)], ["doc 8", "doc 9"]]
+    assert np.array_equal(np.array(resumed), expected)
+
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from flashrag.retriever.retrieval_cache import SQLiteRetrievalCache
+from tests.retriever.fakes import build_fake_retriever, doc_ids
+
+QUERIES = ["word1 common", "word2", "word5 word7"]
+
+
+@pytest.mark.parametrize("backend, cache_file", [("json", "retrieval_cache.json"), ("sqlite", "retrieval_cache.db")])
+def test_cache_hits_skip_retrieval(tmp_path, backend, cache_file):
+    os.makedirs(tmp_path / "first")
+    saving = build_fake_retriever(save_retrieval_cache=True, save_dir=str(tmp_path / "first"), retrieval_cache_backend=backend)
+    expected, expected_scores = saving.batch_search(QUERIES, return_score=True)
+    saving._save_cache()
+
+    cached = build_fake_retriever(
+        use_retrieval_cache=True,
+        save_retrieval_cache=True,
+        save_dir=str(tmp_path),
+        retrieval_cache_path=str(tmp_path / "first" / cache_file),
+        retrieval_cache_backend=backend,
+    )
+    results, scores = cached.batch_search(QUERIES + ["word9"], return_score=True)
+    assert cached.searched == ["word9"]
+    assert doc_ids(results[:3]) == doc_ids(expected)
+    assert scores[:3] == expected_scores
+    assert cached.search("word2")[0]["id"] == expected[1][0]["id"]
+    assert cached.searched == ["word9"]
+
+
+def test_sqlite_cache_depth(tmp_path):
+    cached = build_fake_retriever(
+        use_retrieval_cache=True,
+        save_retrieval_cache=True,
+        save_dir=str(tmp_path),
+        retrieval_cache_path=str(tmp_path / "retrieval_cache.db"),
+        retrieval_cache_backend="sqlite",
+    )
+    cached.batch_search(["word2"], num=3)
+    cached.batch_search(["word2"], num=2)
+    assert cached.searched == ["word2"]
+    # a deeper request is searched again and replaces the shallower result
+    cached.batch_search(["word2"], num=5)
+    assert cached.searched == ["word2", "word2"]
+    assert len(cached.cache.get("word2", 5)) == 5
+
+
+def test_sqlite_cache_returns_copies(tmp_path):
+    cache = SQLiteRetrievalCache(str(tmp_path / "retrieval_cache.db"))
+    docs = [{"id": "0", "contents": "a", "score": 1.0}, {"id": "1", "contents": "b", "score": 0.5}]
+    cache.put_many(["q"], [docs])
+    docs[0]["contents"] = "changed by the producer"
+
+    first = cache.get("q", 2)
+    first[0]["contents"] = "changed by a caller"
+    first.append({"id": "2"})
+    assert cache.get("q", 2) == [{"id": "0", "contents": "a", "score": 1.0}, {"id": "1", "contents": "b", "score": 0.5}]
+    cache.close()
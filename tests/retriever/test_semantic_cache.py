@@ -0,0 +1,66 @@
+import numpy as np
+
+from flashrag.retriever.retriever import DenseRetriever
+from flashrag.retriever.semantic_cache import SemanticCache
+from tests.retriever.fakes import FAKE_CORPUS
+
+
+def test_hits_need_threshold_and_depth():
+    cache = SemanticCache(threshold=0.95, max_size=2)
+    cache.add(np.array([[1.0, 0.0], [0.0, 1.0]]), np.array([[3, 1, 2], [5, 6, 7]]), np.array([[0.9, 0.8, 0.7]] * 2))
+
+    # cos=0.995 hits; cos=0.707 is below the threshold; 4 results are deeper than the cached 3
+    near, far = cache.lookup(np.array([[1.0, 0.1], [1.0, 1.0]]), 2)
+    (deep,) = cache.lookup(np.array([[1.0, 0.0]]), 4)
+    assert near[0].tolist() == [3, 1]
+    assert np.allclose(near[1], [0.9, 0.8])
+    assert far is None and deep is None
+    assert cache.summary()["hits"] == 1
+    assert cache.summary()["lookups"] == 3
+
+
+def test_oldest_entries_are_evicted():
+    cache = SemanticCache(threshold=0.95, max_size=2)
+    cache.add(np.array([[1.0, 0.0], [0.0, 1.0]]), np.array([[3, 1, 2], [5, 6, 7]]), np.array([[0.9, 0.8, 0.7]] * 2))
+    cache.add(np.array([[-1.0, 0.0]]), np.array([[9, 8, 7]]), np.array([[0.5, 0.4, 0.3]]))
+    assert cache.summary()["size"] == 2
+    assert cache.lookup(np.array([[1.0, 0.0]]), 1) == [None]
+    assert cache.lookup(np.array([[-1.0, 0.01]]), 1)[0][0].tolist() == [9]
+
+
+def test_similarity_stats_use_constant_memory():
+    rng = np.random.default_rng(0)
+    cache = SemanticCache(threshold=2.0)
+    cache.add(np.array([[1.0, 0.0]]), np.array([[0]]), np.array([[1.0]]))
+    angles = rng.uniform(0, np.pi / 2, size=5000)
+    for start in range(0, len(angles), 500):
+        batch = angles[start : start + 500]
+        cache.lookup(np.stack([np.cos(batch), np.sin(batch)], axis=1), 1)
+
+    assert cache.similarity_counts.shape == (SemanticCache.SIMILARITY_BINS,)
+    summary = cache.summary()
+    assert sum(summary["similarity_histogram"].values()) == 5000
+    for q in (10, 50, 90):
+        assert abs(summary["similarity_percentiles"][f"p{q}"] - np.percentile(np.cos(angles), q)) < 0.005
+
+
+def test_single_query_search_uses_semantic_cache():
+    retriever = DenseRetriever.__new__(DenseRetriever)
+    retriever.topk = 2
+    retriever.corpus = FAKE_CORPUS
+    retriever.compact_results = False
+    retriever.semantic_cache = SemanticCache(threshold=0.95)
+    retriever.encoder = type("FakeEncoder", (), {"encode": staticmethod(lambda query, **kwargs: np.array([[1.0, 0.0]]))})
+    index_searches = []
+
+    def index_search(emb, num):
+        index_searches.append(len(emb))
+        return np.array([[0.9, 0.8]], dtype=np.float32), np.array([[4, 7]])
+
+    retriever._index_search = index_search
+    first, first_scores = retriever._search("query", return_score=True)
+    second, second_scores = retriever._search("query", return_score=True)
+    assert index_searches == [1]
+    assert [doc["id"] for doc in first] == [doc["id"] for doc in second] == ["4", "7"]
+    assert np.allclose(second_scores, first_scores)
+    assert retriever.semantic_cache.summary()["hits"] == 1
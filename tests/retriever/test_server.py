@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from flashrag.retriever import RetrievalDispatcher
+from flashrag.retriever.retriever import RemoteRetriever
+from flashrag.retriever.server import build_server
+from tests.retriever.fakes import build_fake_retriever, build_retriever_config
+
+QUERIES = ["word1 common", "word2", "word5 word7"]
+
+
+@pytest.fixture
+def served_dispatcher(tmp_path):
+    """A dispatcher over the fake retriever, served on an ephemeral TCP port and on a Unix socket."""
+    dispatcher = RetrievalDispatcher(build_fake_retriever(), max_wait_ms=1)
+    unix_socket = str(tmp_path / "retriever.sock")
+    servers = [build_server(dispatcher, port=0), build_server(dispatcher, unix_socket=unix_socket)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = {"http": f"http://127.0.0.1:{servers[0].server_address[1]}", "unix": f"unix://{unix_socket}"}
+    yield dispatcher, urls
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    dispatcher.close()
+
+
+def build_remote(url):
+    return RemoteRetriever(build_retriever_config(retrieval_method="remote", retrieval_server_url=url))
+
+
+@pytest.mark.parametrize("transport", ["http", "unix"])
+def test_remote_results_match_direct_search(served_dispatcher, transport):
+    _, urls = served_dispatcher
+    direct = build_fake_retriever()
+    remote = build_remote(urls[transport])
+
+    assert remote.batch_search(QUERIES, return_score=True) == direct.batch_search(QUERIES, return_score=True)
+    assert remote.search(QUERIES[0], num=2, return_score=True) == direct.search(QUERIES[0], num=2, return_score=True)
+    assert remote.health()["topk"] == direct.topk
+
+
+def test_server_errors_are_raised_by_the_client(served_dispatcher):
+    dispatcher, urls = served_dispatcher
+
+    def failing_batch_search(query, num=None, return_score=False):
+        raise ValueError("index unavailable")
+
+    dispatcher.retriever.batch_search = failing_batch_search
+    with pytest.raises(RuntimeError, match="index unavailable"):
+        build_remote(urls["http"]).search(QUERIES[0])